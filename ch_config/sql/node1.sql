@@ -19,6 +19,12 @@ CREATE TABLE IF NOT EXISTS replica.view(
 )
 Engine=ReplicatedMergeTree('/clickhouse/tables/shard2/view', 'replica_2') PARTITION BY toYYYYMMDD(event_time) ORDER BY film_id;
 
+-- Ключ CRC32(user_id) нужен для чтения данных пользователя с одного шарда.
+-- На кластере, где таблица создана с ключом rand(), IF NOT EXISTS ее не меняет,
+-- а строки уже лежат на случайных шардах. Порядок перехода: DROP TABLE default.view
+-- и повторный CREATE ниже на node1 и node3, затем заполнение таблицы последних
+-- позиций (python main.py populate-last) или миграция на схему v2. Только после
+-- этого можно включать CLICKHOUSE_SINGLE_SHARD_READS.
 CREATE TABLE IF NOT EXISTS default.view(
     user_id String,
     film_id String,
@@ -26,4 +32,122 @@ CREATE TABLE IF NOT EXISTS default.view(
     end_time UInt16,
     event_time DateTime DEFAULT now()
 )
-Engine=Distributed('company_cluster', '', view, rand());
\ No newline at end of file
+Engine=Distributed('company_cluster', '', view, CRC32(user_id));
+
+CREATE TABLE IF NOT EXISTS shard.view_last(
+    user_id String,
+    film_id String,
+    start_time UInt16,
+    end_time UInt16,
+    event_time DateTime
+)
+Engine=ReplicatedReplacingMergeTree('/clickhouse/tables/shard1/view_last', 'replica_1', event_time) ORDER BY (user_id, film_id);
+
+CREATE TABLE IF NOT EXISTS replica.view_last(
+    user_id String,
+    film_id String,
+    start_time UInt16,
+    end_time UInt16,
+    event_time DateTime
+)
+Engine=ReplicatedReplacingMergeTree('/clickhouse/tables/shard2/view_last', 'replica_2', event_time) ORDER BY (user_id, film_id);
+
+CREATE TABLE IF NOT EXISTS default.view_last(
+    user_id String,
+    film_id String,
+    start_time UInt16,
+    end_time UInt16,
+    event_time DateTime
+)
+Engine=Distributed('company_cluster', '', view_last, CRC32(user_id));
+
+CREATE TABLE IF NOT EXISTS shard.view_sessions(
+    user_id String,
+    film_id String,
+    started_at DateTime,
+    ended_at DateTime,
+    start_time UInt16,
+    end_time UInt16,
+    watched UInt32,
+    heartbeats UInt32
+)
+Engine=ReplicatedReplacingMergeTree('/clickhouse/tables/shard1/view_sessions', 'replica_1', heartbeats) PARTITION BY toYYYYMM(started_at) ORDER BY (user_id, film_id, started_at);
+
+CREATE TABLE IF NOT EXISTS replica.view_sessions(
+    user_id String,
+    film_id String,
+    started_at DateTime,
+    ended_at DateTime,
+    start_time UInt16,
+    end_time UInt16,
+    watched UInt32,
+    heartbeats UInt32
+)
+Engine=ReplicatedReplacingMergeTree('/clickhouse/tables/shard2/view_sessions', 'replica_2', heartbeats) PARTITION BY toYYYYMM(started_at) ORDER BY (user_id, film_id, started_at);
+
+CREATE TABLE IF NOT EXISTS default.view_sessions(
+    user_id String,
+    film_id String,
+    started_at DateTime,
+    ended_at DateTime,
+    start_time UInt16,
+    end_time UInt16,
+    watched UInt32,
+    heartbeats UInt32
+)
+Engine=Distributed('company_cluster', '', view_sessions, CRC32(user_id));
+
+-- Схема v2: UUID колонки, сортировка по пользователю, партиции по месяцам
+CREATE TABLE IF NOT EXISTS shard.view_v2(
+    user_id UUID,
+    film_id UUID,
+    start_time UInt16 CODEC(T64, ZSTD(1)),
+    end_time UInt16 CODEC(T64, ZSTD(1)),
+    event_time DateTime DEFAULT now() CODEC(Delta, ZSTD(1))
+)
+Engine=ReplicatedMergeTree('/clickhouse/tables/shard1/view_v2', 'replica_1') PARTITION BY toYYYYMM(event_time) ORDER BY (user_id, film_id, event_time);
+
+CREATE TABLE IF NOT EXISTS replica.view_v2(
+    user_id UUID,
+    film_id UUID,
+    start_time UInt16 CODEC(T64, ZSTD(1)),
+    end_time UInt16 CODEC(T64, ZSTD(1)),
+    event_time DateTime DEFAULT now() CODEC(Delta, ZSTD(1))
+)
+Engine=ReplicatedMergeTree('/clickhouse/tables/shard2/view_v2', 'replica_2') PARTITION BY toYYYYMM(event_time) ORDER BY (user_id, film_id, event_time);
+
+CREATE TABLE IF NOT EXISTS default.view_v2(
+    user_id UUID,
+    film_id UUID,
+    start_time UInt16,
+    end_time UInt16,
+    event_time DateTime DEFAULT now()
+)
+Engine=Distributed('company_cluster', '', view_v2, CRC32(toString(user_id)));
+
+CREATE TABLE IF NOT EXISTS shard.view_last_v2(
+    user_id UUID,
+    film_id UUID,
+    start_time UInt16 CODEC(T64, ZSTD(1)),
+    end_time UInt16 CODEC(T64, ZSTD(1)),
+    event_time DateTime CODEC(Delta, ZSTD(1))
+)
+Engine=ReplicatedReplacingMergeTree('/clickhouse/tables/shard1/view_last_v2', 'replica_1', event_time) ORDER BY (user_id, film_id);
+
+CREATE TABLE IF NOT EXISTS replica.view_last_v2(
+    user_id UUID,
+    film_id UUID,
+    start_time UInt16 CODEC(T64, ZSTD(1)),
+    end_time UInt16 CODEC(T64, ZSTD(1)),
+    event_time DateTime CODEC(Delta, ZSTD(1))
+)
+Engine=ReplicatedReplacingMergeTree('/clickhouse/tables/shard2/view_last_v2', 'replica_2', event_time) ORDER BY (user_id, film_id);
+
+CREATE TABLE IF NOT EXISTS default.view_last_v2(
+    user_id UUID,
+    film_id UUID,
+    start_time UInt16,
+    end_time UInt16,
+    event_time DateTime
+)
+Engine=Distributed('company_cluster', '', view_last_v2, CRC32(toString(user_id)));
\ No newline at end of file
@@ -2,6 +2,7 @@
 
 sh.enableSharding("films")
 db.adminCommand({shardCollection: "films.ratings", key: {film_id: 1}})
+db.adminCommand({shardCollection: "films.rating_stats", key: {_id: 1}})
 db.adminCommand({shardCollection: "films.reviews", key: {review_id: 1}})
 db.adminCommand({shardCollection: "films.review_votes", key: {review_id: 1}})
 db.adminCommand({shardCollection: "films.bookmarks", key: {film_id: 1}})
@@ -0,0 +1,88 @@
+import os
+import signal
+from logging import getLogger
+from multiprocessing import Process
+from typing import Callable, List
+
+from extract.replay import PartitionRange
+
+
+logger = getLogger(__name__)
+
+
+def split_ranges(ranges: List[PartitionRange],
+                 workers: int) -> List[List[PartitionRange]]:
+    """Делит партиции между воркерами так, чтобы объем записей
+    у них был примерно одинаковым."""
+    groups: List[List[PartitionRange]] = [[] for _ in range(workers)]
+    sizes = [0] * workers
+    for part in sorted(ranges, key=len, reverse=True):
+        index = sizes.index(min(sizes))
+        groups[index].append(part)
+        sizes[index] += len(part)
+    return [group for group in groups if group]
+
+
+def _run_worker(target: Callable[[int, List[PartitionRange]], None],
+                index: int,
+                ranges: List[PartitionRange]) -> None:
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    target(index, ranges)
+
+
+class Backfill:
+    """Перезаливка диапазона топика: партиции делятся между процессами,
+    каждый читает свои партиции и загружает их независимо. В отличие от
+    Supervisor упавшие воркеры не перезапускаются."""
+
+    def __init__(self,
+                 target: Callable[[int, List[PartitionRange]], None],
+                 ranges: List[PartitionRange],
+                 workers: int) -> None:
+        self.target = target
+        self.ranges = [part for part in ranges if len(part)]
+        self.workers = workers or os.cpu_count() or 1
+        self._processes: List[Process] = []
+
+    def run(self) -> bool:
+        """Возвращает True, если все воркеры завершились успешно."""
+        if not self.ranges:
+            logger.info('Перезаливка: в диапазоне нет записей')
+            return True
+        groups = split_ranges(self.ranges, self.workers)
+        logger.info(
+            'Перезаливка %s записей из %s партиций, воркеров: %s',
+            sum(len(part) for part in self.ranges),
+            len(self.ranges),
+            len(groups)
+        )
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        for index, group in enumerate(groups):
+            process = Process(
+                target=_run_worker,
+                args=(self.target, index, group),
+                name=f'etl-backfill-{index}',
+            )
+            process.start()
+            self._processes.append(process)
+        try:
+            for process in self._processes:
+                process.join()
+        except KeyboardInterrupt:
+            self._handle_signal(signal.SIGINT, None)
+            for process in self._processes:
+                process.join()
+        failed = [
+            process.name for process in self._processes if process.exitcode
+        ]
+        if failed:
+            logger.error('Перезаливка не завершена, упали воркеры: %s',
+                         ', '.join(failed))
+        return not failed
+
+    def _handle_signal(self, signum, frame) -> None:
+        logger.info('Получен сигнал %s, остановка перезаливки', signum)
+        for process in self._processes:
+            if process.is_alive():
+                process.terminate()
@@ -0,0 +1,97 @@
+"""Сравнение скорости декодирования пачки сообщений Kafka.
+
+Запуск: python src/benchmark.py [число записей] [число повторов]
+"""
+import sys
+from datetime import datetime, timedelta
+from random import randint
+from time import perf_counter
+from typing import Callable, List
+from uuid import uuid4
+
+import orjson
+
+from extract.codec import MARKER, VERSION, VIEW_V1
+from extract.decoder import decode_views
+from extract.schema import KafkaData
+from transform.base import Transformer
+
+TRANSFORMER = Transformer()
+
+
+def make_values(count: int) -> List[bytes]:
+    now = datetime.utcnow()
+    return [
+        orjson.dumps({
+            'user_id': str(uuid4()),
+            'film_id': str(uuid4()),
+            'start_time': randint(0, 7200),
+            'end_time': randint(0, 7200),
+            'timestamp': (now - timedelta(seconds=i)).isoformat(),
+        })
+        for i in range(count)
+    ]
+
+
+def to_binary(values: List[bytes]) -> List[bytes]:
+    result = []
+    for value in values:
+        data = KafkaData(**orjson.loads(value))
+        result.append(VIEW_V1.pack(
+            MARKER,
+            VERSION,
+            data.user_id.bytes,
+            data.film_id.bytes,
+            data.start_time,
+            data.end_time,
+            int(data.timestamp.timestamp() * 1000),
+        ))
+    return result
+
+
+def decode_with_models(values: List[bytes]) -> list:
+    """Прежний путь: orjson.loads и модель KafkaData на каждую запись,
+    затем сборка колонок в Transformer."""
+    rows = [KafkaData(**orjson.loads(value)) for value in values]
+    return [
+        [str(row.user_id) for row in rows],
+        [str(row.film_id) for row in rows],
+        [row.start_time for row in rows],
+        [row.end_time for row in rows],
+        [row.timestamp.replace(tzinfo=None, microsecond=0) for row in rows],
+    ]
+
+
+def decode_with_columns(values: List[bytes]) -> list:
+    """Новый путь до тех же готовых к вставке колонок: decode_views
+    и преобразование буфера в Transformer."""
+    columns, _ = decode_views(values)
+    return TRANSFORMER.columns_to_clickhouse(columns, 'default.view').columns
+
+
+def measure(func: Callable, values: List[bytes], repeats: int) -> float:
+    start = perf_counter()
+    for _ in range(repeats):
+        func(values)
+    return (perf_counter() - start) / repeats
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    values = make_values(count)
+    binary = to_binary(values)
+
+    for name, func, data in (
+        ('KafkaData на запись', decode_with_models, values),
+        ('Колоночный буфер', decode_with_columns, values),
+        ('Бинарный формат', decode_with_columns, binary),
+    ):
+        elapsed = measure(func, data, repeats)
+        size = sum(len(value) for value in data) / count
+        print(f'{name:<22} {elapsed * 1000:8.1f} мс, '
+              f'{count / elapsed:10.0f} записей/с, {size:5.0f} байт/запись')
+
+
+if __name__ == '__main__':
+    main()
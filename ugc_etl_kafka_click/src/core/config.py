@@ -1,4 +1,5 @@
 import os
+from typing import List, Literal, Optional
 from pydantic import BaseSettings
 from logging import getLogger, basicConfig
 
@@ -11,14 +12,80 @@ class Settings(BaseSettings):
     kafka_topic: str
     kafka_server: str
     kafka_groupid: str
+    # Топик для записей неверного формата, без него они только считаются
+    kafka_dead_letter_topic: Optional[str] = None
+    # Сколько ждать подтверждения записи в dead letter топик, секунды
+    kafka_dead_letter_timeout: float = 30
+    # Как часто писать в лог сводку по отклоненным записям, секунды
+    reject_stats_interval: float = 60
     clickhouse_host: str
     clickhouse_tablename: str
+    # distributed - вставка в Distributed таблицу, shards - напрямую в шарды
+    clickhouse_insert_mode: Literal['distributed', 'shards'] = 'distributed'
+    clickhouse_cluster: str = 'company_cluster'
+    clickhouse_local_table: str = 'view'
+    # Шарды в виде host:port/database, по умолчанию из system.clusters
+    clickhouse_shards: List[str] = []
+    # Версия схемы таблиц просмотров: v1 - исходная, v2 - UUID колонки и
+    # сортировка по пользователю, таблицы с суффиксом _v2
+    clickhouse_schema_version: Literal['v1', 'v2'] = 'v1'
+    # Передавать insert_deduplication_token при вставке, нужен ClickHouse 22.2+
+    clickhouse_dedup_token: bool = False
+    # Таблица с последними загруженными оффсетами, пустое значение - не вести
+    clickhouse_offsets_table: Optional[str] = 'default.etl_offsets'
+    # Таблица последних позиций просмотра, пустое значение - не вести
+    clickhouse_last_position_table: Optional[str] = 'default.view_last'
+    clickhouse_last_position_local_table: str = 'view_last'
+    # Таблица сессий просмотра, пустое значение - сессии не строятся
+    clickhouse_sessions_table: Optional[str] = None
+    clickhouse_sessions_local_table: str = 'view_sessions'
+    # Загружать ли сырые отметки в clickhouse_tablename
+    clickhouse_raw_views: bool = True
+    # Разрыв по времени и позиции, после которого начинается новая сессия
+    sessions_gap: int = 60
+    # Задержка водяного знака для опоздавших отметок, секунды
+    sessions_lateness: int = 300
+    # Сжатие блоков при вставке по нативному протоколу: lz4, lz4hc, zstd
+    clickhouse_compression: Optional[str] = 'lz4'
     backoff_max_time: float
-    sleep_interval: int
+    # Максимальное число записей за один poll
+    kafka_max_poll_records: int = 10000
+    # Пороги сброса пачки в ClickHouse: строки, байты, секунды
+    batch_max_rows: int = 100000
+    batch_max_bytes: int = 32 * 1024 * 1024
+    batch_max_age: float = 10
+    # Емкость очередей между стадиями extract/transform/load, в пачках
+    pipeline_queue_size: int = 2
+    # Каталог спула на время недоступности ClickHouse, без него спул выключен
+    spool_dir: Optional[str] = None
+    spool_segment_max_bytes: int = 64 * 1024 * 1024
+    # Предельный размер спула: при его достижении чтение из Kafka
+    # приостанавливается, пока спул не будет загружен
+    spool_max_bytes: int = 1024 * 1024 * 1024
+    spool_drain_interval: float = 10
+    # Порт HTTP эндпоинта с метриками Prometheus, у воркера N - порт + N
+    metrics_port: Optional[int] = 8001
+    # Размеры выборок консьюмера при перезаливке, байты
+    backfill_fetch_min_bytes: int = 1024 * 1024
+    backfill_fetch_max_bytes: int = 64 * 1024 * 1024
+    backfill_max_partition_fetch_bytes: int = 16 * 1024 * 1024
+    # Число процессов перезаливки, 0 - по числу CPU
+    backfill_workers: int = 0
+    # Число процессов ETL в группе консьюмеров, 0 - по числу партиций топика
+    etl_workers: int = 1
+    supervisor_restart_delay: float = 5
+    supervisor_stats_interval: float = 30
 
     class Config:
         env_file = ENV_FILE_PATH
 
+    def table(self, name: str, version: Optional[str] = None) -> str:
+        """Имя таблицы просмотров в версии схемы, по умолчанию выбранной."""
+        version = version or self.clickhouse_schema_version
+        if not name or version == 'v1':
+            return name
+        return f'{name}_{version}'
+
 
 settings = Settings()
 
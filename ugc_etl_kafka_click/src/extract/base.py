@@ -1,28 +1,63 @@
 from logging import getLogger
-from typing import Generator, Optional
-from kafka import KafkaConsumer, errors
-from .schema import KafkaData, KafkaBulkData
+from queue import Empty, Queue
+from threading import Event
+from typing import Dict, Generator, List, Optional, Tuple
+from kafka import KafkaConsumer, TopicPartition, errors
+from kafka.consumer.fetcher import ConsumerRecord
+from kafka.structs import OffsetAndMetadata
+from .batch import Batch, BatchPolicy
+from .decoder import decode_views
+from .rejects import RejectedRecords
+from load.offsets import OffsetStore
+from .schema import KafkaBulkData
 from core.config import settings
-import orjson
+from metrics import BYTES, CONSUMER_LAG, STAGE_SECONDS
 import backoff
 
 
 logger = getLogger(__name__)
 
+# Максимальное время ожидания одного poll, секунды
+POLL_TIMEOUT = 1.0
+
 
 class KafkaExtractor:
-    def __init__(self, topic: str, server: str, group_id: str) -> None:
+    def __init__(self,
+                 topic: str,
+                 server: str,
+                 group_id: Optional[str],
+                 policy: BatchPolicy,
+                 dead_letter_topic: Optional[str] = None,
+                 offset_store: Optional[OffsetStore] = None) -> None:
         self.topic = topic
         self.server = server
         self.group_id = group_id
+        self.policy = policy
+        self.offset_store = offset_store
+        # partition -> последний оффсет, уже загруженный в ClickHouse
+        self._high_water: Dict[int, int] = {}
+        self.rejects = RejectedRecords(
+            server,
+            dead_letter_topic,
+            settings.reject_stats_interval,
+            settings.kafka_dead_letter_timeout
+        )
         self._consumer = None
+        self._loaded: Queue = Queue()
+        self.stopped = Event()
+        # partition -> отставание консьюмера по данным последнего poll
+        self.lag: Dict[int, int] = {}
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         try:
+            self.rejects.close()
+            if self.offset_store:
+                self.offset_store.close()
             if self._consumer:
+                self._commit_loaded()
                 self._consumer.close(autocommit=False)
         except Exception:
             logger.exception(
@@ -41,7 +76,6 @@ class KafkaExtractor:
                 bootstrap_servers=[self.server],
                 auto_offset_reset='earliest',
                 group_id=self.group_id,
-                value_deserializer=orjson.loads,
                 enable_auto_commit=False,
                 consumer_timeout_ms=1000
             )
@@ -50,23 +84,133 @@ class KafkaExtractor:
     @backoff.on_exception(backoff.expo,
                           (errors.NoBrokersAvailable, ConnectionRefusedError),
                           max_time=settings.backoff_max_time)
-    def get_updates(self) -> Generator[Optional[KafkaBulkData], None, None]:
-        while True:
-            result = KafkaBulkData(payload=[])
+    def get_updates(self) -> Generator[KafkaBulkData, None, None]:
+        batch = Batch(self.topic)
+        while not self.stopped.is_set():
+            self._commit_loaded()
+            self._add(batch, self._poll(batch))
+            if self.policy.is_ready(batch):
+                yield batch.data
+                batch = Batch(self.topic)
+
+    def _poll(self, batch: Batch) -> List[ConsumerRecord]:
+        timeout = min(self.policy.time_left(batch), POLL_TIMEOUT)
+        with STAGE_SECONDS.labels('poll').time():
             response = self.consumer.poll(
-                timeout_ms=1000,
-                max_records=10000
+                timeout_ms=int(timeout * 1000),
+                max_records=min(
+                    self.policy.rows_left(batch),
+                    settings.kafka_max_poll_records
+                )
             )
-            for records in response.values():
+        self._update_lag()
+        return [
+            record
+            for partition_records in response.values()
+            for record in partition_records
+        ]
+
+    def _add(self, batch: Batch, records: List[ConsumerRecord]) -> None:
+        fresh = self._skip_loaded(records)
+        columns, rejected = decode_views([record.value for record in fresh])
+        self.rejects.handle(
+            [(fresh[index], reason) for index, reason in rejected]
+        )
+        self.rejects.report()
+        # У пустых сообщений размер равен -1
+        BYTES.inc(sum(
+            max(record.serialized_value_size, 0) for record in records
+        ))
+        batch.add(columns, records)
+
+    def _update_lag(self) -> None:
+        lag = {}
+        for partition in self.consumer.assignment():
+            highwater = self.consumer.highwater(partition)
+            if highwater is not None:
+                lag[partition.partition] = \
+                    highwater - self.consumer.position(partition)
+        for partition in self.lag.keys() - lag.keys():
+            CONSUMER_LAG.remove(str(partition))
+        for partition, value in lag.items():
+            CONSUMER_LAG.labels(str(partition)).set(value)
+        self.lag = lag
+
+    def stop(self) -> None:
+        """Завершает get_updates после текущего poll."""
+        self.stopped.set()
+
+    def _skip_loaded(
+        self,
+        records: List[ConsumerRecord]
+    ) -> List[ConsumerRecord]:
+        """Отбрасывает записи, которые уже есть в ClickHouse, но чьи
+        оффсеты не успели зафиксироваться в Kafka."""
+        if not self.offset_store or not records:
+            return records
+        if any(r.partition not in self._high_water for r in records):
+            stored = self.offset_store.get(self.topic)
+            # Без ответа хранилища ничего не запоминаем, запросим еще раз
+            # со следующим poll
+            if stored is not None:
                 for record in records:
-                    try:
-                        kafka_data = KafkaData(**record.value)
-                    except Exception:
-                        logger.warning(
-                            'Пропуск записи %s. Неверный формат',
-                            record.value
-                        )
-                    else:
-                        result.payload.append(kafka_data)
-            yield result
-            self.consumer.commit()
+                    stored.setdefault(record.partition, -1)
+                for partition, offset in stored.items():
+                    self._high_water[partition] = max(
+                        self._high_water.get(partition, -1),
+                        offset
+                    )
+        high_water = self._high_water
+        fresh = [
+            r for r in records if r.offset > high_water.get(r.partition, -1)
+        ]
+        if len(fresh) < len(records):
+            logger.info(
+                'Пропущено уже загруженных записей: %s',
+                len(records) - len(fresh)
+            )
+        return fresh
+
+    def mark_loaded(self,
+                    batch: KafkaBulkData,
+                    stored: bool = True) -> None:
+        """Отмечает пачку как загруженную. Может вызываться из любого потока,
+        сами оффсеты фиксируются потоком консьюмера перед следующим poll.
+        stored=False - пачка не попала в ClickHouse (например, ушла в спул),
+        поэтому отметка о загруженных оффсетах не обновляется."""
+        if stored and self.offset_store and batch.offsets:
+            offsets = {
+                partition: last
+                for partition, (_, last) in batch.offsets.items()
+            }
+            self.offset_store.save(self.topic, offsets)
+            for partition, last in offsets.items():
+                self._high_water[partition] = max(
+                    self._high_water.get(partition, -1),
+                    last
+                )
+        self._loaded.put(batch.offsets)
+
+    def _commit_loaded(self) -> None:
+        offsets: Dict[int, int] = {}
+        while True:
+            try:
+                batch_offsets: Dict[int, Tuple[int, int]] = \
+                    self._loaded.get_nowait()
+            except Empty:
+                break
+            for partition, (_, last) in batch_offsets.items():
+                offsets[partition] = max(offsets.get(partition, last), last)
+        if not offsets:
+            return
+        try:
+            self.consumer.commit({
+                TopicPartition(self.topic, partition):
+                    OffsetAndMetadata(offset + 1, None)
+                for partition, offset in offsets.items()
+            })
+        except errors.CommitFailedError:
+            logger.warning(
+                'Не удалось зафиксировать оффсеты %s, группа перебалансирована',
+                offsets
+            )
@@ -0,0 +1,64 @@
+from time import monotonic
+from typing import List, Optional
+
+from kafka.consumer.fetcher import ConsumerRecord
+
+from .schema import KafkaBulkData, ViewColumns
+
+
+class Batch:
+    """Пачка записей, накопленная за один или несколько poll."""
+
+    def __init__(self, topic: str) -> None:
+        self.data = KafkaBulkData(payload=ViewColumns(), topic=topic)
+        self.size = 0
+        self.started: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self.data.payload)
+
+    @property
+    def age(self) -> float:
+        if self.started is None:
+            return 0.0
+        return monotonic() - self.started
+
+    def add(self, columns: ViewColumns, records: List[ConsumerRecord]) -> None:
+        if self.started is None and len(columns):
+            self.started = monotonic()
+        self.data.payload.extend(columns)
+        offsets = self.data.offsets
+        for record in records:
+            self.size += record.serialized_value_size
+            first, _ = offsets.get(
+                record.partition,
+                (record.offset, record.offset)
+            )
+            offsets[record.partition] = (first, record.offset)
+
+
+class BatchPolicy:
+    """Пачка сбрасывается по первому достигнутому порогу: число строк,
+    объем сообщений в байтах или возраст первой записи в секундах."""
+
+    def __init__(self, max_rows: int, max_bytes: int, max_age: float) -> None:
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def is_ready(self, batch: Batch) -> bool:
+        if not len(batch):
+            return False
+        return any((
+            len(batch) >= self.max_rows,
+            batch.size >= self.max_bytes,
+            batch.age >= self.max_age,
+        ))
+
+    def rows_left(self, batch: Batch) -> int:
+        return max(self.max_rows - len(batch), 1)
+
+    def time_left(self, batch: Batch) -> float:
+        if not len(batch):
+            return self.max_age
+        return max(self.max_age - batch.age, 0.0)
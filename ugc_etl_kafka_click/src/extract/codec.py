@@ -0,0 +1,35 @@
+import struct
+from array import array
+from typing import Optional, Sequence
+
+from .schema import ViewColumns
+
+# Бинарный формат события просмотра, версия 1: маркер 0x00 (JSON с него
+# не начинается), версия, user_id и film_id по 16 байт, start_time
+# и end_time UInt16, время события в миллисекундах Int64, little-endian.
+# Кодировщик - в ugc_service/src/db/codecs.py, форматы совпадают
+VIEW_V1 = struct.Struct('<BB16s16sHHq')
+MARKER = 0
+VERSION = 1
+
+
+def is_binary(value: Optional[bytes]) -> bool:
+    return isinstance(value, bytes) and value[:1] == b'\x00'
+
+
+def decode_binary(values: Sequence[bytes]) -> ViewColumns:
+    """Декодирует записи фиксированной длины одним проходом по общему
+    буферу. Любая некорректная запись - исключение для всей пачки."""
+    blob = b''.join(values)
+    if len(blob) != VIEW_V1.size * len(values):
+        raise ValueError('Неверная длина бинарной записи')
+    rows = list(VIEW_V1.iter_unpack(blob))
+    if any(row[1] != VERSION for row in rows):
+        raise ValueError('Неподдерживаемая версия бинарного формата')
+    columns = ViewColumns()
+    columns.user_id = bytearray(b''.join(row[2] for row in rows))
+    columns.film_id = bytearray(b''.join(row[3] for row in rows))
+    columns.start_time = array('H', [row[4] for row in rows])
+    columns.end_time = array('H', [row[5] for row in rows])
+    columns.event_time = array('q', [row[6] // 1000 for row in rows])
+    return columns
@@ -0,0 +1,164 @@
+from array import array
+from datetime import datetime, timezone
+from typing import List, Optional, Sequence, Tuple
+
+import orjson
+from pydantic import ValidationError
+
+from .codec import decode_binary, is_binary
+from .schema import KafkaData, ViewColumns
+
+
+def decode_views(
+    values: Sequence[Optional[bytes]]
+) -> Tuple[ViewColumns, List[Tuple[int, str]]]:
+    """Декодирует сообщения одного poll в колоночный буфер.
+
+    Возвращает буфер и список отклоненных записей (индекс, причина).
+    Сообщения в JSON и в бинарном формате могут идти вперемешку, каждая
+    группа разбирается за один проход, и только если в ней есть
+    некорректные записи, сообщения проверяются по одному. Сообщения
+    без значения (tombstone) отклоняются.
+    """
+    if not values:
+        return ViewColumns(), []
+    present = [
+        index for index, value in enumerate(values)
+        if isinstance(value, bytes)
+    ]
+    payloads = [value for value in values if isinstance(value, bytes)]
+    if len(payloads) == len(values):
+        return _decode_mixed(payloads)
+    columns, rejected = _decode_mixed(payloads)
+    present_set = set(present)
+    tombstones = [
+        (index, 'tombstone')
+        for index in range(len(values)) if index not in present_set
+    ]
+    invalid = [(present[index], reason) for index, reason in rejected]
+    return columns, sorted(invalid + tombstones)
+
+
+def _decode_mixed(
+    values: Sequence[bytes]
+) -> Tuple[ViewColumns, List[Tuple[int, str]]]:
+    if not values:
+        return ViewColumns(), []
+    binary = [index for index, value in enumerate(values) if is_binary(value)]
+    if not binary:
+        return _decode_json(values)
+    if len(binary) == len(values):
+        return _decode_binary(values)
+    # Во время перехода на бинарный формат топик содержит оба формата
+    binary_set = set(binary)
+    text = [index for index in range(len(values)) if index not in binary_set]
+    columns, rejected = _decode_json([values[index] for index in text])
+    binary_columns, binary_rejected = _decode_binary(
+        [values[index] for index in binary]
+    )
+    columns.extend(binary_columns)
+    invalid = [(text[index], reason) for index, reason in rejected]
+    invalid.extend(
+        (binary[index], reason) for index, reason in binary_rejected
+    )
+    return columns, sorted(invalid)
+
+
+def _decode_json(
+    values: Sequence[bytes]
+) -> Tuple[ViewColumns, List[Tuple[int, str]]]:
+    try:
+        return _decode_bulk(values), []
+    except Exception:
+        return _decode_each(values)
+
+
+def _decode_binary(
+    values: Sequence[bytes]
+) -> Tuple[ViewColumns, List[Tuple[int, str]]]:
+    try:
+        return decode_binary(values), []
+    except Exception:
+        pass
+    columns = ViewColumns()
+    rejected = []
+    for index, value in enumerate(values):
+        try:
+            columns.extend(decode_binary([value]))
+        except Exception:
+            rejected.append((index, 'invalid_binary'))
+    return columns, rejected
+
+
+def _decode_bulk(values: Sequence[bytes]) -> ViewColumns:
+    rows = orjson.loads(b'[' + b','.join(values) + b']')
+    if len(rows) != len(values):
+        raise ValueError('Количество объектов не совпадает с числом записей')
+    columns = ViewColumns()
+    columns.user_id = _uuids_to_bytes([row['user_id'] for row in rows])
+    columns.film_id = _uuids_to_bytes([row['film_id'] for row in rows])
+    # array('H') сам проверяет тип и диапазон UInt16
+    columns.start_time = array('H', [row['start_time'] for row in rows])
+    columns.end_time = array('H', [row['end_time'] for row in rows])
+    columns.event_time = array(
+        'q',
+        [_to_epoch(datetime.fromisoformat(row['timestamp'])) for row in rows]
+    )
+    return columns
+
+
+def _decode_each(
+    values: Sequence[bytes]
+) -> Tuple[ViewColumns, List[Tuple[int, str]]]:
+    columns = ViewColumns()
+    rejected = []
+    for index, value in enumerate(values):
+        try:
+            columns.extend(_decode_bulk([value]))
+            continue
+        except Exception:
+            pass
+        try:
+            columns.extend(_decode_slow(value))
+        except Exception as exc:
+            rejected.append((index, _reason(exc)))
+    return columns, rejected
+
+
+def _decode_slow(value: bytes) -> ViewColumns:
+    data = KafkaData(**orjson.loads(value))
+    columns = ViewColumns()
+    columns.start_time.append(data.start_time)
+    columns.end_time.append(data.end_time)
+    columns.event_time.append(_to_epoch(data.timestamp))
+    columns.user_id += data.user_id.bytes
+    columns.film_id += data.film_id.bytes
+    return columns
+
+
+def _uuids_to_bytes(uuids: List[str]) -> bytearray:
+    for uuid in uuids:
+        if type(uuid) is not str or len(uuid) != 36:
+            raise ValueError('UUID не в каноническом виде')
+    raw = bytearray.fromhex(''.join(uuids).replace('-', ''))
+    if len(raw) != 16 * len(uuids):
+        raise ValueError('UUID не в каноническом виде')
+    return raw
+
+
+def _to_epoch(value: datetime) -> int:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+
+def _reason(exc: Exception) -> str:
+    if isinstance(exc, orjson.JSONDecodeError):
+        return 'invalid_json'
+    if isinstance(exc, ValidationError):
+        return 'invalid_' + '_'.join(
+            str(loc) for loc in exc.errors()[0]['loc']
+        )
+    if isinstance(exc, OverflowError):
+        return 'out_of_range'
+    return 'invalid_format'
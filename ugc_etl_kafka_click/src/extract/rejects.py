@@ -0,0 +1,104 @@
+from collections import Counter
+from logging import getLogger
+from time import monotonic
+from typing import List, Optional, Tuple
+
+import backoff
+from kafka import KafkaProducer, errors
+from kafka.consumer.fetcher import ConsumerRecord
+
+from core.config import settings
+from metrics import REJECTED
+
+
+logger = getLogger(__name__)
+
+
+class RejectedRecords:
+    """Отклоненные записи отправляются пачкой в dead letter топик вместе
+    с причиной, а в лог раз в report_interval секунд пишется сводка
+    по причинам вместо сообщения на каждую запись."""
+
+    def __init__(self,
+                 server: str,
+                 topic: Optional[str],
+                 report_interval: float,
+                 send_timeout: float = 30) -> None:
+        self.server = server
+        self.topic = topic
+        self.report_interval = report_interval
+        self.send_timeout = send_timeout
+        self.counters: Counter = Counter()
+        self._producer: Optional[KafkaProducer] = None
+        self._window: Counter = Counter()
+        self._reported = monotonic()
+
+    def close(self) -> None:
+        self.report(force=True)
+        if self._producer:
+            self._producer.close()
+
+    @property
+    @backoff.on_exception(backoff.expo,
+                          (errors.NoBrokersAvailable, ConnectionRefusedError),
+                          max_time=settings.backoff_max_time)
+    def producer(self) -> KafkaProducer:
+        if not self._producer:
+            self._producer = KafkaProducer(
+                bootstrap_servers=[self.server],
+                linger_ms=100,
+            )
+        return self._producer
+
+    def handle(self, rejected: List[Tuple[ConsumerRecord, str]]) -> None:
+        if not rejected:
+            return
+        for _, reason in rejected:
+            self._window[reason] += 1
+            self.counters[reason] += 1
+            REJECTED.labels(reason).inc()
+        if self.topic:
+            self._send(rejected)
+
+    def report(self, force: bool = False) -> None:
+        elapsed = monotonic() - self._reported
+        if not force and elapsed < self.report_interval:
+            return
+        if self._window:
+            logger.warning(
+                'Отклонено записей за %.0f с: %s',
+                elapsed,
+                dict(self._window)
+            )
+        self._window.clear()
+        self._reported = monotonic()
+
+    def _send(self, rejected: List[Tuple[ConsumerRecord, str]]) -> None:
+        """Бросает KafkaError, если хоть одна запись не доставлена: тогда
+        пачка не загружается и ее оффсеты не фиксируются."""
+        futures = [
+            self.producer.send(
+                self.topic,
+                value=record.value,
+                key=record.key,
+                headers=[
+                    ('error', reason.encode()),
+                    ('source_topic', record.topic.encode()),
+                    ('source_partition', str(record.partition).encode()),
+                    ('source_offset', str(record.offset).encode()),
+                ],
+            )
+            for record, reason in rejected
+        ]
+        # Оффсеты фиксируются только после того, как брак сохранен
+        self.producer.flush(timeout=self.send_timeout)
+        try:
+            for future in futures:
+                future.get(timeout=self.send_timeout)
+        except errors.KafkaError:
+            logger.exception(
+                'Не удалось сохранить %s отклоненных записей в топик %s',
+                len(rejected),
+                self.topic
+            )
+            raise
@@ -0,0 +1,209 @@
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from logging import getLogger
+from typing import Dict, Generator, List, Optional, Union
+
+import backoff
+from kafka import KafkaConsumer, TopicPartition, errors
+
+from core.config import settings
+from metrics import CONSUMER_LAG
+
+from .base import KafkaExtractor
+from .batch import Batch, BatchPolicy
+from .schema import KafkaBulkData
+
+
+logger = getLogger(__name__)
+
+# Граница диапазона: время сообщения или оффсет, одинаковый для всех партиций
+Bound = Union[datetime, int]
+
+
+@dataclass
+class PartitionRange:
+    partition: int
+    # Первый оффсет диапазона
+    start: int
+    # Оффсет, следующий за последним, не включается в диапазон
+    end: int
+
+    def __len__(self) -> int:
+        return max(self.end - self.start, 0)
+
+
+def parse_bound(value: str) -> Bound:
+    """Оффсет, если значение целое, иначе время в формате ISO 8601.
+    Время без часового пояса считается UTC."""
+    if value.isdigit():
+        return int(value)
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment
+
+
+def create_consumer(server: str) -> KafkaConsumer:
+    """Консьюмер вне группы: читает назначенные партиции и не фиксирует
+    оффсеты, поэтому не влияет на основную группу ETL."""
+    return KafkaConsumer(
+        bootstrap_servers=[server],
+        group_id=None,
+        enable_auto_commit=False,
+        fetch_min_bytes=settings.backfill_fetch_min_bytes,
+        fetch_max_bytes=settings.backfill_fetch_max_bytes,
+        max_partition_fetch_bytes=settings.backfill_max_partition_fetch_bytes,
+        receive_buffer_bytes=settings.backfill_fetch_max_bytes,
+    )
+
+
+@backoff.on_exception(backoff.expo,
+                      (errors.NoBrokersAvailable, ConnectionRefusedError),
+                      max_time=settings.backoff_max_time)
+def resolve_ranges(topic: str,
+                   server: str,
+                   start: Bound,
+                   end: Optional[Bound] = None) -> List[PartitionRange]:
+    """Переводит границы в оффсеты каждой партиции. Конец диапазона
+    не дальше текущего конца партиции, чтобы загрузка завершилась."""
+    consumer = create_consumer(server)
+    try:
+        partitions = [
+            TopicPartition(topic, partition)
+            for partition in sorted(consumer.partitions_for_topic(topic) or ())
+        ]
+        if not partitions:
+            raise ValueError(f'Топик {topic} не найден')
+        beginning = consumer.beginning_offsets(partitions)
+        latest = consumer.end_offsets(partitions)
+        starts = _to_offsets(consumer, partitions, start, latest)
+        ends = latest if end is None else \
+            _to_offsets(consumer, partitions, end, latest)
+    finally:
+        consumer.close()
+    return [
+        PartitionRange(
+            partition=partition.partition,
+            start=max(starts[partition], beginning[partition]),
+            end=min(ends[partition], latest[partition]),
+        )
+        for partition in partitions
+    ]
+
+
+def _to_offsets(consumer: KafkaConsumer,
+                partitions: List[TopicPartition],
+                bound: Bound,
+                latest: Dict[TopicPartition, int]) -> Dict[TopicPartition, int]:
+    if isinstance(bound, int):
+        return {partition: bound for partition in partitions}
+    timestamp = int(bound.timestamp() * 1000)
+    found = consumer.offsets_for_times(
+        {partition: timestamp for partition in partitions}
+    )
+    # Если после этого времени сообщений нет, граница - конец партиции
+    return {
+        partition: found[partition].offset
+        if found.get(partition) else latest[partition]
+        for partition in partitions
+    }
+
+
+class ReplayExtractor(KafkaExtractor):
+    """Читает заданные диапазоны оффсетов назначенных партиций и завершает
+    get_updates, когда все диапазоны прочитаны. Оффсеты группы консьюмеров
+    не читаются и не фиксируются, отклоненные записи только считаются."""
+
+    def __init__(self,
+                 topic: str,
+                 server: str,
+                 policy: BatchPolicy,
+                 ranges: List[PartitionRange]) -> None:
+        super().__init__(topic, server, None, policy)
+        self.ranges = {
+            part.partition: part for part in ranges if len(part)
+        }
+        # Партиции, диапазон которых еще не дочитан
+        self._remaining = set(self.ranges)
+        self.rows_total = sum(len(part) for part in self.ranges.values())
+        self._loaded_offsets: Dict[int, int] = {}
+
+    @property
+    @backoff.on_exception(backoff.expo,
+                          (errors.NoBrokersAvailable, ConnectionRefusedError),
+                          max_time=settings.backoff_max_time)
+    def consumer(self) -> KafkaConsumer:
+        if not self._consumer:
+            consumer = create_consumer(self.server)
+            consumer.assign([
+                TopicPartition(self.topic, partition)
+                for partition in self.ranges
+            ])
+            for part in self.ranges.values():
+                consumer.seek(
+                    TopicPartition(self.topic, part.partition),
+                    part.start
+                )
+            self._consumer = consumer
+        return self._consumer
+
+    def get_updates(self) -> Generator[KafkaBulkData, None, None]:
+        batch = Batch(self.topic)
+        while self._remaining and not self.stopped.is_set():
+            records = [
+                record
+                for record in self._poll(batch)
+                if record.offset < self.ranges[record.partition].end
+            ]
+            self._finish_partitions()
+            self._add(batch, records)
+            if self.policy.is_ready(batch):
+                yield batch.data
+                batch = Batch(self.topic)
+        if len(batch):
+            yield batch.data
+
+    def _finish_partitions(self) -> None:
+        for partition in list(self._remaining):
+            topic_partition = TopicPartition(self.topic, partition)
+            position = self.consumer.position(topic_partition)
+            if position >= self.ranges[partition].end:
+                # Дальше конца диапазона партицию не читаем
+                self.consumer.pause(topic_partition)
+                self._remaining.discard(partition)
+
+    def _update_lag(self) -> None:
+        # Для перезаливки отставание - число записей до конца диапазона
+        lag = {
+            partition: max(
+                self.ranges[partition].end - self.consumer.position(
+                    TopicPartition(self.topic, partition)
+                ),
+                0
+            )
+            for partition in self._remaining
+        }
+        for partition in self.lag.keys() - lag.keys():
+            CONSUMER_LAG.remove(str(partition))
+        for partition, value in lag.items():
+            CONSUMER_LAG.labels(str(partition)).set(value)
+        self.lag = lag
+
+    def mark_loaded(self,
+                    batch: KafkaBulkData,
+                    stored: bool = True) -> None:
+        for partition, (_, last) in batch.offsets.items():
+            self._loaded_offsets[partition] = last
+        done = sum(
+            offset + 1 - self.ranges[partition].start
+            for partition, offset in self._loaded_offsets.items()
+        )
+        logger.info(
+            'Перезаливка: загружено %s из %s записей (%.1f%%)',
+            done,
+            self.rows_total,
+            100 * done / self.rows_total if self.rows_total else 100
+        )
+
+    def _commit_loaded(self) -> None:
+        """Оффсеты перезаливки не фиксируются."""
@@ -1,6 +1,8 @@
+from array import array
+from hashlib import sha1
 from pydantic import BaseModel
 from uuid import UUID
-from typing import List
+from typing import Dict, List, Tuple
 from datetime import datetime
 
 
@@ -12,5 +14,57 @@ class KafkaData(BaseModel):
     timestamp: datetime
 
 
+class ViewColumns:
+    """Колоночный буфер просмотров: UUID хранятся подряд по 16 байт,
+    время события - в секундах с начала эпохи."""
+
+    __slots__ = ('user_id', 'film_id', 'start_time', 'end_time', 'event_time')
+
+    def __init__(self) -> None:
+        self.user_id = bytearray()
+        self.film_id = bytearray()
+        self.start_time = array('H')
+        self.end_time = array('H')
+        self.event_time = array('q')
+
+    def __len__(self) -> int:
+        return len(self.event_time)
+
+    def extend(self, other: 'ViewColumns') -> None:
+        self.user_id += other.user_id
+        self.film_id += other.film_id
+        self.start_time.extend(other.start_time)
+        self.end_time.extend(other.end_time)
+        self.event_time.extend(other.event_time)
+
+    def take(self, indices: List[int]) -> 'ViewColumns':
+        """Новый буфер из строк с указанными номерами."""
+        result = ViewColumns()
+        for index in indices:
+            offset = index * 16
+            result.user_id += self.user_id[offset:offset + 16]
+            result.film_id += self.film_id[offset:offset + 16]
+        result.start_time = array('H', (self.start_time[i] for i in indices))
+        result.end_time = array('H', (self.end_time[i] for i in indices))
+        result.event_time = array('q', (self.event_time[i] for i in indices))
+        return result
+
+
 class KafkaBulkData(BaseModel):
-    payload: List[KafkaData]
+    payload: ViewColumns
+    topic: str = ''
+    # partition -> (первый, последний) оффсет записей, вошедших в пачку
+    offsets: Dict[int, Tuple[int, int]] = {}
+
+    @property
+    def dedup_token(self) -> str:
+        """Детерминированный токен пачки по диапазонам оффсетов: повторная
+        вставка той же пачки отбрасывается дедупликацией ClickHouse."""
+        ranges = ';'.join(
+            f'{self.topic}:{partition}:{first}-{last}'
+            for partition, (first, last) in sorted(self.offsets.items())
+        )
+        return sha1(ranges.encode()).hexdigest()
+
+    class Config:
+        arbitrary_types_allowed = True
@@ -1,20 +1,51 @@
+from abc import ABC, abstractmethod
+from typing import Optional, Set
 from clickhouse_driver import Client, errors
 from .schema import ClickhouseBulkData
 from core.config import settings
+from metrics import count_retry
 import backoff
 
 from logging import getLogger
 logger = getLogger(__name__)
 
+# Ошибки соединения, после которых вставку можно повторить
+LOAD_ERRORS = (errors.NetworkError, ConnectionRefusedError)
 
-class ClickhouseLoader:
-    def __init__(self, host: str) -> None:
-        self.host = host
-        self._client = None
+
+class BaseLoader(ABC):
 
     def __enter__(self):
         return self
 
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    @abstractmethod
+    def load(self, transformed_data: ClickhouseBulkData) -> None:
+        """Вставка с повторами при ошибках соединения."""
+
+    @abstractmethod
+    def insert(self,
+               transformed_data: ClickhouseBulkData,
+               written: Optional[Set[str]] = None) -> None:
+        """Одна попытка вставки, без повторов. written - метки частей
+        пачки, которые уже записаны в ClickHouse: они пропускаются, а метки
+        записанных при этой вставке добавляются в written."""
+
+
+class ClickhouseLoader(BaseLoader):
+    def __init__(self,
+                 host: str,
+                 compression: Optional[str] = None,
+                 port: int = 9000,
+                 deduplicate: bool = False) -> None:
+        self.host = host
+        self.port = port
+        self.compression = compression or False
+        self.deduplicate = deduplicate
+        self._client = None
+
     def __exit__(self, exc_type, exc_val, exc_tb):
         try:
             if self._client and self._client.connection.connected:
@@ -28,12 +59,37 @@ class ClickhouseLoader:
     @property
     def client(self) -> Client:
         if not self._client or not self._client.connection.connected:
-            self._client = Client(self.host)
+            self._client = Client(
+                self.host,
+                port=self.port,
+                compression=self.compression
+            )
         return self._client
 
     @backoff.on_exception(backoff.expo,
-                          (errors.NetworkError, ConnectionRefusedError),
-                          max_time=settings.backoff_max_time)
+                          LOAD_ERRORS,
+                          max_time=settings.backoff_max_time,
+                          on_backoff=count_retry)
     def load(self, transformed_data: ClickhouseBulkData) -> None:
+        self.insert(transformed_data)
+
+    def insert(self,
+               transformed_data: ClickhouseBulkData,
+               written: Optional[Set[str]] = None) -> None:
+        if written is not None and transformed_data.table in written:
+            return
         logger.info('Loading data %s rows', transformed_data.count)
-        self.client.execute(transformed_data.query)
+        query_settings = {}
+        if self.deduplicate and transformed_data.dedup_token:
+            query_settings = {
+                'insert_deduplicate': 1,
+                'insert_deduplication_token': transformed_data.dedup_token,
+            }
+        self.client.execute(
+            transformed_data.query,
+            transformed_data.columns,
+            columnar=True,
+            settings=query_settings
+        )
+        if written is not None:
+            written.add(transformed_data.table)
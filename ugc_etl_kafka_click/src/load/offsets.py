@@ -0,0 +1,70 @@
+from logging import getLogger
+from threading import Lock
+from typing import Dict, Optional
+
+from clickhouse_driver import Client
+
+from .base import LOAD_ERRORS
+
+
+logger = getLogger(__name__)
+
+
+class OffsetStore:
+    """Последний загруженный оффсет по каждой партиции для группы
+    консьюмеров, хранится в ClickHouse. Таблица создается при первом
+    обращении."""
+
+    def __init__(self, host: str, table: str, group_id: str) -> None:
+        self.host = host
+        self.table = table
+        self.group_id = group_id
+        self._client: Optional[Client] = None
+        # Хранилище используется потоками extract и load
+        self._lock = Lock()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._client:
+                self._client.disconnect()
+
+    @property
+    def client(self) -> Client:
+        if not self._client:
+            client = Client(self.host)
+            client.execute(
+                f'CREATE TABLE IF NOT EXISTS {self.table} ('
+                'topic String, partition UInt32, group_id String, '
+                'offset UInt64, updated DateTime DEFAULT now()'
+                ') ENGINE = ReplacingMergeTree(offset) '
+                'ORDER BY (topic, partition, group_id)'
+            )
+            self._client = client
+        return self._client
+
+    def get(self, topic: str) -> Optional[Dict[int, int]]:
+        """Возвращает None, если ClickHouse недоступен."""
+        try:
+            with self._lock:
+                rows = self.client.execute(
+                    f'SELECT partition, max(offset) FROM {self.table} '
+                    'WHERE topic = %(topic)s AND group_id = %(group_id)s '
+                    'GROUP BY partition',
+                    {'topic': topic, 'group_id': self.group_id}
+                )
+        except LOAD_ERRORS:
+            logger.warning('Не удалось прочитать загруженные оффсеты')
+            return None
+        return dict(rows)
+
+    def save(self, topic: str, offsets: Dict[int, int]) -> None:
+        try:
+            with self._lock:
+                self.client.execute(
+                    f'INSERT INTO {self.table} '
+                    '(topic, partition, offset, group_id) VALUES',
+                    [(topic, partition, offset, self.group_id)
+                     for partition, offset in offsets.items()]
+                )
+        except LOAD_ERRORS:
+            logger.warning('Не удалось сохранить оффсеты %s', offsets)
@@ -1,6 +1,30 @@
+from typing import Optional, Tuple
+
 from pydantic import BaseModel
 
 
+# Порядок колонок в таблице просмотров ClickHouse
+VIEW_COLUMNS = ('user_id', 'film_id', 'start_time', 'end_time', 'event_time')
+# Порядок колонок в таблице сессий просмотра
+SESSION_COLUMNS = (
+    'user_id', 'film_id', 'started_at', 'ended_at',
+    'start_time', 'end_time', 'watched', 'heartbeats',
+)
+
+
 class ClickhouseBulkData(BaseModel):
     count: int
-    query: str
+    table: str
+    # Данные в колоночном виде: по одному списку значений на колонку
+    columns: list
+    # Токен для insert_deduplication_token, одинаковый у повторов пачки
+    dedup_token: Optional[str] = None
+    # Имена колонок в порядке columns, первая - user_id
+    column_names: Tuple[str, ...] = VIEW_COLUMNS
+
+    @property
+    def query(self) -> str:
+        return (
+            f'INSERT INTO {self.table} '
+            f'({", ".join(self.column_names)}) VALUES'
+        )
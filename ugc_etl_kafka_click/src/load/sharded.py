@@ -0,0 +1,183 @@
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from logging import getLogger
+from typing import List, Optional, Set
+
+import backoff
+
+from core.config import settings
+
+from metrics import count_retry
+
+from .base import LOAD_ERRORS, BaseLoader, ClickhouseLoader
+from .schema import ClickhouseBulkData
+
+
+logger = getLogger(__name__)
+
+# База данных локальной таблицы, если в кластере она не указана
+DEFAULT_DATABASE = 'shard'
+
+
+@dataclass
+class Shard:
+    num: int
+    weight: int
+    host: str
+    port: int
+    database: str
+
+
+def shard_key(user_id: str) -> int:
+    """Ключ шардирования, совпадает с CRC32(user_id) в ClickHouse,
+    для UUID колонок схемы v2 - с CRC32(toString(user_id))."""
+    return zlib.crc32(user_id.encode())
+
+
+def parse_shards(shards: List[str]) -> List[Shard]:
+    """Разбирает топологию из настроек: 'host:port/database' на шард."""
+    result = []
+    for num, shard in enumerate(shards, start=1):
+        address, _, database = shard.partition('/')
+        host, _, port = address.partition(':')
+        result.append(Shard(
+            num=num,
+            weight=1,
+            host=host,
+            port=int(port or 9000),
+            database=database or DEFAULT_DATABASE,
+        ))
+    return result
+
+
+class ShardedClickhouseLoader(BaseLoader):
+    """Вставляет пачку напрямую в локальные таблицы шардов, минуя
+    Distributed таблицу. Строки распределяются по CRC32(user_id) с учетом
+    весов шардов так же, как это сделала бы Distributed таблица.
+    Каждый шард - отдельная часть пачки: при ошибке одного шарда повторно
+    вставляются только не записанные части."""
+
+    def __init__(self,
+                 host: str,
+                 compression: Optional[str],
+                 cluster: str,
+                 local_table: str,
+                 shards: Optional[List[Shard]] = None,
+                 deduplicate: bool = False) -> None:
+        self.host = host
+        self.compression = compression
+        self.cluster = cluster
+        self.local_table = local_table
+        self.shards = shards or self._read_topology()
+        self._loaders = [
+            ClickhouseLoader(shard.host, compression, shard.port, deduplicate)
+            for shard in self.shards
+        ]
+        self._slots = [
+            index
+            for index, shard in enumerate(self.shards)
+            for _ in range(shard.weight)
+        ]
+        self._executor = ThreadPoolExecutor(
+            max_workers=len(self.shards),
+            thread_name_prefix='shard'
+        )
+        logger.info(
+            'Вставка напрямую в шарды: %s',
+            ', '.join(f'{shard.host}:{shard.port}' for shard in self.shards)
+        )
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._executor.shutdown()
+        for loader in self._loaders:
+            loader.__exit__(exc_type, exc_val, exc_tb)
+
+    @backoff.on_exception(backoff.expo,
+                          LOAD_ERRORS,
+                          max_time=settings.backoff_max_time)
+    def _read_topology(self) -> List[Shard]:
+        with ClickhouseLoader(self.host, self.compression) as loader:
+            rows = loader.client.execute(
+                'SELECT shard_num, shard_weight, host_name, port, '
+                'default_database FROM system.clusters '
+                'WHERE cluster = %(cluster)s AND replica_num = 1 '
+                'ORDER BY shard_num',
+                {'cluster': self.cluster}
+            )
+        if not rows:
+            raise ValueError(f'Кластер {self.cluster} не найден')
+        return [
+            Shard(
+                num=num,
+                weight=weight,
+                host=host,
+                port=port,
+                database=database or DEFAULT_DATABASE,
+            )
+            for num, weight, host, port, database in rows
+        ]
+
+    def load(self, transformed_data: ClickhouseBulkData) -> None:
+        self._load(transformed_data, set())
+
+    @backoff.on_exception(backoff.expo,
+                          LOAD_ERRORS,
+                          max_time=settings.backoff_max_time,
+                          on_backoff=count_retry)
+    def _load(self,
+              transformed_data: ClickhouseBulkData,
+              written: Set[str]) -> None:
+        self.insert(transformed_data, written)
+
+    def insert(self,
+               transformed_data: ClickhouseBulkData,
+               written: Optional[Set[str]] = None) -> None:
+        if written is None:
+            written = set()
+        futures = [
+            (label, self._executor.submit(loader.insert, part))
+            for shard, loader, part in zip(
+                self.shards,
+                self._loaders,
+                self.split(transformed_data)
+            )
+            if part is not None
+            for label in [f'{transformed_data.table}#{shard.num}']
+            if label not in written
+        ]
+        error = None
+        for label, future in futures:
+            exception = future.exception()
+            if exception is None:
+                written.add(label)
+            elif error is None:
+                error = exception
+        if error is not None:
+            # Записанные шарды уже в written, повторять их не нужно
+            raise error
+
+    def split(
+        self,
+        transformed_data: ClickhouseBulkData
+    ) -> List[Optional[ClickhouseBulkData]]:
+        parts: List[List[list]] = [
+            [[] for _ in transformed_data.columns] for _ in self.shards
+        ]
+        slots = self._slots
+        token = transformed_data.dedup_token
+        rows = zip(*transformed_data.columns)
+        for row in rows:
+            part = parts[slots[shard_key(row[0]) % len(slots)]]
+            for column, value in zip(part, row):
+                column.append(value)
+        return [
+            ClickhouseBulkData(
+                count=len(part[0]),
+                table=f'{shard.database}.{self.local_table}',
+                columns=part,
+                column_names=transformed_data.column_names,
+                dedup_token=f'{token}-{shard.num}' if token else token,
+            ) if part[0] else None
+            for shard, part in zip(self.shards, parts)
+        ]
@@ -0,0 +1,377 @@
+import os
+import struct
+import zlib
+from array import array
+from logging import getLogger
+from threading import Condition, Event, Lock, Thread
+from time import time
+from typing import (
+    BinaryIO, Collection, Dict, Iterator, List, Optional, Sequence, Set,
+    Tuple, Union
+)
+
+from extract.schema import ViewColumns
+from load.schema import ClickhouseBulkData
+from transform.aggregate import Aggregation
+from transform.base import Transformer
+from metrics import ROWS, SPOOL_BYTES
+
+from .base import LOAD_ERRORS, BaseLoader
+
+
+logger = getLogger(__name__)
+
+# Заголовок записи: сигнатура, версия формата, число строк, crc32 данных,
+# длина токена дедупликации, длина меток уже записанных частей пачки.
+# За заголовком идут токен, метки через перевод строки и колонки.
+# Колонки пишутся в порядке байтов машины: спул не переносится между хостами
+HEADER = struct.Struct('<4sBIIHH')
+MAGIC = b'VSPL'
+VERSION = 3
+# Запись спула: колонки, токен дедупликации, метки записанных частей
+SpoolRecord = Tuple[ViewColumns, str, Set[str]]
+# Размер одной строки в байтах: два UUID, два UInt16 и Int64
+ROW_SIZE = 16 + 16 + 2 + 2 + 8
+SEGMENT_SUFFIX = '.seg'
+CORRUPT_SUFFIX = '.corrupt'
+
+
+class Spool:
+    """Журнал пачек на локальном диске на время недоступности ClickHouse.
+
+    Пачки дописываются в текущий сегмент с fsync после каждой записи.
+    Сегмент закрывается при достижении segment_max_bytes или по запросу
+    SpoolDrainer, после чего его можно загружать и удалять. Когда размер
+    спула достигает max_bytes, писатель ждет в wait_for_space, пока
+    SpoolDrainer не освободит место.
+    """
+
+    def __init__(self,
+                 directory: str,
+                 segment_max_bytes: int,
+                 max_bytes: int) -> None:
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.max_bytes = max_bytes
+        self._lock = Lock()
+        self._space = Condition(self._lock)
+        self._active: Optional[BinaryIO] = None
+        self._active_path: Optional[str] = None
+        self._counter = 0
+        # Результаты агрегатов с состоянием по токенам пачек, записанных
+        # в спул этим процессом
+        self._states: Dict[str, Dict[str, ClickhouseBulkData]] = {}
+        os.makedirs(directory, exist_ok=True)
+        # Сегменты, оставшиеся от предыдущего запуска, считаются закрытыми
+        self._sealed: List[str] = sorted(
+            os.path.join(directory, name)
+            for name in os.listdir(directory)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+        self._size = sum(os.path.getsize(path) for path in self._sealed)
+        SPOOL_BYTES.set(self._size)
+        if self._sealed:
+            logger.warning(
+                'В спуле %s найдено незагруженных сегментов: %s',
+                directory,
+                len(self._sealed)
+            )
+
+    @property
+    def pending(self) -> bool:
+        with self._lock:
+            return bool(self._sealed) or self._active is not None
+
+    def wait_for_space(self, timeout: float) -> bool:
+        """Возвращает False, если за timeout секунд место не освободилось."""
+        with self._space:
+            return self._space.wait_for(
+                lambda: self._size < self.max_bytes,
+                timeout
+            )
+
+    def append(self,
+               columns: ViewColumns,
+               dedup_token: str = '',
+               written: Collection[str] = (),
+               states: Optional[Dict[str, ClickhouseBulkData]] = None
+               ) -> None:
+        """written - метки частей пачки, которые уже есть в ClickHouse,
+        см. BaseLoader.insert. states - результаты агрегатов с состоянием
+        по таблицам, они хранятся только в памяти, как и само состояние."""
+        token = dedup_token.encode()
+        labels = '\n'.join(sorted(written)).encode()
+        payload = b''.join((
+            token,
+            labels,
+            columns.user_id,
+            columns.film_id,
+            columns.start_time.tobytes(),
+            columns.end_time.tobytes(),
+            columns.event_time.tobytes(),
+        ))
+        header = HEADER.pack(
+            MAGIC,
+            VERSION,
+            len(columns),
+            zlib.crc32(payload),
+            len(token),
+            len(labels)
+        )
+        with self._lock:
+            segment = self._active
+            if segment is None:
+                segment = self._open_segment()
+            self._states[dedup_token] = dict(states or {})
+            segment.write(header)
+            segment.write(payload)
+            segment.flush()
+            os.fsync(segment.fileno())
+            self._size += HEADER.size + len(payload)
+            SPOOL_BYTES.set(self._size)
+            if segment.tell() >= self.segment_max_bytes:
+                self._seal()
+        logger.warning('В спул записано %s строк', len(columns))
+
+    def states(self,
+               dedup_token: str) -> Optional[Dict[str, ClickhouseBulkData]]:
+        """None, если пачка записана в спул до перезапуска."""
+        with self._lock:
+            return self._states.get(dedup_token)
+
+    def remember(self,
+                 dedup_token: str,
+                 states: Dict[str, ClickhouseBulkData]) -> None:
+        with self._lock:
+            self._states[dedup_token] = states
+
+    def forget(self, dedup_token: str) -> None:
+        with self._lock:
+            self._states.pop(dedup_token, None)
+
+    def seal(self) -> None:
+        with self._lock:
+            self._seal()
+
+    def sealed(self) -> List[str]:
+        with self._lock:
+            return list(self._sealed)
+
+    def remove(self, path: str) -> None:
+        size = os.path.getsize(path)
+        os.remove(path)
+        self._release(path, size)
+
+    def quarantine(self, path: str) -> None:
+        """Убирает сегмент с поврежденными записями из спула, оставляя
+        его на диске для разбора."""
+        size = os.path.getsize(path)
+        os.rename(path, path + CORRUPT_SUFFIX)
+        self._release(path, size)
+
+    def _release(self, path: str, size: int) -> None:
+        with self._space:
+            self._sealed.remove(path)
+            self._size -= size
+            SPOOL_BYTES.set(self._size)
+            self._space.notify_all()
+
+    def _open_segment(self) -> BinaryIO:
+        self._counter += 1
+        name = f'{int(time() * 1000):016d}-{self._counter:06d}{SEGMENT_SUFFIX}'
+        self._active_path = os.path.join(self.directory, name)
+        self._active = open(self._active_path, 'ab')
+        return self._active
+
+    def _seal(self) -> None:
+        if self._active is None or self._active_path is None:
+            return
+        self._active.close()
+        self._sealed.append(self._active_path)
+        self._active = None
+        self._active_path = None
+
+
+class SegmentReader:
+    """Читает записи сегмента. Поврежденная или оборванная запись
+    пропускается: чтение продолжается со следующей сигнатуры, с которой
+    начинается целая запись. Число пропущенных участков - в corrupt."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.corrupt = 0
+
+    def __iter__(self) -> Iterator[SpoolRecord]:
+        with open(self.path, 'rb') as segment:
+            raw = segment.read()
+        data = memoryview(raw)
+        position = 0
+        skipping = False
+        while position < len(data):
+            record = _read_record(data, position)
+            if record is None:
+                if not skipping:
+                    self.corrupt += 1
+                    skipping = True
+                    logger.error(
+                        'Поврежденная запись в сегменте %s, позиция %s',
+                        self.path,
+                        position
+                    )
+                position = raw.find(MAGIC, position + 1)
+                if position == -1:
+                    return
+                continue
+            skipping = False
+            spool_record, position = record
+            yield spool_record
+
+
+def _read_record(
+    data: memoryview,
+    position: int
+) -> Optional[Tuple[SpoolRecord, int]]:
+    """Возвращает запись и позицию следующей за ней или None."""
+    if len(data) - position < HEADER.size:
+        return None
+    magic, version, rows, crc, token_size, labels_size = \
+        HEADER.unpack_from(data, position)
+    if version != VERSION:
+        return None
+    start = position + HEADER.size
+    columns_start = start + token_size + labels_size
+    end = columns_start + rows * ROW_SIZE
+    if magic != MAGIC or end > len(data):
+        return None
+    if zlib.crc32(data[start:end]) != crc:
+        return None
+    labels = bytes(data[start + token_size:columns_start]).decode()
+    return (
+        (
+            _unpack_columns(data[columns_start:end], rows),
+            bytes(data[start:start + token_size]).decode(),
+            set(labels.split('\n')) if labels else set(),
+        ),
+        end
+    )
+
+
+def _unpack_columns(payload: Union[bytes, memoryview],
+                    rows: int) -> ViewColumns:
+    columns = ViewColumns()
+    view = memoryview(payload)
+    offset = 0
+    columns.user_id = bytearray(view[offset:offset + 16 * rows])
+    offset += 16 * rows
+    columns.film_id = bytearray(view[offset:offset + 16 * rows])
+    offset += 16 * rows
+    columns.start_time = array('H', view[offset:offset + 2 * rows].tobytes())
+    offset += 2 * rows
+    columns.end_time = array('H', view[offset:offset + 2 * rows].tobytes())
+    offset += 2 * rows
+    columns.event_time = array('q', view[offset:offset + 8 * rows].tobytes())
+    return columns
+
+
+class SpoolDrainer:
+    """Фоновый поток, который загружает сегменты спула в ClickHouse,
+    как только он снова доступен. Использует собственное соединение.
+    Части пачки, которые уже записаны в ClickHouse, повторно не вставляются.
+    Агрегаты с состоянием пересчитываются только для пачек, записанных
+    в спул до перезапуска: остальные пачки уже прошли через агрегат
+    при чтении, и загружается посчитанный тогда результат."""
+
+    def __init__(self,
+                 spool: Spool,
+                 transformer: Transformer,
+                 loader: BaseLoader,
+                 table_name: Optional[str],
+                 interval: float,
+                 aggregations: Sequence[Tuple[Aggregation, BaseLoader]] = ()
+                 ) -> None:
+        self.spool = spool
+        self.transformer = transformer
+        self.loader = loader
+        self.table_name = table_name
+        self.interval = interval
+        self.aggregations = aggregations
+        self._stopped = Event()
+        # Сколько записей сегмента уже загружено и метки записанных частей
+        # следующей записи, если ее загрузка прервалась
+        self._drained: Dict[str, Tuple[int, Optional[Set[str]]]] = {}
+        self._thread = Thread(target=self._run, name='spool', daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            if not self.spool.pending:
+                continue
+            self.spool.seal()
+            try:
+                for path in self.spool.sealed():
+                    self._drain(path)
+            except LOAD_ERRORS:
+                logger.warning('ClickHouse недоступен, спул будет загружен позже')
+            except Exception:
+                logger.exception('Ошибка при загрузке спула')
+
+    def _drain(self, path: str) -> None:
+        done, interrupted = self._drained.get(path, (0, None))
+        reader = SegmentReader(path)
+        for index, (columns, token, written) in enumerate(reader):
+            if index < done:
+                continue
+            if interrupted is not None:
+                written, interrupted = interrupted, None
+            self._drained[path] = (index, written)
+            if self.table_name:
+                self.loader.insert(
+                    self.transformer.columns_to_clickhouse(
+                        columns,
+                        self.table_name,
+                        token or None
+                    ),
+                    written
+                )
+            states = self.spool.states(token)
+            if states is None:
+                # Пачка записана в спул до перезапуска: агрегаты с состоянием
+                # считаются один раз, даже если загрузку придется повторить
+                states = {
+                    aggregation.table: aggregation.aggregate(
+                        columns,
+                        token or None
+                    )
+                    for aggregation, _ in self.aggregations
+                    if aggregation.stateful
+                }
+                self.spool.remember(token, states)
+            for aggregation, loader in self.aggregations:
+                if aggregation.stateful:
+                    data = states.get(aggregation.table)
+                else:
+                    data = aggregation.aggregate(columns, token or None)
+                if data is not None:
+                    loader.insert(data, written)
+            self._drained[path] = (index + 1, None)
+            self.spool.forget(token)
+            ROWS.inc(len(columns))
+        self._drained.pop(path, None)
+        if reader.corrupt:
+            self.spool.quarantine(path)
+            logger.error(
+                'Сегмент спула %s загружен без %s поврежденных участков '
+                'и сохранен как %s',
+                path,
+                reader.corrupt,
+                path + CORRUPT_SUFFIX
+            )
+            return
+        self.spool.remove(path)
+        logger.info('Сегмент спула %s загружен', path)
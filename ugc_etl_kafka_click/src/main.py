@@ -1,31 +1,354 @@
+import argparse
+import os
+import signal
+import sys
+from contextlib import ExitStack
+from functools import partial
+from multiprocessing import Queue
+from threading import Thread
+from typing import List, Optional, Tuple
+
 from extract.base import KafkaExtractor
+from extract.batch import BatchPolicy
+from extract.replay import (PartitionRange, ReplayExtractor, parse_bound,
+                            resolve_ranges)
+from transform.aggregate import Aggregation, LastPosition
+from transform.sessions import Sessionizer
 from transform.base import Transformer
-from load.base import ClickhouseLoader
+from clickhouse_driver import Client
+from load.base import BaseLoader, ClickhouseLoader
+from load.offsets import OffsetStore
+from load.sharded import ShardedClickhouseLoader, parse_shards
+from load.spool import Spool, SpoolDrainer
+from pipeline import Pipeline
+from backfill import Backfill
+from migrate import LastPositionFill, Migration, MigrationTable
+from metrics import start_metrics_server
+from supervisor import Supervisor, WorkerStats, get_workers_count
 from logging import getLogger
-from time import sleep
 from core.config import settings
 
 
 logger = getLogger(__name__)
 
 
-def main():
+def report_stats(worker: int,
+                 stats_queue: Queue,
+                 extractor: KafkaExtractor,
+                 pipeline: Pipeline) -> None:
+    reported_rows = 0
+    while not extractor.stopped.wait(settings.supervisor_stats_interval):
+        rows = pipeline.rows_loaded
+        stats_queue.put(WorkerStats(
+            worker=worker,
+            rows=rows - reported_rows,
+            lag=sum(extractor.lag.values()),
+        ))
+        reported_rows = rows
+
+
+def create_loader(
+    local_table: str = settings.table(settings.clickhouse_local_table)
+) -> BaseLoader:
+    if settings.clickhouse_insert_mode == 'shards':
+        return ShardedClickhouseLoader(
+            settings.clickhouse_host,
+            settings.clickhouse_compression,
+            settings.clickhouse_cluster,
+            local_table,
+            parse_shards(settings.clickhouse_shards),
+            settings.clickhouse_dedup_token
+        )
+    return ClickhouseLoader(
+        settings.clickhouse_host,
+        settings.clickhouse_compression,
+        deduplicate=settings.clickhouse_dedup_token
+    )
+
+
+def create_offset_store() -> Optional[OffsetStore]:
+    if not settings.clickhouse_offsets_table:
+        return None
+    return OffsetStore(
+        settings.clickhouse_host,
+        settings.clickhouse_offsets_table,
+        settings.kafka_groupid
+    )
+
+
+def create_aggregations(
+    transformer: Transformer
+) -> List[Tuple[Aggregation, str]]:
+    """Агрегаты и локальные таблицы шардов для их загрузчиков."""
+    aggregations: List[Tuple[Aggregation, str]] = []
+    if settings.clickhouse_last_position_table:
+        aggregations.append((
+            LastPosition(
+                transformer,
+                settings.table(settings.clickhouse_last_position_table)
+            ),
+            settings.table(settings.clickhouse_last_position_local_table),
+        ))
+    if settings.clickhouse_sessions_table:
+        aggregations.append((
+            Sessionizer(
+                settings.clickhouse_sessions_table,
+                settings.sessions_gap,
+                settings.sessions_lateness
+            ),
+            settings.clickhouse_sessions_local_table,
+        ))
+    return aggregations
+
+
+def attach_loaders(
+    aggregations: List[Tuple[Aggregation, str]],
+    stack: ExitStack
+) -> List[Tuple[Aggregation, BaseLoader]]:
+    """У каждого потока свои загрузчики: соединения ClickHouse
+    не потокобезопасны."""
+    return [
+        (aggregation, stack.enter_context(create_loader(local_table)))
+        for aggregation, local_table in aggregations
+    ]
+
+
+def get_raw_table() -> Optional[str]:
+    if not settings.clickhouse_raw_views:
+        return None
+    return settings.table(settings.clickhouse_tablename)
+
+
+def start_spool(worker: int,
+                transformer: Transformer,
+                aggregations: List[Tuple[Aggregation, str]],
+                stack: ExitStack) -> Optional[Spool]:
+    if not settings.spool_dir:
+        return None
+    spool = Spool(
+        os.path.join(settings.spool_dir, f'worker-{worker}'),
+        settings.spool_segment_max_bytes,
+        settings.spool_max_bytes
+    )
+    drainer = SpoolDrainer(
+        spool,
+        transformer,
+        stack.enter_context(create_loader()),
+        get_raw_table(),
+        settings.spool_drain_interval,
+        # Те же агрегаты, что у пайплайна: состояние сессий общее
+        attach_loaders(aggregations, stack)
+    )
+    drainer.start()
+    stack.callback(drainer.stop)
+    return spool
+
+
+def run_worker(worker: int = 0, stats_queue: Optional[Queue] = None):
+    if settings.metrics_port:
+        start_metrics_server(settings.metrics_port + worker)
     transofmer = Transformer()
     with KafkaExtractor(
             settings.kafka_topic,
             settings.kafka_server,
-            settings.kafka_groupid
+            settings.kafka_groupid,
+            create_policy(),
+            settings.kafka_dead_letter_topic,
+            create_offset_store()
         ) as extractor, \
-            ClickhouseLoader(settings.clickhouse_host) as loader:
-
-        for kafka_bulk_data in extractor.get_updates():
-            if kafka_bulk_data.payload:
-                transformed_data = transofmer.kafka_to_clickhouse(
-                    kafka_bulk_data,
-                    settings.clickhouse_tablename
-                )
-                loader.load(transformed_data)
-            sleep(settings.sleep_interval)
+            create_loader() as loader, \
+            ExitStack() as stack:
+
+        # По SIGTERM дочитываем текущую пачку и загружаем уже прочитанные
+        signal.signal(signal.SIGTERM, lambda *_: extractor.stop())
+        aggregations = create_aggregations(transofmer)
+        pipeline = Pipeline(
+            extractor,
+            transofmer,
+            loader,
+            get_raw_table(),
+            settings.pipeline_queue_size,
+            start_spool(worker, transofmer, aggregations, stack),
+            attach_loaders(aggregations, stack)
+        )
+        if stats_queue is not None:
+            Thread(
+                target=report_stats,
+                args=(worker, stats_queue, extractor, pipeline),
+                daemon=True,
+            ).start()
+        pipeline.run()
+
+
+def create_policy() -> BatchPolicy:
+    return BatchPolicy(
+        settings.batch_max_rows,
+        settings.batch_max_bytes,
+        settings.batch_max_age
+    )
+
+
+def run_backfill_worker(worker: int,
+                        ranges: List[PartitionRange],
+                        table: str,
+                        local_table: str,
+                        aggregate: bool) -> None:
+    transformer = Transformer()
+    with ReplayExtractor(
+            settings.kafka_topic,
+            settings.kafka_server,
+            create_policy(),
+            ranges
+    ) as extractor, \
+            create_loader(local_table) as loader, \
+            ExitStack() as stack:
+        signal.signal(signal.SIGTERM, lambda *_: extractor.stop())
+        Pipeline(
+            extractor,
+            transformer,
+            loader,
+            table,
+            settings.pipeline_queue_size,
+            aggregations=attach_loaders(create_aggregations(transformer), stack)
+            if aggregate else ()
+        ).run()
+
+
+def backfill(args: argparse.Namespace) -> None:
+    ranges = resolve_ranges(
+        settings.kafka_topic,
+        settings.kafka_server,
+        args.start,
+        args.end
+    )
+    completed = Backfill(
+        partial(
+            run_backfill_worker,
+            table=args.table,
+            local_table=args.local_table,
+            aggregate=not args.skip_aggregations
+        ),
+        ranges,
+        args.workers
+    ).run()
+    if not completed:
+        sys.exit(1)
+
+
+def migrate(args: argparse.Namespace) -> None:
+    tables = [MigrationTable(
+        settings.clickhouse_tablename,
+        settings.table(settings.clickhouse_tablename, args.to)
+    )]
+    if settings.clickhouse_last_position_table:
+        tables.append(MigrationTable(
+            settings.clickhouse_last_position_table,
+            settings.table(settings.clickhouse_last_position_table, args.to),
+            final=True
+        ))
+    client = Client(settings.clickhouse_host)
+    try:
+        completed = Migration(client, tables).run()
+    finally:
+        client.disconnect()
+    if not completed:
+        sys.exit(1)
+
+
+def populate_last_positions() -> None:
+    if not settings.clickhouse_last_position_table:
+        sys.exit('CLICKHOUSE_LAST_POSITION_TABLE не задана')
+    client = Client(settings.clickhouse_host)
+    try:
+        LastPositionFill(
+            client,
+            settings.table(settings.clickhouse_tablename),
+            settings.table(settings.clickhouse_last_position_table)
+        ).run()
+    finally:
+        client.disconnect()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description='ETL просмотров из Kafka в ClickHouse'
+    )
+    commands = parser.add_subparsers(dest='command')
+    replay = commands.add_parser(
+        'backfill',
+        help='Перезалить диапазон топика, не затрагивая оффсеты группы'
+    )
+    replay.add_argument(
+        '--start',
+        type=parse_bound,
+        default=0,
+        help='Начало диапазона: оффсет или время ISO 8601 (UTC)'
+    )
+    replay.add_argument(
+        '--end',
+        type=parse_bound,
+        default=None,
+        help='Конец диапазона, не включается. По умолчанию текущий конец'
+    )
+    replay.add_argument(
+        '--table',
+        default=settings.table(settings.clickhouse_tablename),
+        help='Таблица, в которую загружаются записи'
+    )
+    replay.add_argument(
+        '--local-table',
+        default=settings.table(settings.clickhouse_local_table),
+        help='Локальная таблица шардов для CLICKHOUSE_INSERT_MODE=shards'
+    )
+    replay.add_argument(
+        '--skip-aggregations',
+        action='store_true',
+        help='Не обновлять таблицу последних позиций'
+    )
+    replay.add_argument(
+        '--workers',
+        type=int,
+        default=settings.backfill_workers,
+        help='Число процессов, 0 - по числу CPU'
+    )
+    schema = commands.add_parser(
+        'migrate',
+        help='Перенести просмотры из таблиц схемы v1 в таблицы новой схемы'
+    )
+    schema.add_argument(
+        '--to',
+        choices=['v2'],
+        default='v2',
+        help='Версия схемы, в которую переносятся данные'
+    )
+    commands.add_parser(
+        'populate-last',
+        help='Заполнить таблицу последних позиций по загруженным просмотрам'
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == 'backfill':
+        backfill(args)
+        return
+    if args.command == 'migrate':
+        migrate(args)
+        return
+    if args.command == 'populate-last':
+        populate_last_positions()
+        return
+    workers = get_workers_count()
+    if workers == 1:
+        run_worker()
+        return
+    Supervisor(
+        run_worker,
+        workers,
+        settings.supervisor_restart_delay,
+        settings.supervisor_stats_interval
+    ).run()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,46 @@
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+
+CONSUMER_LAG = Gauge(
+    'etl_consumer_lag',
+    'Отставание консьюмера от конца партиции, записей',
+    ['partition'],
+)
+STAGE_SECONDS = Histogram(
+    'etl_stage_seconds',
+    'Длительность стадий ETL',
+    ['stage'],
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30),
+)
+ROWS = Counter('etl_rows_total', 'Строк загружено в ClickHouse')
+BYTES = Counter('etl_bytes_total', 'Байт сообщений прочитано из Kafka')
+BATCH_ROWS = Histogram(
+    'etl_batch_rows',
+    'Число строк в загружаемой пачке',
+    buckets=(100, 1000, 5000, 10000, 25000, 50000, 100000, 250000),
+)
+REJECTED = Counter(
+    'etl_rejected_records_total',
+    'Отклоненные записи по причинам',
+    ['reason'],
+)
+LOAD_RETRIES = Counter(
+    'etl_load_retries_total',
+    'Повторы вставки в ClickHouse после ошибок соединения',
+)
+SPOOLED_ROWS = Counter('etl_spooled_rows_total', 'Строк записано в спул')
+SPOOL_BYTES = Gauge('etl_spool_bytes', 'Размер спула на диске, байт')
+OPEN_SESSIONS = Gauge('etl_open_sessions', 'Открытых сессий просмотра')
+LATE_HEARTBEATS = Counter(
+    'etl_late_heartbeats_total',
+    'Отметок просмотра позже водяного знака',
+)
+
+
+def count_retry(details: dict) -> None:
+    """Обработчик on_backoff для backoff.on_exception."""
+    LOAD_RETRIES.inc()
+
+
+def start_metrics_server(port: int) -> None:
+    start_http_server(port)
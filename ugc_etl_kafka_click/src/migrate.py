@@ -0,0 +1,130 @@
+from dataclasses import dataclass
+from logging import getLogger
+from typing import Dict, List
+
+from clickhouse_driver import Client
+
+
+logger = getLogger(__name__)
+
+
+@dataclass
+class MigrationTable:
+    source: str
+    target: str
+    # Сравнивать и копировать с FINAL, для ReplacingMergeTree
+    final: bool = False
+
+
+class Migration:
+    """Копирует просмотры из таблиц схемы v1 в таблицы v2 по дневным
+    партициям исходной таблицы. Данные переносятся на стороне ClickHouse
+    (INSERT ... SELECT с приведением строк к UUID). День, число строк
+    которого в целевой таблице уже совпадает с исходной, пропускается,
+    поэтому прерванную миграцию можно запустить повторно. ETL на время
+    миграции нужно остановить, новые сообщения дождутся его в Kafka."""
+
+    def __init__(self, client: Client, tables: List[MigrationTable]) -> None:
+        self.client = client
+        self.tables = tables
+
+    def run(self) -> bool:
+        """Возвращает True, если все партиции перенесены полностью."""
+        completed = True
+        for table in self.tables:
+            completed = self._migrate(table) and completed
+        return completed
+
+    def _migrate(self, table: MigrationTable) -> bool:
+        source = self._counts(table.source, table.final)
+        target = self._counts(table.target, table.final)
+        partial = []
+        for partition, rows in source.items():
+            copied = target.get(partition, 0)
+            if copied >= rows:
+                continue
+            if copied:
+                # Удалять строки из реплицированных шардов миграция не берется
+                partial.append(partition)
+                continue
+            self._copy(table, partition)
+            logger.info('Миграция %s -> %s: партиция %s, строк %s',
+                        table.source, table.target, partition, rows)
+        if partial:
+            logger.error(
+                'Миграция %s -> %s: партиции %s перенесены частично, '
+                'очистите их в %s и запустите миграцию повторно',
+                table.source, table.target,
+                ', '.join(map(str, partial)), table.target
+            )
+        return not partial
+
+    def _counts(self, table: str, final: bool) -> Dict[int, int]:
+        return dict(self.client.execute(
+            f"""
+                SELECT toYYYYMMDD(event_time) AS partition, count()
+                FROM {table} {'FINAL' if final else ''}
+                GROUP BY partition
+                ORDER BY partition
+            """
+        ))
+
+    def _copy(self, table: MigrationTable, partition: int) -> None:
+        self.client.execute(
+            f"""
+                INSERT INTO {table.target}
+                    (user_id, film_id, start_time, end_time, event_time)
+                SELECT
+                    toUUID(user_id), toUUID(film_id),
+                    start_time, end_time, event_time
+                FROM {table.source} {'FINAL' if table.final else ''}
+                WHERE toYYYYMMDD(event_time) = %(partition)s
+            """,
+            {'partition': partition},
+            # Счетчики строк проверяются сразу после вставки
+            settings={'insert_distributed_sync': 1}
+        )
+
+
+class LastPositionFill:
+    """Заполняет таблицу последних позиций по просмотрам, загруженным
+    до ее появления. Для каждой дневной партиции source в target пишется
+    последняя за день позиция каждой пары пользователь - фильм,
+    ReplacingMergeTree(event_time) оставит из них самую позднюю. Поэтому
+    заполнение можно повторять и запускать, не останавливая ETL."""
+
+    def __init__(self, client: Client, source: str, target: str) -> None:
+        self.client = client
+        self.source = source
+        self.target = target
+
+    def run(self) -> None:
+        partitions = self.client.execute(
+            f"""
+                SELECT DISTINCT toYYYYMMDD(event_time) AS partition
+                FROM {self.source}
+                ORDER BY partition
+            """
+        )
+        for partition, in partitions:
+            self._fill(partition)
+            logger.info('Последние позиции %s -> %s: партиция %s',
+                        self.source, self.target, partition)
+
+    def _fill(self, partition: int) -> None:
+        self.client.execute(
+            f"""
+                INSERT INTO {self.target}
+                    (user_id, film_id, start_time, end_time, event_time)
+                SELECT
+                    user_id, film_id,
+                    argMax(start_time, event_time),
+                    argMax(end_time, event_time),
+                    max(event_time)
+                FROM {self.source}
+                WHERE toYYYYMMDD(event_time) = %(partition)s
+                GROUP BY user_id, film_id
+            """,
+            {'partition': partition},
+            settings={'insert_distributed_sync': 1}
+        )
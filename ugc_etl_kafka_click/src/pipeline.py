@@ -0,0 +1,204 @@
+from logging import getLogger
+from queue import Empty, Full, Queue
+from threading import Event, Thread
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from extract.base import KafkaExtractor
+from extract.schema import KafkaBulkData
+from load.base import LOAD_ERRORS, BaseLoader
+from load.schema import ClickhouseBulkData
+from load.spool import Spool
+from transform.aggregate import Aggregation
+from transform.base import Transformer
+from metrics import BATCH_ROWS, ROWS, SPOOLED_ROWS, STAGE_SECONDS
+
+
+logger = getLogger(__name__)
+
+# Интервал, с которым стадии проверяют флаг остановки, секунды
+QUEUE_TIMEOUT = 1.0
+
+_STOP = object()
+
+
+class Pipeline:
+    """Extract, transform и load работают одновременно и связаны
+    ограниченными очередями: пока пачка N загружается в ClickHouse,
+    из Kafka уже читается пачка N + 1. Оффсеты пачки фиксируются только
+    после ее загрузки. Агрегаты пачки загружаются каждый своим загрузчиком
+    вслед за сырыми данными, без table_name сырые данные не загружаются.
+    Если часть пачки не записалась, в спул она уходит вместе с метками
+    уже записанных частей, и при загрузке спула они не повторяются."""
+
+    def __init__(self,
+                 extractor: KafkaExtractor,
+                 transformer: Transformer,
+                 loader: BaseLoader,
+                 table_name: Optional[str],
+                 queue_size: int,
+                 spool: Optional[Spool] = None,
+                 aggregations: Sequence[Tuple[Aggregation, BaseLoader]] = ()
+                 ) -> None:
+        self.extractor = extractor
+        self.transformer = transformer
+        self.loader = loader
+        self.table_name = table_name
+        self.spool = spool
+        self.aggregations = aggregations
+        self._transform_queue: Queue = Queue(maxsize=queue_size)
+        self._load_queue: Queue = Queue(maxsize=queue_size)
+        self._stop = Event()
+        self._error: Optional[BaseException] = None
+        self.rows_loaded = 0
+
+    def run(self) -> None:
+        workers = [
+            Thread(
+                target=self._stage,
+                args=(self._transform, self._transform_queue,
+                      self._load_queue),
+                name='transform',
+            ),
+            Thread(
+                target=self._stage,
+                args=(self._load, self._load_queue, None),
+                name='load',
+            ),
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            for kafka_bulk_data in self.extractor.get_updates():
+                if not self._put(self._transform_queue, kafka_bulk_data):
+                    break
+        except BaseException:
+            self._stop.set()
+            raise
+        finally:
+            # При штатной остановке дожидаемся загрузки уже прочитанных пачек
+            self._put(self._transform_queue, _STOP)
+            for worker in workers:
+                worker.join()
+        if self._error:
+            raise self._error
+
+    def _transform(self, kafka_bulk_data: KafkaBulkData) -> Any:
+        outputs: List[Tuple[BaseLoader, ClickhouseBulkData]] = []
+        # Результаты агрегатов с состоянием, на случай записи пачки в спул
+        states: Dict[str, ClickhouseBulkData] = {}
+        with STAGE_SECONDS.labels('transform').time():
+            if self.table_name:
+                outputs.append((
+                    self.loader,
+                    self.transformer.kafka_to_clickhouse(
+                        kafka_bulk_data,
+                        self.table_name
+                    )
+                ))
+            for aggregation, loader in self.aggregations:
+                data = aggregation.aggregate(
+                    kafka_bulk_data.payload,
+                    kafka_bulk_data.dedup_token
+                )
+                if data is not None:
+                    outputs.append((loader, data))
+                    if aggregation.stateful:
+                        states[aggregation.table] = data
+        return kafka_bulk_data, outputs, states
+
+    def _load(self, item: Any) -> None:
+        kafka_bulk_data, outputs, states = item
+        rows = len(kafka_bulk_data.payload)
+        stored = True
+        written: Set[str] = set()
+        BATCH_ROWS.observe(rows)
+        with STAGE_SECONDS.labels('load').time():
+            if self.spool is None:
+                for loader, data in outputs:
+                    loader.load(data)
+            elif self.spool.pending or not self._try_insert(outputs, written):
+                if not self._wait_for_spool(self.spool):
+                    # Пачка не отмечена загруженной и будет прочитана заново
+                    self._stop.set()
+                    return
+                # Пока спул не разобран, новые пачки пишутся следом за ним
+                self.spool.append(
+                    kafka_bulk_data.payload,
+                    kafka_bulk_data.dedup_token,
+                    written,
+                    states
+                )
+                stored = False
+        self.extractor.mark_loaded(kafka_bulk_data, stored)
+        self.rows_loaded += rows
+        if stored:
+            ROWS.inc(rows)
+        else:
+            SPOOLED_ROWS.inc(rows)
+
+    def _try_insert(
+        self,
+        outputs: List[Tuple[BaseLoader, ClickhouseBulkData]],
+        written: Set[str]
+    ) -> bool:
+        try:
+            for loader, data in outputs:
+                loader.insert(data, written)
+        except LOAD_ERRORS:
+            logger.warning('ClickHouse недоступен, пачка записана в спул')
+            return False
+        return True
+
+    def _wait_for_spool(self, spool: Spool) -> bool:
+        """Ждет места в спуле. Пока ждет, стадия load не принимает пачки,
+        очереди заполняются и чтение из Kafka приостанавливается.
+        Возвращает False, если пайплайн останавливают."""
+        full = False
+        while not spool.wait_for_space(QUEUE_TIMEOUT):
+            if not full:
+                logger.warning(
+                    'Спул заполнен (%s байт), чтение из Kafka приостановлено',
+                    spool.max_bytes
+                )
+                full = True
+            if self._stop.is_set() or self.extractor.stopped.is_set():
+                return False
+        return True
+
+    def _stage(self,
+               handler: Callable[[Any], Any],
+               source: Queue,
+               target: Optional[Queue]) -> None:
+        try:
+            while True:
+                item = self._get(source)
+                if item is _STOP:
+                    break
+                result = handler(item)
+                if target is not None and not self._put(target, result):
+                    return
+        except BaseException as exc:
+            logger.exception('Ошибка на стадии %s', handler.__name__)
+            self._error = exc
+            self._stop.set()
+            self.extractor.stop()
+            return
+        if target is not None:
+            self._put(target, _STOP)
+
+    def _get(self, queue: Queue) -> Any:
+        while not self._stop.is_set():
+            try:
+                return queue.get(timeout=QUEUE_TIMEOUT)
+            except Empty:
+                continue
+        return _STOP
+
+    def _put(self, queue: Queue, item: Any) -> bool:
+        while not self._stop.is_set():
+            try:
+                queue.put(item, timeout=QUEUE_TIMEOUT)
+                return True
+            except Full:
+                continue
+        return False
@@ -0,0 +1,159 @@
+import os
+import signal
+from dataclasses import dataclass
+from logging import getLogger
+from multiprocessing import Process, Queue
+from queue import Empty
+from threading import Event
+from time import monotonic
+from typing import Callable, Dict, List, Optional
+
+import backoff
+from kafka import KafkaConsumer, errors
+
+from core.config import settings
+
+
+logger = getLogger(__name__)
+
+
+@dataclass
+class WorkerStats:
+    worker: int
+    # Строк загружено с момента предыдущего отчета
+    rows: int
+    # Суммарное отставание по партициям, назначенным воркеру
+    lag: int
+
+
+@backoff.on_exception(backoff.expo,
+                      (errors.NoBrokersAvailable, ConnectionRefusedError),
+                      max_time=settings.backoff_max_time)
+def get_partitions_count(topic: str, server: str) -> int:
+    consumer = KafkaConsumer(bootstrap_servers=[server])
+    try:
+        return len(consumer.partitions_for_topic(topic) or ())
+    finally:
+        consumer.close()
+
+
+def _run_worker(target: Callable[[int, Queue], None],
+                index: int,
+                stats_queue: Queue) -> None:
+    # Обработчики сигналов супервизора не должны наследоваться воркерами
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    target(index, stats_queue)
+
+
+class Supervisor:
+    """Запускает несколько процессов ETL в одной группе консьюмеров,
+    перезапускает упавшие и периодически пишет в лог их суммарную
+    производительность."""
+
+    def __init__(self,
+                 target: Callable[[int, Queue], None],
+                 workers: int,
+                 restart_delay: float,
+                 stats_interval: float) -> None:
+        self.target = target
+        self.workers = workers
+        self.restart_delay = restart_delay
+        self.stats_interval = stats_interval
+        self.stats_queue: Queue = Queue()
+        self._processes: List[Optional[Process]] = [None] * workers
+        self._started: Dict[int, float] = {}
+        self._lag: Dict[int, int] = {}
+        self._rows = 0
+        self._stopped = Event()
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        signal.signal(signal.SIGINT, self._handle_signal)
+        logger.info('Запуск %s воркеров ETL', self.workers)
+        reported = monotonic()
+        try:
+            while not self._stopped.is_set():
+                self._check_workers()
+                self._collect_stats(timeout=1.0)
+                if monotonic() - reported >= self.stats_interval:
+                    self._report(monotonic() - reported)
+                    reported = monotonic()
+        finally:
+            self._shutdown()
+
+    def _handle_signal(self, signum, frame) -> None:
+        logger.info('Получен сигнал %s, остановка воркеров', signum)
+        self._stopped.set()
+
+    def _check_workers(self) -> None:
+        for index, process in enumerate(self._processes):
+            if process is not None and process.is_alive():
+                continue
+            if process is not None:
+                if monotonic() - self._started[index] < self.restart_delay:
+                    continue
+                logger.error(
+                    'Воркер %s завершился с кодом %s, перезапуск',
+                    index,
+                    process.exitcode
+                )
+                self._lag.pop(index, None)
+            self._start_worker(index)
+
+    def _start_worker(self, index: int) -> None:
+        process = Process(
+            target=_run_worker,
+            args=(self.target, index, self.stats_queue),
+            name=f'etl-worker-{index}',
+        )
+        process.start()
+        self._processes[index] = process
+        self._started[index] = monotonic()
+
+    def _collect_stats(self, timeout: float) -> None:
+        try:
+            stats: WorkerStats = self.stats_queue.get(timeout=timeout)
+        except Empty:
+            return
+        while True:
+            self._rows += stats.rows
+            self._lag[stats.worker] = stats.lag
+            try:
+                stats = self.stats_queue.get_nowait()
+            except Empty:
+                return
+
+    def _report(self, elapsed: float) -> None:
+        alive = sum(
+            1 for process in self._processes
+            if process is not None and process.is_alive()
+        )
+        logger.info(
+            'Воркеров: %s/%s, загружено %s строк (%.0f строк/с), '
+            'отставание %s',
+            alive,
+            self.workers,
+            self._rows,
+            self._rows / elapsed if elapsed else 0,
+            sum(self._lag.values())
+        )
+        self._rows = 0
+
+    def _shutdown(self) -> None:
+        for process in self._processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in self._processes:
+            if process is not None:
+                process.join()
+
+
+def get_workers_count() -> int:
+    if settings.etl_workers:
+        return settings.etl_workers
+    partitions = get_partitions_count(
+        settings.kafka_topic,
+        settings.kafka_server
+    )
+    return max(min(partitions, os.cpu_count() or 1), 1)
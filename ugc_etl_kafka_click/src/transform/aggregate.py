@@ -0,0 +1,64 @@
+from abc import ABC, abstractmethod
+from typing import Dict, Optional
+
+from extract.schema import ViewColumns
+from load.schema import ClickhouseBulkData
+
+from .base import Transformer
+
+
+class Aggregation(ABC):
+    """Дополнительная таблица, которая строится из каждой пачки
+    просмотров и загружается вместе с сырыми данными."""
+
+    table: str
+    # Результат зависит от предыдущих пачек, поэтому при загрузке спула
+    # агрегат не пересчитывается: используется результат, посчитанный
+    # при чтении пачки
+    stateful = False
+
+    @abstractmethod
+    def aggregate(
+        self,
+        columns: ViewColumns,
+        dedup_token: Optional[str] = None
+    ) -> Optional[ClickhouseBulkData]:
+        pass
+
+
+def latest_positions(columns: ViewColumns) -> ViewColumns:
+    """Оставляет по одной строке на (user_id, film_id) - с наибольшим
+    event_time, при равенстве - последнюю в пачке."""
+    users = bytes(columns.user_id)
+    films = bytes(columns.film_id)
+    events = columns.event_time
+    latest: Dict[bytes, int] = {}
+    for index in range(len(columns)):
+        offset = index * 16
+        key = users[offset:offset + 16] + films[offset:offset + 16]
+        current = latest.get(key)
+        if current is None or events[index] >= events[current]:
+            latest[key] = index
+    return columns.take(sorted(latest.values()))
+
+
+class LastPosition(Aggregation):
+    """Последняя позиция просмотра по паре пользователь - фильм для
+    ReplacingMergeTree(event_time) таблицы."""
+
+    def __init__(self, transformer: Transformer, table: str) -> None:
+        self.transformer = transformer
+        self.table = table
+
+    def aggregate(
+        self,
+        columns: ViewColumns,
+        dedup_token: Optional[str] = None
+    ) -> Optional[ClickhouseBulkData]:
+        if not len(columns):
+            return None
+        return self.transformer.columns_to_clickhouse(
+            latest_positions(columns),
+            self.table,
+            dedup_token and f'{dedup_token}-last'
+        )
@@ -1,11 +1,21 @@
 from logging import getLogger
-from extract.schema import KafkaBulkData
+from typing import List, Optional
+from extract.schema import KafkaBulkData, ViewColumns
 from load.schema import ClickhouseBulkData
 
 
 logger = getLogger(__name__)
 
 
+def uuids_to_strings(raw: bytearray) -> List[str]:
+    hex_ = raw.hex()
+    return [
+        f'{hex_[i:i + 8]}-{hex_[i + 8:i + 12]}-{hex_[i + 12:i + 16]}-'
+        f'{hex_[i + 16:i + 20]}-{hex_[i + 20:i + 32]}'
+        for i in range(0, len(hex_), 32)
+    ]
+
+
 class Transformer:
 
     def __init__(self) -> None:
@@ -16,14 +26,27 @@ class Transformer:
         kafka_bulk_data: KafkaBulkData,
         click_table_name: str
     ) -> ClickhouseBulkData:
-        query_strings = [f"INSERT INTO {click_table_name} (user_id, film_id, start_time, end_time, event_time) VALUES "] # noqa
-        for row in kafka_bulk_data.payload:
-            timestamp = row.timestamp.replace(tzinfo=None, microsecond=0)
-            query_strings.append(
-                f"('{row.user_id}', '{row.film_id}', {row.start_time}, {row.end_time}, '{timestamp}')," # noqa
-            )
-        result = ClickhouseBulkData(
-            query=''.join(query_strings),
-            count=len(query_strings) - 1
+        return self.columns_to_clickhouse(
+            kafka_bulk_data.payload,
+            click_table_name,
+            kafka_bulk_data.dedup_token
+        )
+
+    def columns_to_clickhouse(
+        self,
+        columns: ViewColumns,
+        click_table_name: str,
+        dedup_token: Optional[str] = None
+    ) -> ClickhouseBulkData:
+        return ClickhouseBulkData(
+            count=len(columns),
+            table=click_table_name,
+            dedup_token=dedup_token,
+            columns=[
+                uuids_to_strings(columns.user_id),
+                uuids_to_strings(columns.film_id),
+                columns.start_time.tolist(),
+                columns.end_time.tolist(),
+                columns.event_time.tolist(),
+            ]
         )
-        return result
@@ -0,0 +1,161 @@
+from logging import getLogger
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from extract.schema import ViewColumns
+from load.schema import SESSION_COLUMNS, ClickhouseBulkData
+from metrics import LATE_HEARTBEATS, OPEN_SESSIONS
+
+from .aggregate import Aggregation
+from .base import uuids_to_strings
+
+
+logger = getLogger(__name__)
+
+
+class Session:
+    """Непрерывный просмотр фильма: отметки, у которых и время события,
+    и позиция в фильме отстоят от сессии не больше чем на gap секунд.
+    started_at входит в ключ строки сессии в ClickHouse и не меняется:
+    отметка раньше начала сессии в нее не попадает."""
+
+    __slots__ = (
+        'key', 'started_at', 'ended_at',
+        'start_time', 'end_time', 'watched', 'heartbeats',
+    )
+
+    def __init__(self, key: bytes, event: int, start: int, end: int) -> None:
+        self.key = key
+        self.started_at = event
+        self.ended_at = event
+        self.start_time = start
+        self.end_time = max(end, start)
+        self.watched = self.end_time - start
+        self.heartbeats = 1
+
+    def accepts(self, event: int, start: int, gap: int) -> bool:
+        in_time = self.started_at <= event <= self.ended_at + gap
+        in_film = self.start_time - gap <= start <= self.end_time + gap
+        return in_time and in_film
+
+    def add(self, event: int, start: int, end: int) -> None:
+        # Учитываем только секунды, которые еще не покрыты сессией
+        after = max(end - max(start, self.end_time), 0)
+        before = max(min(end, self.start_time) - start, 0)
+        self.watched += after + before
+        self.ended_at = max(self.ended_at, event)
+        self.start_time = min(self.start_time, start)
+        self.end_time = max(self.end_time, end)
+        self.heartbeats += 1
+
+
+class Sessionizer(Aggregation):
+    """Склеивает отметки просмотра в сессии.
+
+    Каждая пачка выдает текущее состояние всех затронутых ею сессий,
+    таблица сессий - ReplacingMergeTree(heartbeats), поэтому остается
+    последнее состояние сессии. Сессия забывается, когда водяной знак
+    (максимальное время события минус lateness) уходит дальше ее конца
+    больше чем на gap. Отметка старше водяного знака, не попавшая
+    в открытую сессию, записывается отдельной сессией. Один экземпляр
+    используется пайплайном и загрузкой спула из разных потоков.
+    """
+
+    stateful = True
+
+    def __init__(self, table: str, gap: int, lateness: int) -> None:
+        self.table = table
+        self.gap = gap
+        self.lateness = lateness
+        self._open: Dict[bytes, Session] = {}
+        self._max_event: Optional[int] = None
+        self._lock = Lock()
+
+    @property
+    def watermark(self) -> Optional[int]:
+        if self._max_event is None:
+            return None
+        return self._max_event - self.lateness
+
+    def aggregate(
+        self,
+        columns: ViewColumns,
+        dedup_token: Optional[str] = None
+    ) -> Optional[ClickhouseBulkData]:
+        if not len(columns):
+            return None
+        with self._lock:
+            touched = self._merge(columns)
+            self._max_event = max(
+                self._max_event or 0,
+                max(columns.event_time)
+            )
+            self._expire()
+            return self._to_clickhouse(touched, dedup_token)
+
+    def _merge(self, columns: ViewColumns) -> List[Session]:
+        users = bytes(columns.user_id)
+        films = bytes(columns.film_id)
+        starts = columns.start_time
+        ends = columns.end_time
+        events = columns.event_time
+        watermark = self.watermark
+        touched: Dict[Tuple[bytes, int], Session] = {}
+        late = 0
+        for index in sorted(range(len(columns)), key=events.__getitem__):
+            offset = index * 16
+            key = users[offset:offset + 16] + films[offset:offset + 16]
+            event = events[index]
+            session = self._open.get(key)
+            if session is not None and session.accepts(
+                    event, starts[index], self.gap):
+                session.add(event, starts[index], ends[index])
+            else:
+                if watermark is not None and event < watermark:
+                    late += 1
+                # Запоздавшая отметка не должна вытеснять открытую сессию
+                replace = session is None or event >= session.ended_at
+                session = Session(key, event, starts[index], ends[index])
+                if replace:
+                    self._open[key] = session
+            touched[(key, id(session))] = session
+        if late:
+            LATE_HEARTBEATS.inc(late)
+            logger.info('Отметок позже водяного знака: %s', late)
+        return list(touched.values())
+
+    def _expire(self) -> None:
+        watermark = self.watermark
+        if watermark is None:
+            return
+        limit = watermark - self.gap
+        for key, session in list(self._open.items()):
+            if session.ended_at < limit:
+                del self._open[key]
+        OPEN_SESSIONS.set(len(self._open))
+
+    def _to_clickhouse(
+        self,
+        sessions: List[Session],
+        dedup_token: Optional[str]
+    ) -> ClickhouseBulkData:
+        return ClickhouseBulkData(
+            count=len(sessions),
+            table=self.table,
+            column_names=SESSION_COLUMNS,
+            dedup_token=dedup_token and f'{dedup_token}-sessions',
+            columns=[
+                uuids_to_strings(
+                    bytearray(b''.join(s.key[:16] for s in sessions))
+                ),
+                uuids_to_strings(
+                    bytearray(b''.join(s.key[16:] for s in sessions))
+                ),
+                [s.started_at for s in sessions],
+                [s.ended_at for s in sessions],
+                [s.start_time for s in sessions],
+                [s.end_time for s in sessions],
+                [s.watched for s in sessions],
+                [s.heartbeats for s in sessions],
+            ]
+        )
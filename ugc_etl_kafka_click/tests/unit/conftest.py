@@ -0,0 +1,16 @@
+import os
+import sys
+
+SRC_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    'src'
+)
+sys.path.insert(0, SRC_DIR)
+
+# Минимальные настройки ETL, без них core.config не загрузится
+os.environ.setdefault('KAFKA_TOPIC', 'views')
+os.environ.setdefault('KAFKA_SERVER', 'localhost:9092')
+os.environ.setdefault('KAFKA_GROUPID', 'ugc_etl')
+os.environ.setdefault('CLICKHOUSE_HOST', 'localhost')
+os.environ.setdefault('CLICKHOUSE_TABLENAME', 'default.view')
+os.environ.setdefault('BACKOFF_MAX_TIME', '1')
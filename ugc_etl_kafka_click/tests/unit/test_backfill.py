@@ -0,0 +1,41 @@
+from datetime import datetime, timezone
+
+from backfill import split_ranges
+from extract.replay import PartitionRange, parse_bound
+
+
+def test_integer_bound_is_offset():
+    assert parse_bound('1500') == 1500
+
+
+def test_naive_time_bound_is_utc():
+    assert parse_bound('2023-06-01T12:00:00') == \
+        datetime(2023, 6, 1, 12, tzinfo=timezone.utc)
+
+
+def test_time_bound_keeps_its_timezone():
+    assert parse_bound('2023-06-01T12:00:00+03:00').utcoffset().seconds == 3 * 3600
+
+
+def test_empty_range_has_zero_length():
+    assert len(PartitionRange(partition=0, start=10, end=5)) == 0
+
+
+def test_partitions_are_balanced_by_record_count():
+    ranges = [
+        PartitionRange(partition=0, start=0, end=100),
+        PartitionRange(partition=1, start=0, end=60),
+        PartitionRange(partition=2, start=0, end=50),
+        PartitionRange(partition=3, start=0, end=10),
+    ]
+
+    groups = split_ranges(ranges, 2)
+
+    assert [[part.partition for part in group] for group in groups] == \
+        [[0, 3], [1, 2]]
+
+
+def test_idle_workers_are_dropped():
+    ranges = [PartitionRange(partition=0, start=0, end=100)]
+
+    assert len(split_ranges(ranges, 4)) == 1
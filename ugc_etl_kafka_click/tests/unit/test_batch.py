@@ -0,0 +1,63 @@
+from time import monotonic
+from types import SimpleNamespace
+from uuid import uuid4
+
+from extract.batch import Batch, BatchPolicy
+from testdata import view_columns
+
+
+def record(partition, offset, size=100):
+    return SimpleNamespace(partition=partition, offset=offset, serialized_value_size=size)
+
+
+def rows(count):
+    return view_columns(*[(uuid4(), uuid4(), 1, 2, 3)] * count)
+
+
+def test_empty_batch_is_never_ready():
+    batch = Batch('views')
+    batch.started = monotonic() - 100
+
+    assert not BatchPolicy(1, 1, 0).is_ready(batch)
+
+
+def test_batch_is_ready_by_rows():
+    batch = Batch('views')
+    batch.add(rows(3), [record(0, offset) for offset in range(3)])
+
+    assert not BatchPolicy(4, 10 ** 6, 60).is_ready(batch)
+    assert BatchPolicy(3, 10 ** 6, 60).is_ready(batch)
+
+
+def test_batch_is_ready_by_bytes():
+    batch = Batch('views')
+    batch.add(rows(2), [record(0, 0, 600), record(0, 1, 600)])
+
+    assert batch.size == 1200
+    assert BatchPolicy(100, 1000, 60).is_ready(batch)
+
+
+def test_batch_is_ready_by_age():
+    batch = Batch('views')
+    batch.add(rows(1), [record(0, 0)])
+    policy = BatchPolicy(100, 10 ** 6, 10)
+
+    assert not policy.is_ready(batch)
+    batch.started = monotonic() - 11
+    assert policy.is_ready(batch)
+    assert policy.time_left(batch) == 0
+
+
+def test_batch_tracks_offset_range_per_partition():
+    batch = Batch('views')
+    batch.add(rows(3), [record(0, 5), record(1, 7), record(0, 6)])
+
+    assert batch.data.offsets == {0: (5, 6), 1: (7, 7)}
+
+
+def test_rows_left_is_at_least_one():
+    batch = Batch('views')
+    batch.add(rows(3), [record(0, offset) for offset in range(3)])
+
+    assert BatchPolicy(2, 10 ** 6, 60).rows_left(batch) == 1
+    assert BatchPolicy(10, 10 ** 6, 60).rows_left(batch) == 7
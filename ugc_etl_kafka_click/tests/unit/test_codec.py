@@ -0,0 +1,47 @@
+from uuid import uuid4
+
+from extract.codec import MARKER, VERSION, VIEW_V1, decode_binary, is_binary
+from extract.decoder import decode_views
+from testdata import EVENT_TIME, view_json
+
+
+def view_binary(user_id=None, film_id=None, start_time=10, end_time=20,
+                version=VERSION):
+    return VIEW_V1.pack(
+        MARKER, version, (user_id or uuid4()).bytes, (film_id or uuid4()).bytes,
+        start_time, end_time, int(EVENT_TIME.timestamp() * 1000)
+    )
+
+
+def test_binary_record_is_decoded():
+    user_id, film_id = uuid4(), uuid4()
+
+    columns = decode_binary([view_binary(user_id, film_id, 5, 15)])
+
+    assert bytes(columns.user_id) == user_id.bytes
+    assert bytes(columns.film_id) == film_id.bytes
+    assert (columns.start_time[0], columns.end_time[0]) == (5, 15)
+    assert columns.event_time[0] == int(EVENT_TIME.timestamp())
+
+
+def test_only_bytes_with_marker_are_binary():
+    assert is_binary(view_binary())
+    assert not is_binary(view_json())
+    assert not is_binary(b'')
+    assert not is_binary(None)
+
+
+def test_tombstones_are_rejected_in_mixed_poll():
+    values = [view_json(), None, view_binary(), view_binary(version=9), None]
+
+    columns, rejected = decode_views(values)
+
+    assert len(columns) == 2
+    assert rejected == [(1, 'tombstone'), (3, 'invalid_binary'), (4, 'tombstone')]
+
+
+def test_poll_of_tombstones_only_is_rejected():
+    columns, rejected = decode_views([None])
+
+    assert len(columns) == 0
+    assert rejected == [(0, 'tombstone')]
@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+import orjson
+
+from extract.decoder import decode_views
+from testdata import EVENT_TIME, view_json
+
+
+def test_valid_poll_is_decoded_into_columns():
+    user_id, film_id = uuid4(), uuid4()
+
+    columns, rejected = decode_views([
+        view_json(user_id, film_id, 5, 15),
+        view_json(user_id, film_id, 15, 25),
+    ])
+
+    assert rejected == []
+    assert len(columns) == 2
+    assert bytes(columns.user_id) == user_id.bytes * 2
+    assert bytes(columns.film_id) == film_id.bytes * 2
+    assert list(columns.start_time) == [5, 15]
+    assert list(columns.end_time) == [15, 25]
+    assert list(columns.event_time) == [int(EVENT_TIME.timestamp())] * 2
+
+
+def test_invalid_records_are_rejected_and_the_rest_is_kept():
+    values = [
+        view_json(),
+        b'not json',
+        view_json(start_time=70000),
+        orjson.dumps({'user_id': 'bad'}),
+        view_json(),
+    ]
+
+    columns, rejected = decode_views(values)
+
+    assert len(columns) == 2
+    assert [index for index, _ in rejected] == [1, 2, 3]
+    assert rejected[0][1] == 'invalid_json'
+
+
+def test_naive_timestamp_is_read_as_utc_and_aware_is_converted():
+    naive = EVENT_TIME.replace(tzinfo=None)
+    shifted = EVENT_TIME.astimezone(timezone(timedelta(hours=3)))
+
+    columns, _ = decode_views([view_json(timestamp=naive), view_json(timestamp=shifted)])
+
+    assert list(columns.event_time) == [int(EVENT_TIME.timestamp())] * 2
+
+
+def test_non_canonical_uuid_falls_back_to_model_validation():
+    user_id = uuid4()
+    value = orjson.dumps({
+        'user_id': user_id.hex,
+        'film_id': str(uuid4()),
+        'start_time': 1,
+        'end_time': 2,
+        'timestamp': datetime(2023, 1, 1).isoformat(),
+    })
+
+    columns, rejected = decode_views([value])
+
+    assert rejected == []
+    assert bytes(columns.user_id) == user_id.bytes
@@ -0,0 +1,86 @@
+from uuid import uuid4
+
+from load.spool import SegmentReader, Spool
+from migrate import LastPositionFill
+from pipeline import Pipeline
+from test_load import make_loader
+from test_pipeline import FakeExtractor, FakeLoader, bulk
+from testdata import view_columns
+from transform.aggregate import LastPosition, latest_positions
+from transform.base import Transformer
+
+
+class FakeClient:
+    def __init__(self, partitions):
+        self.partitions = partitions
+        self.calls = []
+
+    def execute(self, query, params=None, settings=None):
+        self.calls.append((query, params))
+        return [(partition,) for partition in self.partitions]
+
+
+def test_latest_event_per_user_and_film_is_kept():
+    user, film, other = uuid4(), uuid4(), uuid4()
+    columns = view_columns(
+        (user, film, 10, 20, 100),
+        (user, film, 30, 40, 300),
+        (user, other, 1, 2, 200),
+        (user, film, 50, 60, 200),
+    )
+
+    latest = latest_positions(columns)
+
+    assert list(latest.start_time) == [30, 1]
+    assert list(latest.event_time) == [300, 200]
+
+
+def test_equal_event_times_keep_last_in_batch():
+    user, film = uuid4(), uuid4()
+    columns = view_columns((user, film, 10, 20, 100), (user, film, 30, 40, 100))
+
+    assert list(latest_positions(columns).start_time) == [30]
+
+
+def test_clickhouse_loader_skips_written_table():
+    loader = make_loader()
+    data = LastPosition(Transformer(), 'default.view_last').aggregate(
+        view_columns((uuid4(), uuid4(), 1, 2, 3))
+    )
+    written = set()
+
+    loader.insert(data, written)
+    loader.insert(data, written)
+
+    assert written == {'default.view_last'}
+    assert len(loader._client.calls) == 1
+
+
+def test_failed_aggregate_is_spooled_without_raw_rows(tmp_path):
+    batch = bulk(0, 0)
+    spool = Spool(str(tmp_path), 1024 * 1024, 1024 * 1024)
+    raw = FakeLoader()
+    last = FakeLoader(fail=ConnectionRefusedError())
+    pipeline = Pipeline(
+        FakeExtractor([batch]), Transformer(), raw, 'default.view', 1, spool,
+        [(LastPosition(Transformer(), 'default.view_last'), last)]
+    )
+
+    pipeline.run()
+    spool.seal()
+
+    assert len(raw.inserted) == 1
+    (_, _, written), = SegmentReader(spool.sealed()[0])
+    assert written == {'default.view'}
+
+
+def test_last_positions_are_filled_per_partition():
+    client = FakeClient([20230601, 20230602])
+
+    LastPositionFill(client, 'default.view_v2', 'default.view_last_v2').run()
+
+    queries = client.calls[1:]
+    assert [params for _, params in queries] == \
+        [{'partition': 20230601}, {'partition': 20230602}]
+    assert 'INSERT INTO default.view_last_v2' in queries[0][0]
+    assert 'argMax(start_time, event_time)' in queries[0][0]
@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+
+from load.base import ClickhouseLoader
+from load.schema import ClickhouseBulkData
+
+
+class FakeClient:
+    def __init__(self):
+        self.connection = SimpleNamespace(connected=True)
+        self.calls = []
+
+    def execute(self, query, params, **kwargs):
+        self.calls.append((query, params, kwargs))
+
+
+def make_loader(deduplicate=False):
+    loader = ClickhouseLoader('localhost', deduplicate=deduplicate)
+    loader._client = FakeClient()
+    return loader
+
+
+def test_insert_sends_columns_in_native_columnar_form():
+    loader = make_loader()
+    data = ClickhouseBulkData(count=1, table='t', columns=[['u'], ['f'], [1], [2], [3]])
+
+    loader.insert(data)
+
+    (query, params, kwargs), = loader._client.calls
+    assert query == data.query
+    assert params == data.columns
+    assert kwargs == {'columnar': True, 'settings': {}}
+
+
+def test_insert_passes_dedup_token_when_enabled():
+    loader = make_loader(deduplicate=True)
+    data = ClickhouseBulkData(count=1, table='t', columns=[[]] * 5, dedup_token='tok')
+
+    loader.insert(data)
+
+    settings = loader._client.calls[0][2]['settings']
+    assert settings == {'insert_deduplicate': 1, 'insert_deduplication_token': 'tok'}
@@ -0,0 +1,55 @@
+from kafka import TopicPartition
+
+from extract.base import KafkaExtractor
+from extract.batch import BatchPolicy
+from metrics import CONSUMER_LAG, REJECTED
+from test_rejects import record
+
+
+class FakeConsumer:
+    def __init__(self, highwater, position):
+        self._highwater = highwater
+        self._position = position
+
+    def assignment(self):
+        return {TopicPartition('views', p) for p in self._highwater}
+
+    def highwater(self, partition):
+        return self._highwater[partition.partition]
+
+    def position(self, partition):
+        return self._position[partition.partition]
+
+
+def lag_of(partition):
+    return CONSUMER_LAG.labels(str(partition))._value.get()
+
+
+def make_extractor():
+    return KafkaExtractor('views', 'localhost:9092', 'ugc_etl',
+                          BatchPolicy(10, 1024, 1))
+
+
+def test_consumer_lag_follows_assignment():
+    extractor = make_extractor()
+    extractor._consumer = FakeConsumer({0: 100, 1: 50}, {0: 90, 1: 50})
+    extractor._update_lag()
+    assert extractor.lag == {0: 10, 1: 0}
+    assert lag_of(0) == 10
+
+    extractor._consumer = FakeConsumer({1: 70}, {1: 60})
+    extractor._update_lag()
+
+    assert extractor.lag == {1: 10}
+    assert '0' not in {
+        sample.labels['partition']
+        for metric in CONSUMER_LAG.collect() for sample in metric.samples
+    }
+
+
+def test_rejected_records_are_counted_by_reason():
+    before = REJECTED.labels('empty')._value.get()
+
+    make_extractor().rejects.handle([(record(1, None), 'empty')])
+
+    assert REJECTED.labels('empty')._value.get() == before + 1
@@ -0,0 +1,52 @@
+from migrate import Migration, MigrationTable
+
+
+class FakeClient:
+    def __init__(self, counts):
+        # Таблица -> {партиция: строк}
+        self.counts = counts
+        self.copied = []
+        self.queries = []
+
+    def execute(self, query, params=None, settings=None):
+        self.queries.append(query)
+        if query.lstrip().startswith('INSERT'):
+            self.copied.append((query, params['partition'], settings))
+            return []
+        table = next(name for name in self.counts if f'FROM {name} ' in query)
+        return list(self.counts[table].items())
+
+
+def test_missing_partitions_are_copied_with_uuid_conversion():
+    client = FakeClient({
+        'default.view': {20230601: 10, 20230602: 5},
+        'default.view_v2': {20230601: 10},
+    })
+
+    completed = Migration(client, [MigrationTable('default.view', 'default.view_v2')]).run()
+
+    assert completed
+    (query, partition, settings), = client.copied
+    assert partition == 20230602
+    assert 'toUUID(user_id)' in query
+    assert settings == {'insert_distributed_sync': 1}
+
+
+def test_partially_copied_partition_fails_migration():
+    client = FakeClient({
+        'default.view': {20230601: 10},
+        'default.view_v2': {20230601: 3},
+    })
+
+    completed = Migration(client, [MigrationTable('default.view', 'default.view_v2')]).run()
+
+    assert not completed
+    assert client.copied == []
+
+
+def test_replacing_tables_are_compared_with_final():
+    client = FakeClient({'default.view_last': {}, 'default.view_last_v2': {}})
+
+    Migration(client, [MigrationTable('default.view_last', 'default.view_last_v2', final=True)]).run()
+
+    assert all('FINAL' in query for query in client.queries)
@@ -0,0 +1,70 @@
+from clickhouse_driver import errors
+
+from extract.base import KafkaExtractor
+from extract.batch import BatchPolicy
+from load.offsets import OffsetStore
+from test_rejects import record
+
+
+class FakeClient:
+    def __init__(self, rows=(), fail=False):
+        self.rows = rows
+        self.fail = fail
+        self.calls = []
+
+    def execute(self, query, params=None):
+        self.calls.append((query, params))
+        if self.fail:
+            raise errors.NetworkError('down')
+        return list(self.rows)
+
+
+class FakeStore:
+    def __init__(self, *answers):
+        self.answers = list(answers)
+        self.calls = 0
+
+    def get(self, topic):
+        self.calls += 1
+        return self.answers.pop(0)
+
+
+def make_store(client):
+    store = OffsetStore('localhost', 'default.etl_offsets', 'ugc_etl')
+    store._client = client
+    return store
+
+
+def test_offsets_are_read_for_consumer_group():
+    store = make_store(FakeClient(rows=[(0, 41)]))
+
+    assert store.get('views') == {0: 41}
+    _, params = store._client.calls[0]
+    assert params == {'topic': 'views', 'group_id': 'ugc_etl'}
+
+
+def test_saved_offsets_carry_consumer_group():
+    store = make_store(FakeClient())
+
+    store.save('views', {0: 41})
+
+    _, params = store._client.calls[0]
+    assert params == [('views', 0, 41, 'ugc_etl')]
+
+
+def test_unavailable_store_returns_none():
+    assert make_store(FakeClient(fail=True)).get('views') is None
+
+
+def test_offsets_are_requested_again_after_store_error():
+    store = FakeStore(None, {0: 5})
+    extractor = KafkaExtractor('views', 'localhost:9092', 'ugc_etl',
+                               BatchPolicy(10, 1024, 1), offset_store=store)
+    records = [record(offset) for offset in range(4, 8)]
+
+    first = extractor._skip_loaded(records)
+    second = extractor._skip_loaded(records)
+
+    assert [r.offset for r in first] == [4, 5, 6, 7]
+    assert [r.offset for r in second] == [6, 7]
+    assert store.calls == 2
@@ -0,0 +1,102 @@
+from threading import Event
+from uuid import uuid4
+
+import pytest
+
+from extract.schema import KafkaBulkData
+from load.base import BaseLoader
+from load.spool import Spool
+from pipeline import Pipeline
+from testdata import view_columns
+from transform.base import Transformer
+
+
+class FakeExtractor:
+    def __init__(self, batches):
+        self.batches = batches
+        self.loaded = []
+        self.stopped = Event()
+
+    def get_updates(self):
+        yield from self.batches
+
+    def mark_loaded(self, batch, stored=True):
+        self.loaded.append((batch, stored))
+
+    def stop(self):
+        self.stopped.set()
+
+
+class FakeLoader(BaseLoader):
+    def __init__(self, fail=None):
+        self.inserted = []
+        self.fail = fail
+
+    def load(self, transformed_data):
+        self.insert(transformed_data)
+
+    def insert(self, transformed_data, written=None):
+        if written is not None and transformed_data.table in written:
+            return
+        if self.fail:
+            raise self.fail
+        self.inserted.append(transformed_data)
+        if written is not None:
+            written.add(transformed_data.table)
+
+
+def bulk(partition, offset, rows=2):
+    return KafkaBulkData(
+        payload=view_columns(*[(uuid4(), uuid4(), 1, 2, 3)] * rows),
+        topic='views',
+        offsets={partition: (offset, offset + rows - 1)},
+    )
+
+
+def test_batches_are_loaded_in_order_and_marked_loaded():
+    batches = [bulk(0, 0), bulk(0, 2), bulk(1, 0)]
+    extractor = FakeExtractor(batches)
+    loader = FakeLoader()
+
+    pipeline = Pipeline(extractor, Transformer(), loader, 'default.view', 1)
+    pipeline.run()
+
+    assert [data.dedup_token for data in loader.inserted] == \
+        [batch.dedup_token for batch in batches]
+    assert extractor.loaded == [(batch, True) for batch in batches]
+    assert pipeline.rows_loaded == 6
+
+
+def test_load_error_stops_pipeline_and_is_raised():
+    extractor = FakeExtractor([bulk(0, 0)])
+    loader = FakeLoader(fail=ValueError('boom'))
+
+    with pytest.raises(ValueError):
+        Pipeline(extractor, Transformer(), loader, 'default.view', 1).run()
+
+    assert extractor.stopped.is_set()
+    assert extractor.loaded == []
+
+
+def test_batch_is_spooled_when_clickhouse_is_down(tmp_path):
+    batch = bulk(0, 0)
+    extractor = FakeExtractor([batch])
+    spool = Spool(str(tmp_path), 1024 * 1024, 1024 * 1024)
+    loader = FakeLoader(fail=ConnectionRefusedError())
+
+    Pipeline(extractor, Transformer(), loader, 'default.view', 1, spool).run()
+
+    assert extractor.loaded == [(batch, False)]
+    assert spool.pending
+
+
+def test_full_spool_leaves_batch_unmarked_on_stop(tmp_path):
+    extractor = FakeExtractor([bulk(0, 0)])
+    extractor.stop()
+    spool = Spool(str(tmp_path), 1024 * 1024, 0)
+    loader = FakeLoader(fail=ConnectionRefusedError())
+
+    Pipeline(extractor, Transformer(), loader, 'default.view', 1, spool).run()
+
+    assert extractor.loaded == []
+    assert not spool.pending
@@ -0,0 +1,57 @@
+import pytest
+from kafka import errors
+from kafka.consumer.fetcher import ConsumerRecord
+
+from extract.rejects import RejectedRecords
+
+
+class FakeFuture:
+    def __init__(self, error=None):
+        self.error = error
+
+    def get(self, timeout=None):
+        if self.error:
+            raise self.error
+
+
+class FakeProducer:
+    def __init__(self, error=None):
+        self.error = error
+        self.sent = []
+        self.flushed = False
+
+    def send(self, topic, **kwargs):
+        self.sent.append((topic, kwargs))
+        return FakeFuture(self.error)
+
+    def flush(self, timeout=None):
+        self.flushed = True
+
+
+def record(offset, value=b'{}'):
+    return ConsumerRecord('views', 0, offset, 0, 0, None, value, [], None, -1, 2, -1)
+
+
+def make_rejects(producer):
+    rejects = RejectedRecords('localhost:9092', 'views_dead_letter', 60)
+    rejects._producer = producer
+    return rejects
+
+
+def test_rejected_records_are_sent_with_reason():
+    producer = FakeProducer()
+
+    make_rejects(producer).handle([(record(5), 'invalid_json')])
+
+    (topic, kwargs), = producer.sent
+    assert topic == 'views_dead_letter'
+    assert ('error', b'invalid_json') in kwargs['headers']
+    assert ('source_offset', b'5') in kwargs['headers']
+    assert producer.flushed
+
+
+def test_failed_delivery_is_raised():
+    producer = FakeProducer(errors.KafkaTimeoutError())
+
+    with pytest.raises(errors.KafkaError):
+        make_rejects(producer).handle([(record(5), 'invalid_json')])
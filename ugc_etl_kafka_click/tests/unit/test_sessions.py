@@ -0,0 +1,91 @@
+from uuid import uuid4
+
+import pytest
+
+from extract.schema import KafkaBulkData
+from load.spool import Spool, SpoolDrainer
+from pipeline import Pipeline
+from test_pipeline import FakeExtractor, FakeLoader
+from testdata import view_columns
+from transform.base import Transformer
+from transform.sessions import Sessionizer
+
+USER, FILM = uuid4(), uuid4()
+
+
+def sessionizer():
+    return Sessionizer('default.view_sessions', gap=60, lateness=30)
+
+
+def heartbeats(*rows):
+    return view_columns(*[(USER, FILM, start, end, event) for start, end, event in rows])
+
+
+def sessions(data):
+    names = ('started_at', 'ended_at', 'start_time', 'end_time', 'watched', 'heartbeats')
+    return [dict(zip(names, row)) for row in zip(*data.columns[2:])]
+
+
+def test_consecutive_heartbeats_form_one_session():
+    data = sessionizer().aggregate(heartbeats((0, 10, 1000), (10, 20, 1010), (15, 30, 1020)))
+
+    assert sessions(data) == [{
+        'started_at': 1000, 'ended_at': 1020, 'start_time': 0,
+        'end_time': 30, 'watched': 30, 'heartbeats': 3,
+    }]
+
+
+def test_gap_starts_new_session():
+    data = sessionizer().aggregate(heartbeats((0, 10, 1000), (10, 20, 2000)))
+
+    assert [s['started_at'] for s in sessions(data)] == [1000, 2000]
+
+
+def test_heartbeat_before_session_start_keeps_session_key():
+    aggregation = sessionizer()
+    aggregation.aggregate(heartbeats((10, 20, 1010), (20, 30, 1020)))
+
+    data = aggregation.aggregate(heartbeats((0, 10, 1000), (30, 40, 1030)))
+
+    assert sorted((s['started_at'], s['heartbeats']) for s in sessions(data)) == \
+        [(1000, 1), (1010, 3)]
+
+
+def test_spooled_batch_is_not_sessionized_twice(tmp_path):
+    aggregation = sessionizer()
+    batch = KafkaBulkData(payload=heartbeats((0, 10, 1000)), topic='views',
+                          offsets={0: (0, 0)})
+    spool = Spool(str(tmp_path), 1024 * 1024, 1024 * 1024)
+    Pipeline(
+        FakeExtractor([batch]), Transformer(), FakeLoader(), None, 1, spool,
+        [(aggregation, FakeLoader(fail=ConnectionRefusedError()))]
+    ).run()
+    spool.seal()
+    loader = FakeLoader()
+    drainer = SpoolDrainer(spool, Transformer(), FakeLoader(), None, 1,
+                           [(aggregation, loader)])
+
+    drainer._drain(spool.sealed()[0])
+
+    data, = loader.inserted
+    assert [s['heartbeats'] for s in sessions(data)] == [1]
+    assert aggregation._open[USER.bytes + FILM.bytes].heartbeats == 1
+
+
+def test_batch_spooled_before_restart_is_sessionized_once(tmp_path):
+    spool = Spool(str(tmp_path), 1024 * 1024, 1024 * 1024)
+    spool.append(heartbeats((0, 10, 1000)), 'token')
+    spool.seal()
+    restarted = Spool(str(tmp_path), 1024 * 1024, 1024 * 1024)
+    aggregation = sessionizer()
+    loader = FakeLoader(fail=ConnectionRefusedError())
+    drainer = SpoolDrainer(restarted, Transformer(), FakeLoader(), None, 1,
+                           [(aggregation, loader)])
+    path, = restarted.sealed()
+
+    with pytest.raises(ConnectionRefusedError):
+        drainer._drain(path)
+    loader.fail = None
+    drainer._drain(path)
+
+    assert [s['heartbeats'] for s in sessions(loader.inserted[0])] == [1]
@@ -0,0 +1,64 @@
+import zlib
+from uuid import uuid4
+
+import pytest
+
+from load.schema import ClickhouseBulkData
+from load.sharded import Shard, ShardedClickhouseLoader, shard_key
+from test_pipeline import FakeLoader
+
+
+def make_loader(*weights):
+    shards = [
+        Shard(num=num, weight=weight, host=f'ch{num}', port=9000, database='shard')
+        for num, weight in enumerate(weights, start=1)
+    ]
+    loader = ShardedClickhouseLoader('localhost', None, 'cluster', 'view', shards)
+    loader._loaders = [FakeLoader() for _ in shards]
+    return loader
+
+
+def bulk_data(user_ids, dedup_token='tok'):
+    return ClickhouseBulkData(
+        count=len(user_ids),
+        table='default.view',
+        columns=[user_ids, [str(uuid4())] * len(user_ids), [1] * len(user_ids),
+                 [2] * len(user_ids), [3] * len(user_ids)],
+        dedup_token=dedup_token,
+    )
+
+
+def test_shard_key_matches_clickhouse_crc32():
+    user_id = str(uuid4())
+
+    assert shard_key(user_id) == zlib.crc32(user_id.encode())
+
+
+def test_rows_are_split_by_weighted_slots():
+    loader = make_loader(1, 2)
+    user_ids = [str(uuid4()) for _ in range(50)]
+
+    first, second = loader.split(bulk_data(user_ids))
+
+    assert first.columns[0] == [u for u in user_ids if shard_key(u) % 3 == 0]
+    assert second.columns[0] == [u for u in user_ids if shard_key(u) % 3 != 0]
+    assert (first.table, first.dedup_token) == ('shard.view', 'tok-1')
+    assert (second.table, second.dedup_token) == ('shard.view', 'tok-2')
+
+
+def test_failed_shard_is_retried_alone():
+    loader = make_loader(1, 1)
+    data = bulk_data([str(uuid4()) for _ in range(50)])
+    first, second = loader._loaders
+    second.fail = ConnectionRefusedError()
+    written = set()
+
+    with pytest.raises(ConnectionRefusedError):
+        loader.insert(data, written)
+    second.fail = None
+    loader.insert(data, written)
+
+    assert len(first.inserted) == 1
+    assert len(second.inserted) == 1
+    assert written == {'default.view#1', 'default.view#2'}
+    loader._executor.shutdown()
@@ -0,0 +1,117 @@
+import os
+import zlib
+from uuid import uuid4
+
+from load.spool import (
+    CORRUPT_SUFFIX, HEADER, MAGIC, SegmentReader, Spool, SpoolDrainer
+)
+from test_pipeline import FakeLoader
+from testdata import view_columns
+from transform.aggregate import LastPosition
+from transform.base import Transformer
+
+
+def columns(rows=2):
+    return view_columns(*[(uuid4(), uuid4(), 1, 2, 3)] * rows)
+
+
+def sealed_segment(spool, *batches):
+    for index, batch in enumerate(batches):
+        spool.append(batch, f'token-{index}')
+    spool.seal()
+    path, = spool.sealed()
+    return path
+
+
+def test_segment_is_read_back_with_tokens(tmp_path):
+    spool = Spool(str(tmp_path), 1024 * 1024, 1024 * 1024)
+    batches = [columns(2), columns(3)]
+
+    records = list(SegmentReader(sealed_segment(spool, *batches)))
+
+    assert [(c.user_id, c.event_time, token) for c, token, _ in records] == \
+        [(b.user_id, b.event_time, f'token-{i}') for i, b in enumerate(batches)]
+
+
+def test_corrupt_record_is_skipped(tmp_path):
+    spool = Spool(str(tmp_path), 1024 * 1024, 1024 * 1024)
+    batches = [columns(2), columns(2), columns(2)]
+    path = sealed_segment(spool, *batches)
+    with open(path, 'r+b') as segment:
+        # Портим данные второй записи
+        segment.seek(2 * HEADER.size + len('token-0') + 2 * 44 + 10)
+        segment.write(b'\xff' * 4)
+
+    reader = SegmentReader(path)
+    records = list(reader)
+
+    assert [token for _, token, _ in records] == ['token-0', 'token-2']
+    assert reader.corrupt == 1
+
+
+def test_truncated_tail_is_skipped(tmp_path):
+    spool = Spool(str(tmp_path), 1024 * 1024, 1024 * 1024)
+    path = sealed_segment(spool, columns(2), columns(2))
+    with open(path, 'r+b') as segment:
+        segment.truncate(os.path.getsize(path) - 5)
+
+    reader = SegmentReader(path)
+
+    assert [token for _, token, _ in reader] == ['token-0']
+    assert reader.corrupt == 1
+
+
+def test_full_spool_waits_until_segment_is_removed(tmp_path):
+    spool = Spool(str(tmp_path), 1024 * 1024, 100)
+    path = sealed_segment(spool, columns(2))
+
+    assert not spool.wait_for_space(0.01)
+    spool.remove(path)
+    assert spool.wait_for_space(0.01)
+
+
+def test_drainer_quarantines_segment_with_corrupt_records(tmp_path):
+    spool = Spool(str(tmp_path), 1024 * 1024, 1024 * 1024)
+    path = sealed_segment(spool, columns(2))
+    with open(path, 'ab') as segment:
+        segment.write(b'garbage')
+    loader = FakeLoader()
+    drainer = SpoolDrainer(spool, Transformer(), loader, 'default.view', 1)
+
+    drainer._drain(path)
+
+    assert [data.dedup_token for data in loader.inserted] == ['token-0']
+    assert spool.sealed() == []
+    assert os.listdir(tmp_path) == [os.path.basename(path) + CORRUPT_SUFFIX]
+
+
+def test_written_parts_are_stored_and_skipped_by_drainer(tmp_path):
+    spool = Spool(str(tmp_path), 1024 * 1024, 1024 * 1024)
+    spool.append(columns(2), 'token-0', {'default.view'})
+    spool.seal()
+    path, = spool.sealed()
+    raw, last = FakeLoader(), FakeLoader()
+    drainer = SpoolDrainer(
+        spool, Transformer(), raw, 'default.view', 1,
+        [(LastPosition(Transformer(), 'default.view_last'), last)]
+    )
+
+    (_, _, written), = SegmentReader(path)
+    drainer._drain(path)
+
+    assert written == {'default.view'}
+    assert raw.inserted == []
+    assert [data.table for data in last.inserted] == ['default.view_last']
+
+
+def test_record_of_other_version_is_skipped(tmp_path):
+    batch = columns(1)
+    payload = b'tok' + bytes(batch.user_id) + bytes(batch.film_id)
+    header = HEADER.pack(MAGIC, 2, 1, zlib.crc32(payload), 3, 0)
+    path = tmp_path / 'old.seg'
+    path.write_bytes(header + payload)
+
+    reader = SegmentReader(str(path))
+
+    assert list(reader) == []
+    assert reader.corrupt == 1
@@ -0,0 +1,56 @@
+from time import sleep
+
+import supervisor
+from core.config import settings
+from supervisor import Supervisor, WorkerStats, get_workers_count
+
+
+def exit_immediately(index, stats_queue):
+    pass
+
+
+def test_stats_from_workers_are_summed_and_lag_is_kept_per_worker():
+    sup = Supervisor(exit_immediately, 2, 0, 30)
+    for stats in (WorkerStats(0, 10, 5), WorkerStats(1, 20, 7), WorkerStats(0, 1, 3)):
+        sup.stats_queue.put(stats)
+    # Очередь multiprocessing передает элементы фоновым потоком
+    sleep(0.2)
+
+    sup._collect_stats(timeout=1.0)
+
+    assert sup._rows == 31
+    assert sup._lag == {0: 3, 1: 7}
+
+
+def test_exited_worker_is_restarted_after_delay():
+    sup = Supervisor(exit_immediately, 1, 0, 30)
+    sup._check_workers()
+    first = sup._processes[0]
+    first.join()
+
+    sup._check_workers()
+
+    assert sup._processes[0] is not first
+    sup._shutdown()
+
+
+def test_exited_worker_is_not_restarted_before_delay():
+    sup = Supervisor(exit_immediately, 1, 60, 30)
+    sup._check_workers()
+    first = sup._processes[0]
+    first.join()
+
+    sup._check_workers()
+
+    assert sup._processes[0] is first
+
+
+def test_workers_count_follows_partitions_capped_by_cpus(monkeypatch):
+    monkeypatch.setattr(settings, 'etl_workers', 0)
+    monkeypatch.setattr(supervisor, 'get_partitions_count', lambda *_: 64)
+    monkeypatch.setattr(supervisor.os, 'cpu_count', lambda: 4)
+
+    assert get_workers_count() == 4
+
+    monkeypatch.setattr(settings, 'etl_workers', 3)
+    assert get_workers_count() == 3
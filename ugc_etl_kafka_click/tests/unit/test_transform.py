@@ -0,0 +1,36 @@
+from uuid import uuid4
+
+from load.schema import VIEW_COLUMNS
+from testdata import view_columns
+from transform.base import Transformer, uuids_to_strings
+
+
+def test_uuids_are_converted_to_canonical_strings():
+    uuids = [uuid4() for _ in range(3)]
+
+    strings = uuids_to_strings(bytearray(b''.join(u.bytes for u in uuids)))
+
+    assert strings == [str(u) for u in uuids]
+
+
+def test_columns_are_converted_to_insert_ready_columnar_data():
+    user_id, film_id = uuid4(), uuid4()
+    columns = view_columns(
+        (user_id, film_id, 1, 2, 1685620800),
+        (user_id, film_id, 3, 4, 1685620801),
+    )
+
+    data = Transformer().columns_to_clickhouse(columns, 'default.view', 'abc')
+
+    assert data.count == 2
+    assert data.dedup_token == 'abc'
+    assert data.columns == [
+        [str(user_id)] * 2,
+        [str(film_id)] * 2,
+        [1, 3],
+        [2, 4],
+        [1685620800, 1685620801],
+    ]
+    assert data.query == (
+        f'INSERT INTO default.view ({", ".join(VIEW_COLUMNS)}) VALUES'
+    )
@@ -0,0 +1,35 @@
+from datetime import datetime, timezone
+from typing import Optional
+from uuid import UUID, uuid4
+
+import orjson
+
+from extract.schema import ViewColumns
+
+EVENT_TIME = datetime(2023, 6, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def view_json(user_id: Optional[UUID] = None,
+              film_id: Optional[UUID] = None,
+              start_time: int = 10,
+              end_time: int = 20,
+              timestamp: datetime = EVENT_TIME) -> bytes:
+    return orjson.dumps({
+        'user_id': str(user_id or uuid4()),
+        'film_id': str(film_id or uuid4()),
+        'start_time': start_time,
+        'end_time': end_time,
+        'timestamp': timestamp.isoformat(),
+    })
+
+
+def view_columns(*rows) -> ViewColumns:
+    """Буфер из строк (user_id, film_id, start_time, end_time, event_time)."""
+    columns = ViewColumns()
+    for user_id, film_id, start_time, end_time, event_time in rows:
+        columns.user_id += user_id.bytes
+        columns.film_id += film_id.bytes
+        columns.start_time.append(start_time)
+        columns.end_time.append(end_time)
+        columns.event_time.append(event_time)
+    return columns
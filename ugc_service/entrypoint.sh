@@ -5,6 +5,12 @@ set -o pipefail
 set -o nounset
 
 cd src
+# Метрики воркеров gunicorn собираются из общего каталога
+if [ -n "${PROMETHEUS_MULTIPROC_DIR:-}" ]
+then
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
 if [ "$USE_GUNICORN" = "true" ]
 then
 echo "Starting with GUNICORN"
@@ -1,11 +1,15 @@
 from http import HTTPStatus
 from logging import getLogger
+from typing import Any, List
 from uuid import UUID
 
+from api.utils import get_page_params
 from async_fastapi_jwt_auth import AuthJWT
-from fastapi import APIRouter, Depends, HTTPException
+from core.config import settings
+from db.breaker import DependencyUnavailable
+from fastapi import APIRouter, Depends, HTTPException, Query
 from models.users_films import UserFilmTimestamp
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError, conlist
 from services.users_films import UserFilmService, get_userfilm_service
 
 logger = getLogger(__name__)
@@ -15,6 +19,20 @@ class BaseResponse(BaseModel):
     detail: str
 
 
+class BatchItemResult(BaseModel):
+    index: int
+    detail: str
+
+
+class BatchResponse(BaseModel):
+    accepted: int
+    results: List[BatchItemResult]
+
+
+class LastTimestampsResponse(BaseModel):
+    timestamps: List[UserFilmTimestamp]
+
+
 class HTTPError(BaseModel):
     detail: str
 
@@ -53,6 +71,8 @@ async def create_user_film_timestamp(
         )
     try:
         await ugc_service.create_user_film_timestamp(user_film_data)
+    except DependencyUnavailable:
+        raise
     except BaseException as exception:
         logger.error(exception.__str__())
         return HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=exception.__str__())
@@ -60,6 +80,79 @@ async def create_user_film_timestamp(
     return BaseResponse(detail='ok')
 
 
+@router.post('/batch',
+             summary='Пакетное создание временных меток о просмотренных пользователем частях кинопроизведений', # noqa
+             description='Каждая метка проверяется отдельно, корректные отправляются в Kafka одной пачкой, результат возвращается по каждой метке', # noqa
+             responses={
+                 HTTPStatus.OK: {
+                     'model': BatchResponse,
+                     'description': 'Результат по каждой метке'
+                 },
+                 HTTPStatus.BAD_REQUEST: {'model': HTTPError},
+             })
+async def create_user_film_timestamps(
+        items: conlist(  # type: ignore
+            Any,
+            min_items=1,
+            max_items=settings.users_films_batch_max_size
+        ),
+        ugc_service: UserFilmService = Depends(get_userfilm_service),
+        Authorize: AuthJWT = Depends()
+):
+    await Authorize.jwt_required()
+    current_user = await Authorize.get_jwt_subject()
+    results = [
+        BatchItemResult(index=index, detail='ok')
+        for index in range(len(items))
+    ]
+    # Некорректная метка не должна отклонять остальные метки пачки
+    own = []
+    user_films_data = []
+    foreign = 0
+    for index, item in enumerate(items):
+        try:
+            user_film_data = UserFilmTimestamp.parse_obj(item)
+        except ValidationError as invalid:
+            results[index].detail = _validation_detail(invalid)
+            continue
+        if current_user == str(user_film_data.user_id):
+            own.append(index)
+            user_films_data.append(user_film_data)
+        else:
+            foreign += 1
+            results[index].detail = \
+                'user_id в токене не соответсвует user_id в timestamp'
+    if foreign:
+        logger.error('user_id в токене не соответсвует user_id в %s timestamp',
+                     foreign)
+    if not user_films_data:
+        return BatchResponse(accepted=0, results=results)
+    try:
+        errors = await ugc_service.create_user_film_timestamps(
+            user_films_data
+        )
+    except DependencyUnavailable:
+        raise
+    except BaseException as exception:
+        logger.error(exception.__str__())
+        return HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=exception.__str__())
+
+    accepted = 0
+    for index, error in zip(own, errors):
+        if error is None:
+            accepted += 1
+        else:
+            results[index].detail = str(error)
+    return BatchResponse(accepted=accepted, results=results)
+
+
+def _validation_detail(error: ValidationError) -> str:
+    return '; '.join(
+        f"{'.'.join(map(str, item['loc']))}: {item['msg']}"
+        for item in error.errors()
+    )
+
+
 @router.get('/{user_id}/{film_id}/last_timestamp',
             summary='Получить последнюю временную метку просмотренной пользователем части кинопроизведения', # noqa
             description='Получить последнюю временную метку просмотренной пользователем части кинопроизведения', # noqa
@@ -88,6 +181,8 @@ async def get_last_user_film_timestamp(
         )
     try:
         timestamp = await ugc_service.get_last_timestamp(user_id, film_id)
+    except DependencyUnavailable:
+        raise
     except BaseException as exception:
         logger.error(exception.__str__())
         return HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=exception.__str__())
@@ -95,3 +190,45 @@ async def get_last_user_film_timestamp(
     if not timestamp:
         return
     return timestamp
+
+
+@router.get('/{user_id}/last_timestamps',
+            summary='Продолжить просмотр: последние временные метки пользователя по всем кинопроизведениям', # noqa
+            description='Последняя временная метка по каждому кинопроизведению, сначала недавно просмотренные', # noqa
+            responses={
+                HTTPStatus.OK: {
+                    'model': LastTimestampsResponse,
+                    'description': 'Временные метки'
+                },
+                HTTPStatus.BAD_REQUEST: {'model': HTTPError},
+                HTTPStatus.FORBIDDEN: {'model': HTTPError}
+            })
+async def get_last_user_timestamps(
+        user_id: UUID,
+        film_id: List[UUID] = Query(default=[]),
+        paginate_by: dict = Depends(get_page_params(20, 100)),
+        ugc_service: UserFilmService = Depends(get_userfilm_service),
+        Authorize: AuthJWT = Depends()
+):
+    await Authorize.jwt_required()
+    current_user = await Authorize.get_jwt_subject()
+    raw_jwt = await Authorize.get_raw_jwt()
+    user_roles = raw_jwt['roles']
+    if current_user != str(user_id) and 'admin' not in user_roles:
+        logger.error("Попытка получить timestump не принадлежащие пользователю")
+        return HTTPException(
+            status_code=HTTPStatus.FORBIDDEN, detail="Попытка получить timestump не принадлежащие пользователю"
+        )
+    try:
+        timestamps = await ugc_service.get_last_timestamps(
+            user_id,
+            film_id,
+            **paginate_by
+        )
+    except DependencyUnavailable:
+        raise
+    except BaseException as exception:
+        logger.error(exception.__str__())
+        return HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=exception.__str__())
+
+    return LastTimestampsResponse(timestamps=timestamps)
@@ -1,6 +1,7 @@
 import os
 from logging import config as logging_config
 from contextvars import ContextVar
+from typing import Literal
 
 from core.logger import LOGGING
 from pydantic import BaseSettings
@@ -24,16 +25,71 @@ class Settings(BaseSettings):
     kafka_host: str
     kafka_port: int
     kafka_view_topic: str
+    # Формат сообщений по топикам: json или binary, по умолчанию json
+    kafka_topic_formats: dict[str, Literal['json', 'binary']] = {}
+    # Ждать подтверждения брокера в каждом запросе, иначе только буферизовать
+    kafka_wait_delivery: bool = True
+    # Батчинг продюсера: задержка перед отправкой, мс, и размер пачки, байты
+    kafka_linger_ms: int = 0
+    kafka_max_batch_size: int = 16384
+    kafka_compression_type: (
+        Literal['gzip', 'snappy', 'lz4', 'zstd'] | None
+    ) = None
+    # Предельное время отправки пачки сообщений, секунды
+    kafka_send_timeout: float = 5
+
+    # Максимальное число временных меток в одном пакетном запросе
+    users_films_batch_max_size: int = 500
+    # Окно объединения временных меток перед отправкой в Kafka, секунды,
+    # 0 - метки отправляются сразу
+    users_films_coalesce_window: float = 0
+    users_films_coalesce_max_keys: int = 10000
+    # latest - последняя метка пары, merge - объединение смежных интервалов
+    users_films_coalesce_mode: Literal['latest', 'merge'] = 'merge'
+    # Кэш последних позиций, записанных воркером: число пар и время жизни,
+    # секунды, не меньше задержки ETL. 0 - кэш выключен
+    last_position_cache_size: int = 0
+    last_position_cache_ttl: float = 30
 
     # Настройки ClickHouse
     clickhouse_host: str
     clickhouse_port: str
+    # Таблица последних позиций просмотра, ее ведет ETL
+    clickhouse_last_position_table: str = 'default.view_last'
+    # Версия схемы таблиц просмотров: v1 - исходная, v2 - UUID колонки,
+    # таблицы с суффиксом _v2
+    clickhouse_schema_version: Literal['v1', 'v2'] = 'v1'
+    # Пул соединений: размеры, таймаут запроса и интервал проверки, секунды
+    clickhouse_pool_min_size: int = 1
+    clickhouse_pool_max_size: int = 10
+    clickhouse_query_timeout: float = 5
+    clickhouse_health_check_interval: float = 30
+    # Читать данные пользователя только с его шарда. Включать, когда
+    # таблица последних позиций создана с ключом CRC32(user_id) и данные
+    # записаны через него (см. ch_config/sql), иначе чтение теряет строки
+    # других шардов
+    clickhouse_single_shard_reads: bool = False
+    # Выполнять одинаковые одновременные запросы один раз
+    clickhouse_coalesce_reads: bool = True
+
+    # Предохранители ClickHouse, Kafka и MongoDB: при доле ошибок
+    # failure_rate за window секунд (не меньше min_calls вызовов) вызовы
+    # open_time секунд сразу завершаются 503, затем пропускается
+    # half_open_calls пробных вызовов
+    breaker_enabled: bool = True
+    breaker_failure_rate: float = 0.5
+    breaker_min_calls: int = 20
+    breaker_window: float = 10
+    breaker_open_time: float = 5
+    breaker_half_open_calls: int = 1
 
     # Auth
     authjwt_secret_key: str
 
     # MongoDB settings
     mongodb_uri: str
+    # Предельное время операции MongoDB (timeoutMS), секунды
+    mongodb_timeout: float = 5
 
     # Sentry
     sentry_enabled: bool = True
@@ -42,6 +98,12 @@ class Settings(BaseSettings):
     class Config:
         env_file = ENV_FILE_PATH
 
+    def clickhouse_table(self, name: str) -> str:
+        """Имя таблицы просмотров в выбранной версии схемы."""
+        if self.clickhouse_schema_version == 'v1':
+            return name
+        return f'{name}_{self.clickhouse_schema_version}'
+
 
 logging_config.dictConfig(LOGGING)
 
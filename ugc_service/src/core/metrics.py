@@ -0,0 +1,36 @@
+import os
+
+from prometheus_client import (REGISTRY, CollectorRegistry, Counter,
+                               make_asgi_app, multiprocess)
+
+SINGLE_FLIGHT_CALLS = Counter(
+    'ugc_olap_single_flight_calls_total',
+    'Запросы к ClickHouse через single flight',
+)
+SINGLE_FLIGHT_SHARED = Counter(
+    'ugc_olap_single_flight_shared_total',
+    'Запросы к ClickHouse, получившие результат одновременного запроса',
+)
+
+KAFKA_MESSAGES = Counter(
+    'ugc_kafka_messages_total',
+    'Сообщения в Kafka по результату: buffered, delivered, failed',
+    ['result'],
+)
+
+COALESCER_HEARTBEATS = Counter(
+    'ugc_coalescer_heartbeats_total',
+    'Временные метки в буфере перед Kafka по результату: received, '
+    'coalesced, emitted, requeued, failed',
+    ['result'],
+)
+
+
+def create_metrics_app():
+    """ASGI приложение с метриками Prometheus. Под gunicorn у каждого
+    воркера свои счетчики, с PROMETHEUS_MULTIPROC_DIR они суммируются."""
+    if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        return make_asgi_app(REGISTRY)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return make_asgi_app(registry)
@@ -0,0 +1,177 @@
+import asyncio
+from collections import deque
+from enum import Enum
+from functools import wraps
+from logging import getLogger
+from time import monotonic
+from typing import Any, Awaitable, Callable, Deque, List, Tuple, Type
+
+from core.config import settings
+
+logger = getLogger(__name__)
+
+
+class DependencyUnavailable(Exception):
+    """Зависимость недоступна: предохранитель разомкнут."""
+
+    def __init__(self, name: str, retry_after: float) -> None:
+        super().__init__(f'{name} временно недоступен')
+        self.name = name
+        self.retry_after = retry_after
+
+
+class State(str, Enum):
+    closed = 'closed'
+    open = 'open'
+    half_open = 'half_open'
+
+
+class CircuitBreaker:
+    """Предохранитель для вызовов внешней зависимости.
+
+    В замкнутом состоянии считает вызовы и ошибки за последние window
+    секунд. Когда вызовов в окне не меньше min_calls, а доля ошибок
+    достигает failure_rate, предохранитель размыкается, и следующие
+    open_time секунд вызовы сразу завершаются DependencyUnavailable.
+    Затем пропускается half_open_calls пробных вызовов: успех замыкает
+    предохранитель, ошибка снова размыкает. Ошибкой считаются исключения
+    из errors и превышение deadline, остальные исключения означают, что
+    зависимость ответила.
+    """
+
+    def __init__(self,
+                 name: str,
+                 deadline: float,
+                 failure_rate: float = 0.5,
+                 min_calls: int = 20,
+                 window: float = 10,
+                 open_time: float = 5,
+                 half_open_calls: int = 1,
+                 errors: Tuple[Type[BaseException], ...] = ()
+                 ) -> None:
+        self.name = name
+        self.deadline = deadline
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.open_time = open_time
+        self.half_open_calls = half_open_calls
+        self.errors = errors + (asyncio.TimeoutError,)
+        self.state = State.closed
+        self._opened_at = 0.0
+        self._trials = 0
+        # Посекундные счетчики окна: [секунда, вызовы, ошибки]
+        self._buckets: Deque[List[int]] = deque()
+
+    async def call(self,
+                   func: Callable[..., Awaitable[Any]],
+                   *args,
+                   **kwargs) -> Any:
+        trial = self.check()
+        try:
+            result = await asyncio.wait_for(
+                func(*args, **kwargs),
+                self.deadline
+            )
+        except self.errors:
+            self.record(False, trial)
+            raise
+        except Exception:
+            # Зависимость ответила, ошибка на стороне вызывающего
+            self.record(True, trial)
+            raise
+        except BaseException:
+            self.release(trial)
+            raise
+        self.record(True, trial)
+        return result
+
+    def check(self) -> bool:
+        """Бросает DependencyUnavailable, если вызов сейчас запрещен.
+        Возвращает True для пробного вызова в полуоткрытом состоянии."""
+        if self.state == State.open:
+            retry_after = self._opened_at + self.open_time - monotonic()
+            if retry_after > 0:
+                raise DependencyUnavailable(self.name, retry_after)
+            self._set_state(State.half_open)
+            self._trials = 0
+        if self.state == State.half_open:
+            if self._trials >= self.half_open_calls:
+                raise DependencyUnavailable(self.name, self.open_time)
+            self._trials += 1
+            return True
+        return False
+
+    def release(self, trial: bool) -> None:
+        """Вызов отменен, его результат не учитывается."""
+        if trial:
+            self._trials -= 1
+
+    def record(self, success: bool, trial: bool = False) -> None:
+        if trial:
+            self.release(trial)
+            if self.state != State.half_open:
+                return
+            if success:
+                self._buckets.clear()
+                self._set_state(State.closed)
+            else:
+                self._open()
+            return
+        if self.state != State.closed:
+            return
+        calls, failures = self._count(success)
+        if calls >= self.min_calls and failures >= self.failure_rate * calls:
+            self._open()
+
+    def _count(self, success: bool) -> Tuple[int, int]:
+        second = int(monotonic())
+        if not self._buckets or self._buckets[-1][0] != second:
+            self._buckets.append([second, 0, 0])
+        self._buckets[-1][1] += 1
+        self._buckets[-1][2] += not success
+        while self._buckets[0][0] <= second - self.window:
+            self._buckets.popleft()
+        return (
+            sum(bucket[1] for bucket in self._buckets),
+            sum(bucket[2] for bucket in self._buckets),
+        )
+
+    def _open(self) -> None:
+        self._opened_at = monotonic()
+        self._buckets.clear()
+        self._set_state(State.open)
+
+    def _set_state(self, state: State) -> None:
+        if state != self.state:
+            log = logger.info if state == State.closed else logger.warning
+            log('Предохранитель %s: %s -> %s',
+                self.name, self.state.value, state.value)
+        self.state = state
+
+
+def guarded(method):
+    """Вызывает метод через предохранитель self.breaker, если он задан."""
+    @wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        if self.breaker is None:
+            return await method(self, *args, **kwargs)
+        return await self.breaker.call(method, self, *args, **kwargs)
+    return wrapper
+
+
+def create_breaker(
+    name: str,
+    deadline: float,
+    errors: Tuple[Type[BaseException], ...]
+) -> CircuitBreaker:
+    return CircuitBreaker(
+        name,
+        deadline,
+        settings.breaker_failure_rate,
+        settings.breaker_min_calls,
+        settings.breaker_window,
+        settings.breaker_open_time,
+        settings.breaker_half_open_calls,
+        errors
+    )
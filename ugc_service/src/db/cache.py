@@ -0,0 +1,49 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Hashable, Optional, Tuple
+
+
+class GenericCache(ABC):
+
+    @abstractmethod
+    async def get(self, key: Hashable) -> Optional[Any]:
+        pass
+
+    @abstractmethod
+    async def set(self, key: Hashable, value: Any) -> None:
+        pass
+
+
+class InMemoryCache(GenericCache):
+    """LRU кэш в памяти процесса: не больше max_size записей, запись
+    живет ttl секунд с момента последнего обновления."""
+
+    def __init__(self, max_size: int, ttl: float) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, Tuple[float, Any]] = OrderedDict()
+
+    async def get(self, key: Hashable) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires, value = item
+        if expires < monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    async def set(self, key: Hashable, value: Any) -> None:
+        self._data[key] = (monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+
+last_position_cache: Optional[GenericCache] = None
+
+
+async def get_last_position_cache() -> Optional[GenericCache]:
+    return last_position_cache
@@ -0,0 +1,44 @@
+import struct
+from typing import Callable, Dict
+
+from pydantic import BaseModel
+
+from models.users_films import UserFilmTimestamp
+
+# Бинарный формат события просмотра, версия 1: маркер 0x00 (JSON с него
+# не начинается), версия, user_id и film_id по 16 байт, start_time
+# и end_time UInt16, время события в миллисекундах Int64, little-endian.
+# Декодер - в ugc_etl_kafka_click/src/extract/codec.py, форматы совпадают
+VIEW_V1 = struct.Struct('<BB16s16sHHq')
+MARKER = 0
+VERSION = 1
+
+Encoder = Callable[[BaseModel], bytes]
+
+
+def encode_json(data: BaseModel) -> bytes:
+    return data.json().encode()
+
+
+def encode_view(data: UserFilmTimestamp) -> bytes:
+    """Событие, которое не помещается в бинарный формат (например,
+    позиция больше UInt16), пишется в JSON - ETL читает оба формата."""
+    try:
+        return VIEW_V1.pack(
+            MARKER,
+            VERSION,
+            data.user_id.bytes,
+            data.film_id.bytes,
+            data.start_time,
+            data.end_time,
+            int(data.timestamp.timestamp() * 1000),
+        )
+    except struct.error:
+        return encode_json(data)
+
+
+# Форматы сообщений, которые можно включить для топика
+ENCODERS: Dict[str, Encoder] = {
+    'json': encode_json,
+    'binary': encode_view,
+}
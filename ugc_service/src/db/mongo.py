@@ -1,11 +1,39 @@
 from functools import lru_cache
-from typing import Optional
+from typing import AsyncIterator, Optional
 
+from db.breaker import CircuitBreaker
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import ConnectionFailure, ExecutionTimeout, WTimeoutError
 
 client: Optional[AsyncIOMotorClient] = None
+breaker: Optional[CircuitBreaker] = None
+
+# Ошибки недоступности MongoDB, остальные означают, что сервер ответил
+UNAVAILABLE_ERRORS = (ConnectionFailure, ExecutionTimeout, WTimeoutError)
 
 
 @lru_cache  # type: ignore
 async def get_mongo_client() -> AsyncIOMotorClient:
     return client
+
+
+async def guard_mongo() -> AsyncIterator[None]:
+    """Зависимость роутеров MongoDB: пока предохранитель разомкнут,
+    запрос сразу завершается DependencyUnavailable. Предельное время
+    операций задает timeoutMS клиента."""
+    if breaker is None:
+        yield
+        return
+    trial = breaker.check()
+    try:
+        yield
+    except UNAVAILABLE_ERRORS:
+        breaker.record(False, trial)
+        raise
+    except Exception:
+        breaker.record(True, trial)
+        raise
+    except BaseException:
+        breaker.release(trial)
+        raise
+    breaker.record(True, trial)
@@ -1,13 +1,36 @@
+import asyncio
 from abc import ABC, abstractmethod
-from typing import Optional
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from functools import partial, wraps
+from logging import getLogger
+from time import monotonic
+from typing import (Any, AsyncIterator, Awaitable, Callable, Deque, Dict,
+                    Hashable, List, Optional, Tuple)
 from uuid import UUID
 
 import backoff
 from asynch import connect
+from asynch.connection import Connection
 from asynch.cursors import DictCursor
+from asynch.errors import (NetworkError, ServerException, SocketTimeoutError,
+                           UnexpectedPacketFromServerError)
 from core.config import settings
+from core.metrics import SINGLE_FLIGHT_CALLS, SINGLE_FLIGHT_SHARED
+from db.breaker import CircuitBreaker, guarded
 from models.users_films import UserFilmTimestamp
 
+logger = getLogger(__name__)
+
+# Ошибки недоступности ClickHouse: сеть, таймауты и ответы сервера с ошибкой
+UNAVAILABLE_ERRORS = (
+    NetworkError,
+    SocketTimeoutError,
+    UnexpectedPacketFromServerError,
+    ServerException,
+    OSError,
+)
+
 
 class GenericOlap(ABC):
     pass
@@ -17,15 +40,202 @@ class GenericOlap(ABC):
         self,
         user_id: UUID,
         film_id: UUID
-    ) -> UserFilmTimestamp:
+    ) -> Optional[UserFilmTimestamp]:
+        pass
+
+    @abstractmethod
+    async def get_last_user_timestamps(
+        self,
+        user_id: UUID,
+        film_ids: List[UUID],
+        offset: int,
+        limit: int
+    ) -> List[UserFilmTimestamp]:
         pass
 
 
+class SingleFlight:
+    """Объединяет одинаковые одновременные запросы: пока запрос с ключом
+    выполняется, остальные вызовы с тем же ключом ждут его результат.
+    Отмена одного из ожидающих не отменяет общий запрос. Счетчики
+    доступны и в метриках Prometheus."""
+
+    def __init__(self) -> None:
+        # Счетчики calls и shared - вызовы, получившие чужой результат
+        self.stats: Counter = Counter()
+        self._flights: Dict[Hashable, asyncio.Future] = {}
+
+    @property
+    def dedup_rate(self) -> float:
+        if not self.stats['calls']:
+            return 0
+        return self.stats['shared'] / self.stats['calls']
+
+    async def do(self,
+                 key: Hashable,
+                 call: Callable[[], Awaitable[Any]]) -> Any:
+        self.stats['calls'] += 1
+        SINGLE_FLIGHT_CALLS.inc()
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = asyncio.ensure_future(call())
+            self._flights[key] = flight
+            flight.add_done_callback(partial(self._land, key))
+        else:
+            self.stats['shared'] += 1
+            SINGLE_FLIGHT_SHARED.inc()
+        return await asyncio.shield(flight)
+
+    def _land(self, key: Hashable, flight: asyncio.Future) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        # Ошибку могли не забрать, если все ожидающие отменены
+        if not flight.cancelled():
+            flight.exception()
+
+
+def _hashable(value: Any) -> Hashable:
+    return tuple(value) if isinstance(value, list) else value
+
+
+def single_flight(method):
+    """Объединяет одновременные вызовы метода с одинаковыми аргументами.
+    Списки в аргументах сравниваются как кортежи."""
+    @wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        if self.single_flight is None:
+            return await method(self, *args, **kwargs)
+        named = tuple(
+            (name, _hashable(value)) for name, value in sorted(kwargs.items())
+        )
+        key = (method.__name__, *map(_hashable, args), *named)
+        return await self.single_flight.do(
+            key,
+            lambda: method(self, *args, **kwargs)
+        )
+    return wrapper
+
+
+class ClickHousePool:
+    """Пул соединений asynch: не больше max_size запросов одновременно,
+    min_size соединений открываются заранее. Соединение, простоявшее
+    дольше health_check_interval, проверяется перед выдачей, а после
+    ошибки или таймаута запроса закрывается и заменяется новым."""
+
+    def __init__(self,
+                 host: str,
+                 port: str,
+                 min_size: int,
+                 max_size: int,
+                 health_check_interval: float,
+                 check_timeout: float) -> None:
+        self.host = host
+        self.port = port
+        self.min_size = min_size
+        self.health_check_interval = health_check_interval
+        self.check_timeout = check_timeout
+        self._semaphore = asyncio.Semaphore(max_size)
+        # Свободные соединения и время их последнего использования
+        self._free: Deque[Tuple[Connection, float]] = deque()
+
+    async def open(self) -> None:
+        for _ in range(self.min_size - len(self._free)):
+            self._free.append((await self._connect(), monotonic()))
+
+    async def close(self) -> None:
+        while self._free:
+            connection, _ = self._free.popleft()
+            await connection.close()
+
+    @property
+    def slot(self) -> asyncio.Semaphore:
+        """Место в пуле, занимается до получения соединения."""
+        return self._semaphore
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[Connection]:
+        async with self._semaphore:
+            async with self.connection() as connection:
+                yield connection
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[Connection]:
+        """Соединение для вызывающего, который уже занял slot."""
+        connection = await self._get()
+        try:
+            yield connection
+        except BaseException:
+            await self._discard(connection)
+            raise
+        self._free.append((connection, monotonic()))
+
+    async def _get(self) -> Connection:
+        while self._free:
+            # Последнее освобожденное соединение скорее всего живо
+            connection, used = self._free.pop()
+            if monotonic() - used < self.health_check_interval:
+                return connection
+            if await self._is_healthy(connection):
+                return connection
+            logger.warning('Соединение с ClickHouse неактивно, закрываем')
+            await self._discard(connection)
+        return await self._connect()
+
+    async def _connect(self) -> Connection:
+        return await connect(host=self.host, port=self.port)
+
+    async def _is_healthy(self, connection: Connection) -> bool:
+        try:
+            async with connection.cursor() as cursor:
+                await asyncio.wait_for(
+                    cursor.execute('SELECT 1'),
+                    self.check_timeout
+                )
+        except Exception:
+            return False
+        return True
+
+    async def _discard(self, connection: Connection) -> None:
+        try:
+            await connection.close()
+        except Exception:
+            logger.debug('Ошибка при закрытии соединения с ClickHouse')
+
+
 class ClickHouseOlap(GenericOlap):
-    def __init__(self, host: str, port: str) -> None:
+    def __init__(self,
+                 host: str,
+                 port: str,
+                 last_position_table: str,
+                 pool_min_size: int = 1,
+                 pool_max_size: int = 10,
+                 query_timeout: float = 5,
+                 health_check_interval: float = 30,
+                 single_shard_reads: bool = True,
+                 coalesce_reads: bool = True,
+                 breaker: Optional[CircuitBreaker] = None) -> None:
         self.host = host
         self.port = port
-        self._connect = None
+        self.last_position_table = last_position_table
+        self.query_timeout = query_timeout
+        # Таблицы шардированы по CRC32(user_id), поэтому запрос с условием
+        # на одного пользователя уходит только на его шард
+        self.user_query_settings = {
+            'optimize_skip_unused_shards': 1
+        } if single_shard_reads else {}
+        self.single_flight = SingleFlight() if coalesce_reads else None
+        # Дедлайн предохранителя покрывает соединение и запрос, но не
+        # ожидание места в пуле: перегрузка самого сервиса не считается
+        # отказом ClickHouse
+        self.breaker = breaker
+        self._pool = ClickHousePool(
+            host,
+            port,
+            pool_min_size,
+            pool_max_size,
+            health_check_interval,
+            query_timeout
+        )
 
     @backoff.on_exception(
         backoff.expo,
@@ -33,38 +243,110 @@ class ClickHouseOlap(GenericOlap):
         max_time=settings.backoff_max_time
     )
     async def connect(self) -> None:
-        self._connect = await connect(
-            host=self.host,
-            port=self.port,
-        )
+        await self._pool.open()
 
-    @backoff.on_exception(
-        backoff.expo,
-        Exception,
-        max_time=settings.backoff_max_time
-    )
+    async def disconnect(self) -> None:
+        await self._pool.close()
+        if self.single_flight:
+            logger.info(
+                'Объединено одинаковых запросов к ClickHouse: %s из %s '
+                '(%.1f%%)',
+                self.single_flight.stats['shared'],
+                self.single_flight.stats['calls'],
+                100 * self.single_flight.dedup_rate
+            )
+
+    async def fetchall(self,
+                       query: str,
+                       params: dict,
+                       query_settings: Optional[dict] = None) -> List[dict]:
+        async with self._pool.slot:
+            return await self._fetchall(query, params, query_settings)
+
+    @guarded
+    async def _fetchall(self,
+                        query: str,
+                        params: dict,
+                        query_settings: Optional[dict] = None) -> List[dict]:
+        async with self._pool.connection() as connection:
+            async with connection.cursor(cursor=DictCursor) as cursor:
+                if query_settings:
+                    cursor.set_settings(dict(query_settings))
+                await asyncio.wait_for(
+                    cursor.execute(query, params),
+                    self.query_timeout
+                )
+                return await cursor.fetchall()
+
+    @single_flight
     async def get_last_user_film_timestamp(
         self,
         user_id: UUID,
         film_id: UUID
-    ) -> UserFilmTimestamp:
-        if self._connect:
-            async with self._connect.cursor(cursor=DictCursor) as cursor:
-                count = await cursor.execute("""
-                    SELECT * FROM default.view
-                    WHERE (user_id=='{user_id}') AND (film_id=='{film_id}')
-                    ORDER BY event_time DESC LIMIT 1
-                """.format(user_id=user_id, film_id=film_id))
-                if not count:
-                    return None
-                result = await cursor.fetchone()
-                return UserFilmTimestamp(
-                    user_id=result['user_id'],
-                    film_id=result['film_id'],
-                    start_time=result['start_time'],
-                    end_time=result['end_time'],
-                    timestamp=result['event_time']
-                )
+    ) -> Optional[UserFilmTimestamp]:
+        rows = await self.fetchall(
+            f"""
+                SELECT user_id, film_id, start_time, end_time, event_time
+                FROM {self.last_position_table}
+                WHERE user_id = %(user_id)s AND film_id = %(film_id)s
+                ORDER BY event_time DESC LIMIT 1
+            """,
+            {'user_id': str(user_id), 'film_id': str(film_id)},
+            self.user_query_settings
+        )
+        if not rows:
+            return None
+        return UserFilmTimestamp(
+            user_id=rows[0]['user_id'],
+            film_id=rows[0]['film_id'],
+            start_time=rows[0]['start_time'],
+            end_time=rows[0]['end_time'],
+            timestamp=rows[0]['event_time']
+        )
+
+    @single_flight
+    async def get_last_user_timestamps(
+        self,
+        user_id: UUID,
+        film_ids: List[UUID],
+        offset: int,
+        limit: int
+    ) -> List[UserFilmTimestamp]:
+        """Последние позиции пользователя по всем фильмам, сначала
+        недавние. argMax схлопывает версии, которые ReplacingMergeTree
+        еще не успел объединить."""
+        film_filter = 'AND film_id IN %(film_ids)s' if film_ids else ''
+        rows = await self.fetchall(
+            f"""
+                SELECT
+                    film_id,
+                    argMax(start_time, event_time) AS start_time,
+                    argMax(end_time, event_time) AS end_time,
+                    max(event_time) AS last_event_time
+                FROM {self.last_position_table}
+                WHERE user_id = %(user_id)s {film_filter}
+                GROUP BY film_id
+                ORDER BY last_event_time DESC, film_id
+                LIMIT %(limit)s OFFSET %(offset)s
+            """,
+            {
+                'user_id': str(user_id),
+                'film_ids': [str(film_id) for film_id in film_ids],
+                'limit': limit,
+                'offset': offset,
+            },
+            self.user_query_settings
+        )
+        return [
+            UserFilmTimestamp(
+                user_id=user_id,
+                film_id=row['film_id'],
+                start_time=row['start_time'],
+                end_time=row['end_time'],
+                timestamp=row['last_event_time']
+            )
+            for row in rows
+        ]
 
 
 olap_bd: Optional[GenericOlap] = None
@@ -1,14 +1,40 @@
+import asyncio
 import logging
 from abc import ABC, abstractmethod
+from collections import Counter
 from logging.config import dictConfig
-from typing import Optional
+from time import monotonic
+from typing import Dict, List, Optional, Set, Tuple
 
 from aiokafka import AIOKafkaProducer
+from aiokafka.errors import (KafkaConnectionError, KafkaTimeoutError,
+                             LeaderNotAvailableError, NodeNotReadyError,
+                             NotEnoughReplicasError,
+                             NotLeaderForPartitionError, RequestTimedOutError)
 from core.logger import LOGGING
+from core.metrics import KAFKA_MESSAGES
+from db.breaker import CircuitBreaker
+from db.codecs import ENCODERS, Encoder, encode_json
+from pydantic import BaseModel
 
 logger = logging.getLogger(__name__)
 dictConfig(LOGGING)
 
+# Ошибки недоступности Kafka, остальные означают, что брокер ответил
+UNAVAILABLE_ERRORS = (
+    KafkaConnectionError,
+    KafkaTimeoutError,
+    RequestTimedOutError,
+    NodeNotReadyError,
+    LeaderNotAvailableError,
+    NotLeaderForPartitionError,
+    NotEnoughReplicasError,
+    OSError,
+)
+
+# Ошибки фоновой доставки пишутся в лог не чаще раза за интервал, секунды
+DELIVERY_ERROR_LOG_INTERVAL = 10
+
 
 class GenericOltp(ABC):
 
@@ -24,26 +50,145 @@ class GenericOltp(ABC):
     async def write(self, key, data, topic):
         pass
 
+    @abstractmethod
+    async def write_many(self, messages, topic):
+        pass
+
 
 class KafkaOltp(GenericOltp):
-    def __init__(self, bootstrap_servers: list) -> None:
+    """Продюсер Kafka. При wait_delivery=False write возвращается, как
+    только сообщение попало в буфер продюсера: сообщения отправляются
+    пачками по linger_ms/max_batch_size, а результат доставки
+    учитывается в фоне в stats."""
+
+    def __init__(self,
+                 bootstrap_servers: list,
+                 topic_formats: Optional[Dict[str, str]] = None,
+                 wait_delivery: bool = True,
+                 linger_ms: int = 0,
+                 max_batch_size: int = 16384,
+                 compression_type: Optional[str] = None,
+                 breaker: Optional[CircuitBreaker] = None) -> None:
         self.bootstrap_servers = bootstrap_servers
+        # Формат сообщений по топикам, по умолчанию JSON
+        self.encoders: Dict[str, Encoder] = {
+            topic: ENCODERS[name]
+            for topic, name in (topic_formats or {}).items()
+        }
+        self.wait_delivery = wait_delivery
+        self.linger_ms = linger_ms
+        self.max_batch_size = max_batch_size
+        self.compression_type = compression_type
+        self.breaker = breaker
+        # Счетчики buffered, delivered, failed, доступны и в метриках
+        self.stats: Counter = Counter()
+        self._pending: Set[asyncio.Future] = set()
+        # Ошибки доставки в фоне, еще не попавшие в лог
+        self._unlogged_failures = 0
+        self._failures_logged_at = float('-inf')
 
     async def connect(self) -> None:
         self.producer = AIOKafkaProducer(
-            bootstrap_servers=self.bootstrap_servers
+            bootstrap_servers=self.bootstrap_servers,
+            linger_ms=self.linger_ms,
+            max_batch_size=self.max_batch_size,
+            compression_type=self.compression_type,
         )
         await self.producer.start()
 
     async def disconnect(self) -> None:
+        # stop() дожидается отправки всего, что накоплено в буфере
         await self.producer.stop()
-
-    async def write(self, key: str, data: str, topic: str):
-        await self.producer.send_and_wait(
-            topic=topic,
-            value=bytes(data, encoding='utf-8'),
-            key=bytes(key, encoding='utf-8')
+        if self._pending:
+            await asyncio.wait(self._pending)
+        if self._unlogged_failures:
+            logger.error('Сообщений не доставлено в Kafka: %s',
+                         self._unlogged_failures)
+        logger.info('Kafka producer остановлен: %s', dict(self.stats))
+
+    async def write(self, key: str, data: BaseModel, topic: str):
+        error, = await self.write_many([(key, data)], topic)
+        if error is not None:
+            raise error
+
+    async def write_many(
+        self,
+        messages: List[Tuple[str, BaseModel]],
+        topic: str
+    ) -> List[Optional[BaseException]]:
+        """Отправляет сообщения одной пачкой, возвращает ошибку доставки
+        по каждому сообщению. Без wait_delivery ошибки бывают только при
+        постановке в буфер: доставка учитывается в фоне."""
+        try:
+            if self.breaker is None:
+                return await self._send(messages, topic)
+            return await self.breaker.call(self._send, messages, topic)
+        except Exception as error:
+            self._count('failed', len(messages))
+            return [error] * len(messages)
+
+    async def _send(
+        self,
+        messages: List[Tuple[str, BaseModel]],
+        topic: str
+    ) -> List[Optional[BaseException]]:
+        encode = self.encoders.get(topic, encode_json)
+        deliveries = [
+            await self.producer.send(
+                topic=topic,
+                value=encode(data),
+                key=bytes(key, encoding='utf-8')
+            )
+            for key, data in messages
+        ]
+        if not self.wait_delivery:
+            self._count('buffered', len(deliveries))
+            for delivery in deliveries:
+                self._pending.add(delivery)
+                delivery.add_done_callback(self._on_delivery)
+            return [None] * len(deliveries)
+        results = await asyncio.gather(*deliveries, return_exceptions=True)
+        errors: List[Optional[BaseException]] = [
+            result if isinstance(result, BaseException) else None
+            for result in results
+        ]
+        exceptions = [error for error in errors if error is not None]
+        failed = len(exceptions)
+        self._count('delivered', len(errors) - failed)
+        if errors and failed == len(errors):
+            # Ни одно сообщение не доставлено - ошибка для предохранителя
+            raise exceptions[0]
+        self._count('failed', failed)
+        return errors
+
+    def _on_delivery(self, delivery: asyncio.Future) -> None:
+        self._pending.discard(delivery)
+        if delivery.cancelled() or delivery.exception() is not None:
+            self._count('failed', 1)
+            self._log_failure(
+                'cancelled' if delivery.cancelled() else delivery.exception()
+            )
+            return
+        self._count('delivered', 1)
+
+    def _count(self, result: str, count: int) -> None:
+        self.stats[result] += count
+        KAFKA_MESSAGES.labels(result).inc(count)
+
+    def _log_failure(self, error: object) -> None:
+        """При недоступности брокера ошибки идут по каждому сообщению,
+        поэтому в лог попадает их число за интервал и последняя ошибка."""
+        self._unlogged_failures += 1
+        now = monotonic()
+        if now - self._failures_logged_at < DELIVERY_ERROR_LOG_INTERVAL:
+            return
+        logger.error(
+            'Сообщений не доставлено в Kafka: %s, последняя ошибка: %s',
+            self._unlogged_failures,
+            error
         )
+        self._unlogged_failures = 0
+        self._failures_logged_at = now
 
 
 oltp_bd: Optional[GenericOltp] = None
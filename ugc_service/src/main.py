@@ -1,3 +1,4 @@
+from http import HTTPStatus
 from logging import getLogger
 from contextlib import asynccontextmanager
 
@@ -9,13 +10,16 @@ from async_fastapi_jwt_auth.exceptions import AuthJWTException
 from core.config import settings
 from core.logger import LOGGING
 from db import mongo, olap, oltp
-from fastapi import FastAPI, Request
+from fastapi import Depends, FastAPI, Request
 from fastapi.responses import ORJSONResponse
 from motor.motor_asyncio import AsyncIOMotorClient
 from api.v1 import users_films, ratings, reviews, bookmarks
 from core.config import settings
+from core.metrics import create_metrics_app
 from core.middleware import RequestContextMiddleware
-from db import olap, oltp, mongo
+from db import cache, olap, oltp, mongo
+from db.breaker import DependencyUnavailable, create_breaker
+from services import coalescer
 
 
 logger = getLogger(__name__)
@@ -30,19 +34,69 @@ if settings.sentry_enabled:
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     olap.olap_bd = olap.ClickHouseOlap(
-        settings.clickhouse_host, settings.clickhouse_port
+        settings.clickhouse_host,
+        settings.clickhouse_port,
+        settings.clickhouse_table(settings.clickhouse_last_position_table),
+        settings.clickhouse_pool_min_size,
+        settings.clickhouse_pool_max_size,
+        settings.clickhouse_query_timeout,
+        settings.clickhouse_health_check_interval,
+        settings.clickhouse_single_shard_reads,
+        settings.clickhouse_coalesce_reads,
+        create_breaker(
+            'ClickHouse',
+            settings.clickhouse_query_timeout,
+            olap.UNAVAILABLE_ERRORS
+        )
+        if settings.breaker_enabled else None
     )
     oltp.oltp_bd = oltp.KafkaOltp(
-        f'{settings.kafka_host}:{settings.kafka_port}'
+        f'{settings.kafka_host}:{settings.kafka_port}',
+        settings.kafka_topic_formats,
+        settings.kafka_wait_delivery,
+        settings.kafka_linger_ms,
+        settings.kafka_max_batch_size,
+        settings.kafka_compression_type,
+        create_breaker(
+            'Kafka',
+            settings.kafka_send_timeout,
+            oltp.UNAVAILABLE_ERRORS
+        )
+        if settings.breaker_enabled else None
     )
     await oltp.oltp_bd.connect()
     await olap.olap_bd.connect()
+    if settings.last_position_cache_size:
+        cache.last_position_cache = cache.InMemoryCache(
+            settings.last_position_cache_size,
+            settings.last_position_cache_ttl
+        )
+    if settings.users_films_coalesce_window:
+        coalescer.coalescer = coalescer.HeartbeatCoalescer(
+            oltp.oltp_bd,
+            settings.kafka_view_topic,
+            settings.users_films_coalesce_window,
+            settings.users_films_coalesce_max_keys,
+            settings.users_films_coalesce_mode
+        )
+        await coalescer.coalescer.start()
     mongo.client = AsyncIOMotorClient(
         settings.mongodb_uri,
         uuidRepresentation='standard',
+        timeoutMS=int(settings.mongodb_timeout * 1000),
     )
+    if settings.breaker_enabled:
+        mongo.breaker = create_breaker(
+            'MongoDB',
+            settings.mongodb_timeout,
+            mongo.UNAVAILABLE_ERRORS
+        )
     yield
+    # Буфер сбрасывается до остановки продюсера
+    if coalescer.coalescer:
+        await coalescer.coalescer.stop()
     await oltp.oltp_bd.disconnect()
+    await olap.olap_bd.disconnect()
     mongo.client.close()
 
 
@@ -70,9 +124,22 @@ def authjwt_exception_handler(request: Request, exc: AuthJWTException):
     )
 
 
+@app.exception_handler(DependencyUnavailable)
+def dependency_unavailable_handler(request: Request,
+                                   exc: DependencyUnavailable):
+    logger.error("Зависимость недоступна: %s", exc.name)
+    return ORJSONResponse(
+        status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(max(int(exc.retry_after), 1))}
+    )
+
+
 if settings.sentry_enabled:
     app.add_middleware(RequestContextMiddleware)
 
+app.mount('/ugc/metrics', create_metrics_app())
+
 app.include_router(
     users_films.router,
     prefix='/ugc/api/v1/users_films',
@@ -83,16 +150,19 @@ app.include_router(
     ratings.router,
     prefix='/ugc/api/v1/ratings',
     tags=['ratings'],
+    dependencies=[Depends(mongo.guard_mongo)],
 )
 app.include_router(
     reviews.router,
     prefix='/ugc/api/v1/reviews',
     tags=['reviews'],
+    dependencies=[Depends(mongo.guard_mongo)],
 )
 app.include_router(
     bookmarks.router,
     prefix='/ugc/api/v1/bookmarks',
     tags=['bookmarks'],
+    dependencies=[Depends(mongo.guard_mongo)],
 )
 
 
@@ -1,7 +1,8 @@
-from datetime import datetime
+from datetime import datetime, timezone
 from uuid import UUID
 
 from models.base import BaseModel
+from pydantic import validator
 
 
 class UserFilmTimestamp(BaseModel):
@@ -10,3 +11,17 @@ class UserFilmTimestamp(BaseModel):
     start_time: int
     end_time: int
     timestamp: datetime
+
+    @validator('timestamp')
+    def timestamp_to_utc(cls, value: datetime) -> datetime:
+        """Метки от клиентов и из ClickHouse сравниваются между собой,
+        поэтому время всегда в UTC. Время без часового пояса - UTC."""
+        if value.tzinfo is None:
+            return value.replace(tzinfo=timezone.utc)
+        return value.astimezone(timezone.utc)
+
+
+def message_key(user_film_data: UserFilmTimestamp) -> str:
+    """Ключ сообщения Kafka: метки пары пользователь - фильм попадают
+    в одну партицию."""
+    return f'{user_film_data.user_id}+{user_film_data.film_id}'
@@ -0,0 +1,41 @@
+import argparse
+import asyncio
+from logging import getLogger
+from typing import Optional
+from uuid import UUID
+
+from core.config import settings
+from motor.motor_asyncio import AsyncIOMotorClient
+from services.ratings import MongoDBRatingsService
+
+logger = getLogger(__name__)
+
+
+async def rebuild(film_id: Optional[UUID]) -> None:
+    client = AsyncIOMotorClient(
+        settings.mongodb_uri,
+        uuidRepresentation='standard',
+    )
+    try:
+        await MongoDBRatingsService(client).rebuild_overall_ratings(film_id)
+    finally:
+        client.close()
+    logger.info('Общий рейтинг пересчитан: %s', film_id or 'все фильмы')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Пересчет общих рейтингов фильмов по оценкам'
+    )
+    parser.add_argument(
+        '--film-id',
+        type=UUID,
+        default=None,
+        help='Пересчитать только один фильм'
+    )
+    args = parser.parse_args()
+    asyncio.run(rebuild(args.film_id))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+import asyncio
+from collections import Counter
+from logging import getLogger
+from typing import Dict, List, Literal, Optional, Tuple
+from uuid import UUID
+
+from core.metrics import COALESCER_HEARTBEATS
+from db.oltp import GenericOltp
+from models.users_films import UserFilmTimestamp, message_key
+
+logger = getLogger(__name__)
+
+
+class HeartbeatCoalescer:
+    """Буфер временных меток перед отправкой в Kafka.
+
+    За окно window секунд по каждой паре пользователь - фильм остается
+    одна метка: последняя по времени (mode='latest') или объединение
+    смежных интервалов просмотра (mode='merge'). Буфер сбрасывается
+    по таймеру, при max_keys пар и при остановке сервиса. Неотправленные
+    метки возвращаются в буфер и объединяются с более новыми, пока
+    в буфере не больше max_keys пар.
+    """
+
+    def __init__(self,
+                 oltp: GenericOltp,
+                 topic: str,
+                 window: float,
+                 max_keys: int,
+                 mode: Literal['latest', 'merge'] = 'merge') -> None:
+        self.oltp = oltp
+        self.topic = topic
+        self.window = window
+        self.max_keys = max_keys
+        self.mode = mode
+        # Счетчики received, coalesced, emitted, requeued, failed,
+        # доступны и в метриках
+        self.stats: Counter = Counter()
+        self._buffer: Dict[Tuple[UUID, UUID], UserFilmTimestamp] = {}
+        # Метки, которые не удалось объединить, уходят со следующим сбросом
+        self._ready: List[UserFilmTimestamp] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self.flush(requeue=False)
+        logger.info('Буфер временных меток остановлен: %s', dict(self.stats))
+
+    async def add(self, user_films_data: List[UserFilmTimestamp]) -> None:
+        for data in user_films_data:
+            self._count('received', 1)
+            self._put(data)
+        if len(self._buffer) >= self.max_keys:
+            await self.flush()
+
+    async def flush(self, requeue: bool = True) -> None:
+        """requeue=False - неотправленные метки не возвращаются в буфер,
+        при остановке сервиса они теряются."""
+        items = self._ready + list(self._buffer.values())
+        self._ready = []
+        self._buffer = {}
+        if not items:
+            return
+        errors = await self.oltp.write_many(
+            [(message_key(data), data) for data in items],
+            self.topic
+        )
+        failed = [
+            data for data, error in zip(items, errors) if error is not None
+        ]
+        if len(failed) < len(items):
+            self._count('emitted', len(items) - len(failed))
+        requeued = 0
+        for data in failed:
+            if requeue and self._has_room(data):
+                self._put(data, received=False)
+                requeued += 1
+        if requeued:
+            self._count('requeued', requeued)
+            logger.warning('Временных меток возвращено в буфер: %s',
+                           requeued)
+        lost = len(failed) - requeued
+        if lost:
+            self._count('failed', lost)
+            logger.error('Не отправлено временных меток: %s', lost)
+
+    def _has_room(self, data: UserFilmTimestamp) -> bool:
+        # В буфере уже может быть более новая метка той же пары
+        if (data.user_id, data.film_id) in self._buffer:
+            return True
+        return len(self._buffer) < self.max_keys
+
+    def _put(self, data: UserFilmTimestamp, received: bool = True) -> None:
+        key = (data.user_id, data.film_id)
+        current = self._buffer.get(key)
+        if current is None:
+            self._buffer[key] = data
+            return
+        merged = self._merge(current, data)
+        if merged is None:
+            # Интервалы не смежные, обе метки нужны
+            self._ready.append(current)
+            self._buffer[key] = data
+            return
+        if received:
+            self._count('coalesced', 1)
+        self._buffer[key] = merged
+
+    def _count(self, result: str, count: int) -> None:
+        self.stats[result] += count
+        COALESCER_HEARTBEATS.labels(result).inc(count)
+
+    def _merge(
+        self,
+        current: UserFilmTimestamp,
+        data: UserFilmTimestamp
+    ) -> Optional[UserFilmTimestamp]:
+        latest = data if data.timestamp >= current.timestamp else current
+        if self.mode == 'latest':
+            return latest
+        after = data.start_time > current.end_time
+        before = data.end_time < current.start_time
+        if after or before:
+            return None
+        return latest.copy(update={
+            'start_time': min(current.start_time, data.start_time),
+            'end_time': max(current.end_time, data.end_time),
+        })
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.window)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception('Ошибка при сбросе буфера временных меток')
+
+
+coalescer: Optional[HeartbeatCoalescer] = None
+
+
+async def get_coalescer() -> Optional[HeartbeatCoalescer]:
+    return coalescer
@@ -1,5 +1,6 @@
 from abc import ABC, abstractmethod
-from typing import List, Optional
+from datetime import datetime
+from typing import Any, Dict, List, Optional
 from uuid import UUID
 
 from db import mongo
@@ -47,10 +48,23 @@ class RatingsService(ABC):
     async def get_overall_rating(self, film_id: UUID) -> OverallRating:
         ...
 
+    @abstractmethod
+    async def rebuild_overall_ratings(self,
+                                      film_id: Optional[UUID] = None,
+                                      ) -> None:
+        ...
+
 
 class MongoDBRatingsService(RatingsService):
+    """Общий рейтинг фильма хранится в rating_stats: сумма оценок,
+    их число и число оценок каждого балла. Документ создается и
+    обновляется $inc при каждой записи оценки. Оценки, записанные до
+    появления rating_stats, учитывает rebuild_overall_ratings: его
+    запускают один раз при развертывании (rebuild_ratings.py)."""
+
     def __init__(self, mongo_client: AsyncIOMotorClient) -> None:
         self._ratings = mongo_client.films.ratings
+        self._stats = mongo_client.films.rating_stats
 
     async def get_rating_list(self,
                               film_id: Optional[UUID],
@@ -87,6 +101,11 @@ class MongoDBRatingsService(RatingsService):
         )
         if result.matched_count:
             raise ResourceAlreadyExists()
+        await self._update_stats(film_id, {
+            'sum': rating,
+            'count': 1,
+            f'histogram.{rating}': 1,
+        })
         return res_rating
 
     async def get_rating(self, film_id: UUID, user_id: UUID) -> Rating:
@@ -107,36 +126,91 @@ class MongoDBRatingsService(RatingsService):
         result = await self._ratings.find_one_and_update(
             filter=res_rating.dict(include={'film_id', 'user_id'}),
             update={'$set': res_rating.dict(exclude={'created'})},
-            return_document=ReturnDocument.AFTER,
+            return_document=ReturnDocument.BEFORE,
         )
         if not result:
             raise ResourceDoesNotExist()
-        return Rating(**result)
+        if result['rating'] != rating:
+            await self._update_stats(film_id, {
+                'sum': rating - result['rating'],
+                f'histogram.{result["rating"]}': -1,
+                f'histogram.{rating}': 1,
+            })
+        return Rating(**{**result, **res_rating.dict(exclude={'created'})})
 
     async def delete_rating(self, film_id: UUID, user_id: UUID) -> None:
-        result = await self._ratings.delete_one({
+        result = await self._ratings.find_one_and_delete({
             'film_id': film_id,
             'user_id': user_id,
         })
-        if not result.deleted_count:
+        if not result:
             raise ResourceDoesNotExist()
+        await self._update_stats(film_id, {
+            'sum': -result['rating'],
+            'count': -1,
+            f'histogram.{result["rating"]}': -1,
+        })
 
     async def get_overall_rating(self, film_id: UUID) -> OverallRating:
+        rating_stats = await self._stats.find_one({'_id': film_id})
+        if not rating_stats or not rating_stats.get('count'):
+            raise ResourceDoesNotExist()
+        return OverallRating(
+            film_id=film_id,
+            avg_rating=rating_stats['sum'] / rating_stats['count'],
+            ratings_count=rating_stats['count'],
+        )
+
+    async def rebuild_overall_ratings(self,
+                                      film_id: Optional[UUID] = None,
+                                      ) -> None:
+        """Пересчитывает общий рейтинг по оценкам: одного фильма или
+        всех. Документы фильмов, у которых больше нет оценок, удаляются.
+        Оценки, записанные во время пересчета, могут в него не попасть,
+        поэтому он запускается до того, как сервис начнет принимать
+        запросы."""
+        rebuilt = datetime.utcnow()
+        match = {'film_id': film_id} if film_id else {}
+        await self._merge_stats(match, rebuilt)
+        stale: Dict[str, Any] = {'rebuilt': {'$ne': rebuilt}}
+        if film_id:
+            stale['_id'] = film_id
+        await self._stats.delete_many(stale)
+
+    async def _update_stats(self, film_id: UUID, inc: dict) -> None:
+        await self._stats.update_one(
+            {'_id': film_id},
+            {'$inc': inc},
+            upsert=True,
+        )
+
+    async def _merge_stats(self, match: dict, rebuilt: datetime) -> None:
         pipeline = [
-            {'$match': {'film_id': film_id}},
+            {'$match': match},
             {'$group': {
-                '_id': '$film_id',
-                'avg_rating': {'$avg': '$rating'},
-                'ratings_count': {'$count': {}},
+                '_id': {'film_id': '$film_id', 'rating': '$rating'},
+                'count': {'$sum': 1},
+            }},
+            {'$group': {
+                '_id': '$_id.film_id',
+                'sum': {'$sum': {'$multiply': ['$_id.rating', '$count']}},
+                'count': {'$sum': '$count'},
+                'histogram': {'$push': {
+                    'k': {'$toString': '$_id.rating'},
+                    'v': '$count',
+                }},
+            }},
+            {'$set': {
+                'histogram': {'$arrayToObject': '$histogram'},
+                'rebuilt': rebuilt,
+            }},
+            {'$merge': {
+                'into': self._stats.name,
+                'whenMatched': 'replace',
+                'whenNotMatched': 'insert',
             }},
-            {'$limit': 1},
         ]
-        result = self._ratings.aggregate(pipeline)
-        try:
-            rating_stats = await result.__anext__()
-        except StopAsyncIteration:
-            raise ResourceDoesNotExist()
-        return OverallRating(film_id=film_id, **rating_stats)
+        await self._ratings.aggregate(pipeline).to_list(None)
 
 
 async def get_ratings_service() -> RatingsService:
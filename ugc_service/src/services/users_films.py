@@ -1,39 +1,108 @@
 from functools import lru_cache
+from typing import List, Optional
 from uuid import UUID
 
 from core.config import settings
+from db.cache import GenericCache, get_last_position_cache
 from db.olap import GenericOlap, get_olap
 from db.oltp import GenericOltp, get_oltp
 from fastapi import Depends
-from models.users_films import UserFilmTimestamp
+from models.users_films import UserFilmTimestamp, message_key
+from services.coalescer import HeartbeatCoalescer, get_coalescer
 
 
 class UserFilmService:
-    def __init__(self, olap: GenericOlap, oltp: GenericOltp):
+    def __init__(self,
+                 olap: GenericOlap,
+                 oltp: GenericOltp,
+                 coalescer: Optional[HeartbeatCoalescer] = None,
+                 cache: Optional[GenericCache] = None):
         self.olap = olap
         self.oltp = oltp
+        self.coalescer = coalescer
+        # Последние позиции, записанные этим процессом: пока они не дошли
+        # до ClickHouse через Kafka и ETL, чтение отдает их. Прочитанное
+        # из ClickHouse не кэшируется, иначе другие воркеры отдавали бы
+        # устаревшую позицию
+        self.cache = cache
 
     async def create_user_film_timestamp(
         self,
         user_film_data: UserFilmTimestamp
     ):
-        return await self.oltp.write(
-            key=f'{user_film_data.user_id}+{user_film_data.film_id}',
-            data=user_film_data.json(),
-            topic=settings.kafka_view_topic
-        )
+        if self.coalescer:
+            await self.coalescer.add([user_film_data])
+        else:
+            await self.oltp.write(
+                key=message_key(user_film_data),
+                data=user_film_data,
+                topic=settings.kafka_view_topic
+            )
+        await self._remember(user_film_data)
+
+    async def create_user_film_timestamps(
+        self,
+        user_films_data: List[UserFilmTimestamp]
+    ) -> List[Optional[BaseException]]:
+        if self.coalescer:
+            await self.coalescer.add(user_films_data)
+            errors: List[Optional[BaseException]] = \
+                [None] * len(user_films_data)
+        else:
+            errors = await self.oltp.write_many(
+                [(message_key(data), data) for data in user_films_data],
+                topic=settings.kafka_view_topic
+            )
+        for data, error in zip(user_films_data, errors):
+            if error is None:
+                await self._remember(data)
+        return errors
 
     async def get_last_timestamp(self, user_id: UUID, film_id: UUID):
         timestamp = await self.olap.get_last_user_film_timestamp(
             user_id,
             film_id
         )
+        if not self.cache:
+            return timestamp
+        written = await self.cache.get((user_id, film_id))
+        if written is None:
+            return timestamp
+        if timestamp is None or written.timestamp > timestamp.timestamp:
+            return written
         return timestamp
 
+    async def get_last_timestamps(
+        self,
+        user_id: UUID,
+        film_ids: List[UUID],
+        offset: int,
+        limit: int
+    ) -> List[UserFilmTimestamp]:
+        # Свои записи сюда не подставляются: кэш не знает порядка всех
+        # фильмов пользователя, и подстановка внутри страницы сдвигала бы
+        # смещения между страницами
+        return await self.olap.get_last_user_timestamps(
+            user_id,
+            film_ids,
+            offset,
+            limit
+        )
+
+    async def _remember(self, user_film_data: UserFilmTimestamp) -> None:
+        if not self.cache:
+            return
+        key = (user_film_data.user_id, user_film_data.film_id)
+        cached = await self.cache.get(key)
+        if cached is None or cached.timestamp <= user_film_data.timestamp:
+            await self.cache.set(key, user_film_data)
+
 
 @lru_cache()
 def get_userfilm_service(
     olap: GenericOlap = Depends(get_olap),
     oltp: GenericOltp = Depends(get_oltp),
+    coalescer: Optional[HeartbeatCoalescer] = Depends(get_coalescer),
+    cache: Optional[GenericCache] = Depends(get_last_position_cache),
 ) -> UserFilmService:
-    return UserFilmService(olap, oltp)
+    return UserFilmService(olap, oltp, coalescer, cache)
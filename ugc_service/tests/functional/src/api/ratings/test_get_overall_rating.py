@@ -22,9 +22,18 @@ def test_correct_request_returns_an_overall_rating_with_code_200(
     total_rating = sum(rating.rating for rating in relevant_ratings)
     avg_rating = round(total_rating / ratings_count, 1)
 
-    ratings = relevant_ratings + [Rating() for _ in range(10)]
-
-    write_to_db(db.ratings, *ratings)
+    # Общий рейтинг ведется при записи оценок, поэтому оценки фильма
+    # создаются через API
+    for rating in relevant_ratings:
+        response = api_request(
+            'post',
+            '/ratings/',
+            user_id=rating.user_id,
+            json={'film_id': str(rating.film_id), 'rating': rating.rating},
+        )
+        assert response.status_code == HTTPStatus.CREATED
+
+    write_to_db(db.ratings, *[Rating() for _ in range(10)])
 
     response = api_request(
         endpoint_method,
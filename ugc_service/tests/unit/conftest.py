@@ -0,0 +1,23 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+# Обязательные настройки сервиса, подключений в юнит-тестах нет
+for name, value in {
+    'PROJECT_NAME': 'UGC_PROJECT',
+    'PROJECT_DESCRIPTION': 'UGC_PROJECT',
+    'BACKOFF_MAX_TIME': '1',
+    'UVICORN_APP_NAME': 'main:app',
+    'UVICORN_HOST': '0.0.0.0',
+    'UVICORN_PORT': '8000',
+    'KAFKA_HOST': 'localhost',
+    'KAFKA_PORT': '9092',
+    'KAFKA_VIEW_TOPIC': 'views',
+    'CLICKHOUSE_HOST': 'localhost',
+    'CLICKHOUSE_PORT': '9000',
+    'AUTHJWT_SECRET_KEY': 'secret',
+    'MONGODB_URI': 'mongodb://localhost:27017',
+    'SENTRY_ENABLED': 'false',
+}.items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,172 @@
+import asyncio
+
+import pytest
+from db import breaker as breaker_module
+from db.breaker import CircuitBreaker, DependencyUnavailable, State
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(breaker_module, 'monotonic', clock)
+    return clock
+
+
+def create_breaker(**kwargs):
+    return CircuitBreaker(
+        'test',
+        deadline=1,
+        failure_rate=0.5,
+        min_calls=4,
+        window=10,
+        open_time=5,
+        errors=(ConnectionError,),
+        **kwargs
+    )
+
+
+async def succeed():
+    return 'ok'
+
+
+async def fail(error=ConnectionError):
+    raise error()
+
+
+def call(breaker, func, *args):
+    try:
+        return asyncio.run(breaker.call(func, *args))
+    except Exception as error:
+        return error
+
+
+def trip(breaker):
+    for _ in range(breaker.min_calls):
+        call(breaker, fail)
+
+
+def test_opens_at_failure_rate_after_min_calls(clock):
+    breaker = create_breaker()
+
+    call(breaker, succeed)
+    call(breaker, fail)
+    call(breaker, succeed)
+    assert breaker.state == State.closed
+
+    call(breaker, fail)
+
+    assert breaker.state == State.open
+
+
+def test_old_failures_leave_window(clock):
+    breaker = create_breaker()
+    call(breaker, fail)
+    call(breaker, fail)
+    clock.now += 10
+    call(breaker, fail)
+    call(breaker, succeed)
+    call(breaker, succeed)
+
+    assert breaker.state == State.closed
+
+
+def test_open_breaker_rejects_without_calling(clock):
+    breaker = create_breaker()
+    trip(breaker)
+    calls = []
+
+    async def tracked():
+        calls.append(1)
+
+    clock.now += 2
+    error = call(breaker, tracked)
+
+    assert isinstance(error, DependencyUnavailable)
+    assert error.retry_after == pytest.approx(3)
+    assert calls == []
+
+
+def test_half_open_success_closes(clock):
+    breaker = create_breaker()
+    trip(breaker)
+    clock.now += 5
+
+    assert call(breaker, succeed) == 'ok'
+
+    assert breaker.state == State.closed
+    assert call(breaker, fail).__class__ is ConnectionError
+    assert breaker.state == State.closed
+
+
+def test_half_open_failure_reopens(clock):
+    breaker = create_breaker()
+    trip(breaker)
+    clock.now += 5
+
+    call(breaker, fail)
+
+    assert breaker.state == State.open
+    clock.now += 4
+    assert isinstance(call(breaker, succeed), DependencyUnavailable)
+
+
+def test_half_open_allows_limited_trials(clock):
+    breaker = create_breaker()
+    trip(breaker)
+    clock.now += 5
+
+    async def main():
+        trial = asyncio.ensure_future(breaker.call(asyncio.sleep, 0.01))
+        await asyncio.sleep(0)
+        with pytest.raises(DependencyUnavailable):
+            await breaker.call(succeed)
+        await trial
+
+    asyncio.run(main())
+
+    assert breaker.state == State.closed
+
+
+def test_unlisted_errors_count_as_success(clock):
+    breaker = create_breaker()
+
+    for _ in range(breaker.min_calls):
+        assert isinstance(call(breaker, fail, ValueError), ValueError)
+
+    assert breaker.state == State.closed
+
+
+def test_deadline_counts_as_failure(clock):
+    breaker = create_breaker()
+    breaker.deadline = 0.01
+
+    for _ in range(breaker.min_calls):
+        error = call(breaker, asyncio.sleep, 1)
+        assert isinstance(error, asyncio.TimeoutError)
+
+    assert breaker.state == State.open
+
+
+def test_cancelled_trial_is_released(clock):
+    breaker = create_breaker()
+    trip(breaker)
+    clock.now += 5
+
+    async def main():
+        trial = asyncio.ensure_future(breaker.call(asyncio.sleep, 0.5))
+        await asyncio.sleep(0)
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+        return await breaker.call(succeed)
+
+    assert asyncio.run(main()) == 'ok'
+    assert breaker.state == State.closed
@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+
+from db.olap import ClickHousePool
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def execute(self, query, params=None):
+        if not self.connection.healthy:
+            raise ConnectionError('closed')
+
+
+class FakeConnection:
+    def __init__(self):
+        self.healthy = True
+        self.closed = False
+
+    def cursor(self, cursor=None):
+        return FakeCursor(self)
+
+    async def close(self):
+        self.closed = True
+
+
+class FakePool(ClickHousePool):
+    def __init__(self, max_size=2, health_check_interval=30):
+        super().__init__('localhost', '9000', 1, max_size, health_check_interval, 1)
+        self.opened = []
+
+    async def _connect(self):
+        self.opened.append(FakeConnection())
+        return self.opened[-1]
+
+
+def test_released_connection_is_reused():
+    pool = FakePool()
+
+    async def run():
+        await pool.open()
+        async with pool.acquire() as first:
+            pass
+        async with pool.acquire() as second:
+            pass
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first is second
+    assert len(pool.opened) == 1
+
+
+def test_connection_is_discarded_after_error():
+    pool = FakePool()
+
+    async def run():
+        with pytest.raises(ValueError):
+            async with pool.acquire():
+                raise ValueError()
+        async with pool.acquire():
+            pass
+
+    asyncio.run(run())
+    assert pool.opened[0].closed
+    assert len(pool.opened) == 2
+
+
+def test_idle_dead_connection_is_replaced():
+    pool = FakePool(health_check_interval=0)
+
+    async def run():
+        await pool.open()
+        pool.opened[0].healthy = False
+        async with pool.acquire() as connection:
+            return connection
+
+    assert asyncio.run(run()) is pool.opened[1]
+    assert pool.opened[0].closed
+
+
+def test_concurrent_queries_are_limited_by_max_size():
+    pool = FakePool(max_size=2)
+    active = []
+    peak = []
+
+    async def query():
+        async with pool.acquire():
+            active.append(1)
+            peak.append(len(active))
+            await asyncio.sleep(0.01)
+            active.pop()
+
+    async def run():
+        await asyncio.gather(*(query() for _ in range(5)))
+
+    asyncio.run(run())
+    assert max(peak) == 2
+    assert len(pool.opened) == 2
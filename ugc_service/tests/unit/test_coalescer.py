@@ -0,0 +1,122 @@
+import asyncio
+from datetime import timedelta
+from uuid import uuid4
+
+from aiokafka.errors import KafkaTimeoutError
+from prometheus_client import REGISTRY
+from services.coalescer import HeartbeatCoalescer
+from test_users_films_batch import FakeOltp
+from testdata import EVENT_TIME, heartbeat
+
+USER, FILM = uuid4(), uuid4()
+
+
+def pair(start_time, end_time, seconds):
+    return heartbeat(USER, FILM, start_time, end_time,
+                     EVENT_TIME + timedelta(seconds=seconds))
+
+
+def flushed(mode, *data, max_keys=100):
+    oltp = FakeOltp()
+    coalescer = HeartbeatCoalescer(oltp, 'views', 1, max_keys, mode)
+
+    async def run():
+        await coalescer.add(list(data))
+        await coalescer.flush()
+
+    asyncio.run(run())
+    return [message for messages, _ in oltp.batches for _, message in messages], coalescer
+
+
+def test_adjacent_intervals_are_merged():
+    sent, coalescer = flushed('merge', pair(0, 10, 0), pair(10, 20, 10), pair(5, 25, 20))
+
+    assert [(d.start_time, d.end_time, d.timestamp) for d in sent] == \
+        [(0, 25, EVENT_TIME + timedelta(seconds=20))]
+    assert coalescer.stats == {'received': 3, 'coalesced': 2, 'emitted': 1}
+
+
+def test_disjoint_intervals_are_both_sent():
+    sent, _ = flushed('merge', pair(0, 10, 0), pair(100, 110, 10))
+
+    assert [(d.start_time, d.end_time) for d in sent] == [(0, 10), (100, 110)]
+
+
+def test_latest_mode_keeps_newest_heartbeat():
+    sent, _ = flushed('latest', pair(100, 110, 10), pair(0, 10, 0))
+
+    assert [(d.start_time, d.end_time) for d in sent] == [(100, 110)]
+
+
+def test_buffer_is_flushed_at_max_keys():
+    oltp = FakeOltp()
+    coalescer = HeartbeatCoalescer(oltp, 'views', 60, 2, 'merge')
+
+    asyncio.run(coalescer.add([heartbeat(), heartbeat()]))
+
+    (messages, _), = oltp.batches
+    assert len(messages) == 2
+
+
+def test_failed_heartbeats_are_merged_with_newer_ones():
+    error = KafkaTimeoutError()
+    oltp = FakeOltp([error])
+    coalescer = HeartbeatCoalescer(oltp, 'views', 60, 100, 'merge')
+
+    async def run():
+        await coalescer.add([pair(0, 10, 0)])
+        await coalescer.flush()
+        await coalescer.add([pair(10, 20, 10)])
+        oltp.errors = None
+        await coalescer.flush()
+
+    asyncio.run(run())
+
+    (_, first), = oltp.batches[-1][0]
+    assert (first.start_time, first.end_time) == (0, 20)
+    assert first.timestamp == EVENT_TIME + timedelta(seconds=10)
+    assert coalescer.stats == {
+        'received': 2, 'coalesced': 1, 'emitted': 1, 'requeued': 1
+    }
+
+
+def test_failed_heartbeats_are_dropped_beyond_max_keys():
+    oltp = FakeOltp([KafkaTimeoutError()] * 2)
+    coalescer = HeartbeatCoalescer(oltp, 'views', 60, 1, 'merge')
+
+    async def run():
+        coalescer._buffer = {('a', 'b'): heartbeat(), ('c', 'd'): heartbeat()}
+        await coalescer.flush()
+
+    asyncio.run(run())
+
+    assert len(coalescer._buffer) == 1
+    assert coalescer.stats == {'requeued': 1, 'failed': 1}
+
+
+def test_failed_heartbeats_are_not_requeued_on_stop():
+    coalescer = HeartbeatCoalescer(
+        FakeOltp([KafkaTimeoutError()]), 'views', 60, 100, 'merge'
+    )
+
+    async def run():
+        await coalescer.add([heartbeat()])
+        await coalescer.stop()
+
+    asyncio.run(run())
+
+    assert coalescer._buffer == {}
+    assert coalescer.stats['failed'] == 1
+
+
+def test_counts_are_exported_to_prometheus():
+    def sample():
+        return REGISTRY.get_sample_value(
+            'ugc_coalescer_heartbeats_total', {'result': 'received'}
+        ) or 0
+
+    before = sample()
+
+    flushed('merge', pair(0, 10, 0), pair(10, 20, 10))
+
+    assert sample() == before + 2
@@ -0,0 +1,108 @@
+import asyncio
+from datetime import timedelta, timezone
+from uuid import uuid4
+
+from db.cache import InMemoryCache
+from services.users_films import UserFilmService
+from test_users_films_batch import FakeOltp
+from testdata import EVENT_TIME, heartbeat
+
+
+class FakeOlap:
+    def __init__(self, timestamp=None):
+        self.timestamp = timestamp
+        self.timestamps = []
+        self.calls = 0
+
+    async def get_last_user_film_timestamp(self, user_id, film_id):
+        self.calls += 1
+        return self.timestamp
+
+    async def get_last_user_timestamps(self, user_id, film_ids, offset, limit):
+        return list(self.timestamps)
+
+
+def naive(moment):
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def test_naive_timestamp_is_utc():
+    data = heartbeat(timestamp=naive(EVENT_TIME))
+
+    assert data.timestamp == EVENT_TIME
+    assert data.timestamp.tzinfo is not None
+
+
+def test_aware_timestamp_is_converted_to_utc():
+    moscow = timezone(timedelta(hours=3))
+
+    data = heartbeat(timestamp=EVENT_TIME.astimezone(moscow))
+
+    assert data.timestamp.utcoffset() == timedelta(0)
+
+
+def test_written_position_is_returned_before_it_reaches_clickhouse():
+    olap = FakeOlap()
+    service = UserFilmService(olap, FakeOltp(), cache=InMemoryCache(10, 60))
+    data = heartbeat()
+
+    async def run():
+        await service.create_user_film_timestamp(data)
+        return await service.get_last_timestamp(data.user_id, data.film_id)
+
+    assert asyncio.run(run()) == data
+    assert olap.calls == 1
+
+
+def test_newer_clickhouse_position_wins_over_written():
+    user_id, film_id = uuid4(), uuid4()
+    written = heartbeat(user_id, film_id, 0, 10, EVENT_TIME)
+    # Позицию новее записал другой воркер
+    stored = heartbeat(user_id, film_id, 10, 20, EVENT_TIME + timedelta(seconds=1))
+    service = UserFilmService(FakeOlap(stored), FakeOltp(), cache=InMemoryCache(10, 60))
+
+    async def run():
+        await service.create_user_film_timestamp(written)
+        return await service.get_last_timestamp(user_id, film_id)
+
+    assert asyncio.run(run()) == stored
+
+
+def test_clickhouse_positions_are_not_cached():
+    stored = heartbeat()
+    cache = InMemoryCache(10, 60)
+    service = UserFilmService(FakeOlap(stored), FakeOltp(), cache=cache)
+
+    asyncio.run(service.get_last_timestamp(stored.user_id, stored.film_id))
+
+    assert asyncio.run(cache.get((stored.user_id, stored.film_id))) is None
+
+
+def test_clickhouse_and_client_timestamps_are_compared():
+    user_id, film_id = uuid4(), uuid4()
+    stored = heartbeat(user_id, film_id, 0, 10, naive(EVENT_TIME))
+    newer = heartbeat(user_id, film_id, 10, 20, EVENT_TIME + timedelta(seconds=1))
+    service = UserFilmService(FakeOlap(stored), FakeOltp(), cache=InMemoryCache(10, 60))
+
+    async def run():
+        await service.get_last_timestamp(user_id, film_id)
+        await service.create_user_film_timestamp(newer)
+        await service.create_user_film_timestamp(stored)
+        return await service.get_last_timestamp(user_id, film_id)
+
+    assert asyncio.run(run()) == newer
+
+
+def test_continue_watching_pages_come_from_clickhouse():
+    user_id, film_id = uuid4(), uuid4()
+    stored = [heartbeat(user_id, film_id, 0, 10, EVENT_TIME)]
+    newer = heartbeat(user_id, film_id, 10, 20, EVENT_TIME + timedelta(seconds=3))
+    olap = FakeOlap()
+    olap.timestamps = stored
+    service = UserFilmService(olap, FakeOltp(), cache=InMemoryCache(10, 60))
+
+    async def run():
+        await service.create_user_film_timestamp(newer)
+        return await service.get_last_timestamps(user_id, [], 0, 20)
+
+    assert asyncio.run(run()) == stored
@@ -0,0 +1,119 @@
+import asyncio
+from uuid import uuid4
+
+import pytest
+
+from db.breaker import CircuitBreaker, State
+from db.olap import UNAVAILABLE_ERRORS, ClickHouseOlap
+from testdata import EVENT_TIME
+
+
+class FakeCursor:
+    def __init__(self, olap):
+        self.olap = olap
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    def set_settings(self, settings):
+        self.olap.settings.append(settings)
+
+    async def execute(self, query, params):
+        self.olap.queries.append((query, params))
+        if self.olap.delay:
+            await asyncio.sleep(self.olap.delay)
+
+    async def fetchall(self):
+        return self.olap.rows
+
+
+class FakeConnection:
+    def __init__(self, olap):
+        self.olap = olap
+
+    def cursor(self, cursor=None):
+        return FakeCursor(self.olap)
+
+    async def close(self):
+        pass
+
+
+class FakeOlap(ClickHouseOlap):
+    def __init__(self, rows=(), delay=0, **kwargs):
+        super().__init__('localhost', '9000', 'default.view_last', **kwargs)
+        self.rows = list(rows)
+        self.delay = delay
+        self.queries = []
+        self.settings = []
+        self._pool._connect = self._connect
+
+    async def _connect(self):
+        return FakeConnection(self)
+
+
+def position_row(film_id=None):
+    return {
+        'user_id': str(uuid4()), 'film_id': str(film_id or uuid4()),
+        'start_time': 0, 'end_time': 10, 'event_time': EVENT_TIME,
+    }
+
+
+def test_user_queries_skip_unused_shards():
+    olap = FakeOlap([position_row()])
+    user_id, film_id = uuid4(), uuid4()
+
+    asyncio.run(olap.get_last_user_film_timestamp(user_id, film_id))
+
+    (query, params), = olap.queries
+    assert 'default.view_last' in query
+    assert params == {'user_id': str(user_id), 'film_id': str(film_id)}
+    assert olap.settings == [{'optimize_skip_unused_shards': 1}]
+
+
+def test_single_shard_reads_can_be_disabled():
+    olap = FakeOlap([], single_shard_reads=False)
+
+    asyncio.run(olap.get_last_user_film_timestamp(uuid4(), uuid4()))
+
+    assert olap.settings == []
+
+
+def test_pool_wait_does_not_trip_breaker():
+    breaker = CircuitBreaker(
+        'ClickHouse', deadline=0.05, min_calls=1, errors=UNAVAILABLE_ERRORS
+    )
+    olap = FakeOlap(
+        [], delay=0.03, pool_max_size=1, coalesce_reads=False, breaker=breaker
+    )
+
+    async def main():
+        # Третий запрос ждет место в пуле дольше дедлайна предохранителя
+        await asyncio.gather(*(
+            olap.get_last_user_film_timestamp(uuid4(), uuid4())
+            for _ in range(3)
+        ))
+
+    asyncio.run(main())
+
+    assert len(olap.queries) == 3
+    assert breaker.state == State.closed
+
+
+def test_connection_error_trips_breaker():
+    breaker = CircuitBreaker(
+        'ClickHouse', deadline=1, min_calls=1, errors=UNAVAILABLE_ERRORS
+    )
+    olap = FakeOlap([], breaker=breaker)
+
+    async def refuse():
+        raise ConnectionRefusedError()
+
+    olap._pool._connect = refuse
+
+    with pytest.raises(ConnectionRefusedError):
+        asyncio.run(olap.get_last_user_film_timestamp(uuid4(), uuid4()))
+
+    assert breaker.state == State.open
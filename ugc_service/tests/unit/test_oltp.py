@@ -0,0 +1,98 @@
+import asyncio
+import logging
+
+import pytest
+from aiokafka.errors import KafkaTimeoutError
+from prometheus_client import REGISTRY
+
+from db.oltp import KafkaOltp
+from testdata import heartbeat
+
+
+class FakeProducer:
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.sent = []
+
+    async def send(self, topic, value, key):
+        self.sent.append((topic, key, value))
+        delivery = asyncio.get_running_loop().create_future()
+        error = self.errors.pop(0) if self.errors else None
+        if error is None:
+            delivery.set_result(None)
+        else:
+            delivery.set_exception(error)
+        return delivery
+
+
+def make_oltp(producer, **kwargs):
+    oltp = KafkaOltp(['localhost:9092'], **kwargs)
+    oltp.producer = producer
+    return oltp
+
+
+def test_messages_are_sent_as_one_batch_with_errors_per_message():
+    error = KafkaTimeoutError()
+    oltp = make_oltp(FakeProducer([None, error]))
+
+    errors = asyncio.run(oltp.write_many(
+        [('a', heartbeat()), ('b', heartbeat())], 'views'
+    ))
+
+    assert errors == [None, error]
+    assert oltp.stats == {'delivered': 1, 'failed': 1}
+
+
+def test_single_write_raises_delivery_error():
+    oltp = make_oltp(FakeProducer([KafkaTimeoutError()]))
+
+    with pytest.raises(KafkaTimeoutError):
+        asyncio.run(oltp.write('a', heartbeat(), 'views'))
+
+
+def test_buffered_writes_are_counted_in_background():
+    producer = FakeProducer([None, KafkaTimeoutError()])
+    oltp = make_oltp(producer, wait_delivery=False)
+
+    async def write():
+        errors = await oltp.write_many([('a', heartbeat()), ('b', heartbeat())], 'views')
+        await asyncio.sleep(0)
+        return errors
+
+    assert asyncio.run(write()) == [None, None]
+    assert oltp.stats == {'buffered': 2, 'delivered': 1, 'failed': 1}
+
+
+def test_background_failures_are_logged_once_per_interval(caplog):
+    producer = FakeProducer([KafkaTimeoutError()] * 3)
+    oltp = make_oltp(producer, wait_delivery=False)
+    messages = [(key, heartbeat()) for key in 'abc']
+
+    async def write():
+        await oltp.write_many(messages, 'views')
+        await asyncio.sleep(0)
+
+    with caplog.at_level(logging.ERROR, logger='db.oltp'):
+        asyncio.run(write())
+
+    assert oltp.stats['failed'] == 3
+    assert len(caplog.records) == 1
+    assert oltp._unlogged_failures == 2
+
+
+def test_delivery_results_are_exported_to_prometheus():
+    def sample(result):
+        return REGISTRY.get_sample_value(
+            'ugc_kafka_messages_total', {'result': result}
+        ) or 0
+
+    before = sample('delivered'), sample('failed')
+    oltp = make_oltp(FakeProducer([None, KafkaTimeoutError()]))
+
+    asyncio.run(oltp.write_many(
+        [('a', heartbeat()), ('b', heartbeat())], 'views'
+    ))
+
+    assert (sample('delivered'), sample('failed')) == (
+        before[0] + 1, before[1] + 1
+    )
@@ -0,0 +1,94 @@
+import asyncio
+from types import SimpleNamespace
+from uuid import uuid4
+
+import pytest
+from services.exceptions import ResourceDoesNotExist
+from services.ratings import MongoDBRatingsService
+
+
+class FakeCollection:
+    def __init__(self, name):
+        self.name = name
+        self.documents = {}
+        self.updates = []
+        self.aggregations = []
+
+    async def find_one(self, query):
+        return self.documents.get(query.get('_id'))
+
+    async def update_one(self, filter, update, upsert=False):
+        self.updates.append((filter, update, upsert))
+        return SimpleNamespace(matched_count=0)
+
+    async def find_one_and_delete(self, query):
+        return {**query, 'rating': 7}
+
+    def aggregate(self, pipeline):
+        self.aggregations.append(pipeline)
+
+
+class FakeClient:
+    def __init__(self):
+        self.films = SimpleNamespace(
+            ratings=FakeCollection('ratings'),
+            rating_stats=FakeCollection('rating_stats'),
+        )
+
+
+def create_service():
+    client = FakeClient()
+    return MongoDBRatingsService(client), client.films
+
+
+def test_new_rating_upserts_stats():
+    service, films = create_service()
+    film_id = uuid4()
+
+    asyncio.run(service.create_rating(film_id, uuid4(), 8))
+
+    assert films.rating_stats.updates == [(
+        {'_id': film_id},
+        {'$inc': {'sum': 8, 'count': 1, 'histogram.8': 1}},
+        True,
+    )]
+
+
+def test_deleted_rating_upserts_stats():
+    service, films = create_service()
+    film_id = uuid4()
+
+    asyncio.run(service.delete_rating(film_id, uuid4()))
+
+    assert films.rating_stats.updates == [(
+        {'_id': film_id},
+        {'$inc': {'sum': -7, 'count': -1, 'histogram.7': -1}},
+        True,
+    )]
+
+
+def test_overall_rating_is_read_from_stats():
+    service, films = create_service()
+    film_id = uuid4()
+    films.rating_stats.documents[film_id] = {
+        '_id': film_id, 'sum': 17, 'count': 2,
+    }
+
+    overall = asyncio.run(service.get_overall_rating(film_id))
+
+    assert overall.avg_rating == 8.5
+    assert overall.ratings_count == 2
+    assert films.ratings.aggregations == []
+
+
+@pytest.mark.parametrize('stats', [None, {'sum': 0, 'count': 0}])
+def test_missing_stats_are_not_rebuilt_on_read(stats):
+    service, films = create_service()
+    film_id = uuid4()
+    if stats:
+        films.rating_stats.documents[film_id] = {'_id': film_id, **stats}
+
+    with pytest.raises(ResourceDoesNotExist):
+        asyncio.run(service.get_overall_rating(film_id))
+
+    assert films.ratings.aggregations == []
@@ -0,0 +1,85 @@
+import asyncio
+from uuid import uuid4
+
+from core.metrics import SINGLE_FLIGHT_CALLS, SINGLE_FLIGHT_SHARED
+from db.olap import SingleFlight
+from test_olap import FakeOlap
+
+
+def test_concurrent_identical_reads_share_one_query():
+    olap = FakeOlap([], delay=0.01)
+    user_id = uuid4()
+
+    async def run():
+        await asyncio.gather(*(
+            olap.get_last_user_timestamps(user_id, [], 0, 20) for _ in range(3)
+        ))
+
+    asyncio.run(run())
+    assert len(olap.queries) == 1
+    assert olap.single_flight.stats == {'calls': 3, 'shared': 2}
+
+
+def test_list_arguments_in_kwargs_are_coalesced():
+    olap = FakeOlap([], delay=0.01)
+    user_id, film_id = uuid4(), uuid4()
+
+    async def run():
+        await asyncio.gather(*(
+            olap.get_last_user_timestamps(
+                user_id, film_ids=[film_id], offset=0, limit=20
+            )
+            for _ in range(2)
+        ))
+
+    asyncio.run(run())
+    assert len(olap.queries) == 1
+
+
+def test_different_arguments_are_not_coalesced():
+    olap = FakeOlap([], delay=0.01)
+
+    async def run():
+        await asyncio.gather(
+            olap.get_last_user_timestamps(uuid4(), [], 0, 20),
+            olap.get_last_user_timestamps(uuid4(), [], 0, 20),
+        )
+
+    asyncio.run(run())
+    assert len(olap.queries) == 2
+
+
+def test_calls_and_shared_are_exported_as_metrics():
+    flight = SingleFlight()
+    calls = SINGLE_FLIGHT_CALLS._value.get()
+    shared = SINGLE_FLIGHT_SHARED._value.get()
+
+    async def query():
+        await asyncio.sleep(0.01)
+        return 1
+
+    async def run():
+        return await asyncio.gather(flight.do('key', query), flight.do('key', query))
+
+    assert asyncio.run(run()) == [1, 1]
+    assert SINGLE_FLIGHT_CALLS._value.get() == calls + 2
+    assert SINGLE_FLIGHT_SHARED._value.get() == shared + 1
+
+
+def test_error_is_shared_and_key_is_released():
+    flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError('boom')
+
+    async def run():
+        results = await asyncio.gather(
+            flight.do('key', fail), flight.do('key', fail),
+            return_exceptions=True
+        )
+        return results, dict(flight._flights)
+
+    results, flights = asyncio.run(run())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert flights == {}
@@ -0,0 +1,90 @@
+import asyncio
+from uuid import uuid4
+
+from aiokafka.errors import KafkaTimeoutError
+
+from api.v1.users_films import create_user_film_timestamps
+from services.users_films import UserFilmService
+from testdata import heartbeat
+
+
+class FakeAuthorize:
+    def __init__(self, subject):
+        self.subject = subject
+
+    async def jwt_required(self):
+        pass
+
+    async def get_jwt_subject(self):
+        return self.subject
+
+
+class FakeOltp:
+    def __init__(self, errors=None):
+        self.errors = errors
+        self.batches = []
+
+    async def write(self, key, data, topic):
+        error, = await self.write_many([(key, data)], topic)
+        if error is not None:
+            raise error
+
+    async def write_many(self, messages, topic):
+        self.batches.append((messages, topic))
+        return self.errors or [None] * len(messages)
+
+
+def test_batch_is_sent_once_and_reported_per_item():
+    user_id = uuid4()
+    error = KafkaTimeoutError()
+    oltp = FakeOltp([None, error])
+    data = [heartbeat(user_id), heartbeat(uuid4()), heartbeat(user_id)]
+
+    response = asyncio.run(create_user_film_timestamps(
+        data,
+        ugc_service=UserFilmService(None, oltp),
+        Authorize=FakeAuthorize(str(user_id)),
+    ))
+
+    (messages, topic), = oltp.batches
+    assert [message for _, message in messages] == [data[0], data[2]]
+    assert topic == 'views'
+    assert response.accepted == 1
+    assert [result.detail for result in response.results] == [
+        'ok',
+        'user_id в токене не соответсвует user_id в timestamp',
+        str(error),
+    ]
+
+
+def test_invalid_item_is_rejected_alone():
+    user_id = uuid4()
+    oltp = FakeOltp()
+    valid = heartbeat(user_id)
+    invalid = {**heartbeat(user_id).dict(), 'film_id': 'not-a-uuid'}
+
+    response = asyncio.run(create_user_film_timestamps(
+        [invalid, valid.dict()],
+        ugc_service=UserFilmService(None, oltp),
+        Authorize=FakeAuthorize(str(user_id)),
+    ))
+
+    (messages, _), = oltp.batches
+    assert [message for _, message in messages] == [valid]
+    assert response.accepted == 1
+    assert response.results[0].detail.startswith('film_id: ')
+    assert response.results[1].detail == 'ok'
+
+
+def test_batch_without_valid_items_is_not_sent():
+    oltp = FakeOltp()
+
+    response = asyncio.run(create_user_film_timestamps(
+        [{'user_id': str(uuid4())}],
+        ugc_service=UserFilmService(None, oltp),
+        Authorize=FakeAuthorize('user'),
+    ))
+
+    assert oltp.batches == []
+    assert response.accepted == 0
+    assert response.results[0].detail != 'ok'
@@ -0,0 +1,20 @@
+from datetime import datetime, timezone
+from uuid import UUID, uuid4
+
+from models.users_films import UserFilmTimestamp
+
+EVENT_TIME = datetime(2023, 6, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def heartbeat(user_id: UUID = None,
+              film_id: UUID = None,
+              start_time: int = 0,
+              end_time: int = 10,
+              timestamp: datetime = EVENT_TIME) -> UserFilmTimestamp:
+    return UserFilmTimestamp(
+        user_id=user_id or uuid4(),
+        film_id=film_id or uuid4(),
+        start_time=start_time,
+        end_time=end_time,
+        timestamp=timestamp,
+    )